@@ -0,0 +1,229 @@
+"""End-to-end turn latency benchmark on the offline ``fake`` LLM provider.
+
+Drives ``bot.handle_message`` through full trainings (/start → "начать" →
+N questions → "завершить") for 1, 100 and 10k concurrent simulated users and
+reports p50/p95/p99 turn latency, time to the first reply (what the user
+perceives when responses are streamed), throughput and memory per active
+session.
+No network access or API keys are needed. The fake provider sees the same
+system prompt and dialogue history as a real one, and each prompt token
+adds ``FAKE_LLM_PROMPT_TOKEN_TIME`` to the call, so later questions of a
+training are slower than the first.
+
+    python benchmarks/turn_latency.py
+    python benchmarks/turn_latency.py --users 1,100 --latency const:0.05 --failure-rate 0.05
+
+Fake provider knobs can also be set via FAKE_LLM_* environment variables
+(see README).
+"""
+
+import argparse
+import asyncio
+import contextlib
+import gc
+import json
+import logging
+import os
+import statistics
+import sys
+import time
+import tracemalloc
+from pathlib import Path
+from typing import Any, Dict, List
+
+ROOT = Path(__file__).resolve().parent.parent
+
+QUESTIONS = (
+    "Сколько металла вы закупаете в месяц?",
+    "С какими сложностями вы сталкиваетесь при поставках?",
+    "Как эти задержки влияют на выполнение ваших заказов?",
+    "Во что вам обходится простой линии?",
+    "Насколько важно для вас сократить эти потери?",
+    "Что даст компании стабильный график поставок?",
+)
+
+
+def _configure_env(args: argparse.Namespace) -> None:
+    """All pipelines on the fake provider, in-memory store; must run before importing bot."""
+    for pipeline in ('RESPONSE', 'FEEDBACK', 'CLASSIFICATION'):
+        os.environ[f'{pipeline}_PRIMARY_PROVIDER'] = 'fake'
+        os.environ[f'{pipeline}_FALLBACK_PROVIDER'] = 'fake'
+    os.environ.setdefault('BOT_TOKEN', 'benchmark')
+    os.environ['USER_STORE'] = 'memory'
+    if args.latency:
+        os.environ['FAKE_LLM_LATENCY'] = args.latency
+    if args.failure_rate is not None:
+        os.environ['FAKE_LLM_FAILURE_RATE'] = str(args.failure_rate)
+    if args.seed is not None:
+        os.environ['FAKE_LLM_SEED'] = str(args.seed)
+
+
+class _Chat:
+    def __init__(self, chat_id: int) -> None:
+        self.id = chat_id
+        self.first_reply_at = None
+
+    async def send_action(self, *args, **kwargs) -> None:
+        pass
+
+
+class _Message:
+    def __init__(self, text: str, chat: _Chat) -> None:
+        self.text = text
+        self.chat = chat
+        self.chat_id = chat.id
+
+    async def reply_text(self, text: str, **kwargs) -> '_Message':
+        if self.chat.first_reply_at is None:
+            self.chat.first_reply_at = time.perf_counter()
+        return _Message(text, self.chat)
+
+    async def edit_text(self, text: str, **kwargs) -> '_Message':
+        self.text = text
+        return self
+
+
+class _User:
+    def __init__(self, user_id: int) -> None:
+        self.id = user_id
+
+
+class _Update:
+    def __init__(self, user_id: int, text: str) -> None:
+        self.effective_user = _User(user_id)
+        self.effective_chat = _Chat(user_id)
+        self.message = _Message(text, self.effective_chat)
+
+
+class _Bot:
+    async def send_chat_action(self, *args, **kwargs) -> None:
+        pass
+
+
+class _Context:
+    bot = _Bot()
+
+
+def _percentile(sorted_values: List[float], pct: float) -> float:
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, max(0, round(pct / 100 * len(sorted_values)) - 1))
+    return sorted_values[index]
+
+
+async def _training(bot, user_id: int, questions: int, latencies: List[float], first_replies: List[float]) -> None:
+    ctx = _Context()
+    await bot.start_command(_Update(user_id, '/start'), ctx)
+    texts = ['начать'] + [QUESTIONS[i % len(QUESTIONS)] for i in range(questions)] + ['завершить']
+    for text in texts:
+        update = _Update(user_id, text)
+        started = time.perf_counter()
+        await bot.handle_message(update, ctx)
+        latencies.append(time.perf_counter() - started)
+        if update.effective_chat.first_reply_at is not None:
+            first_replies.append(update.effective_chat.first_reply_at - started)
+
+
+async def _run_level(bot, users: int, questions: int, id_base: int) -> Dict[str, Any]:
+    latencies: List[float] = []
+    first_replies: List[float] = []
+    calls_before, failures_before = bot.fake_llm.calls, bot.fake_llm.failures
+    prompt_tokens_before = bot.fake_llm.prompt_tokens
+    started = time.perf_counter()
+    await asyncio.gather(*(_training(bot, id_base + i, questions, latencies, first_replies) for i in range(users)))
+    wall = time.perf_counter() - started
+    latencies.sort()
+    first_replies.sort()
+    return {
+        'users': users,
+        'turns': len(latencies),
+        'wall_sec': round(wall, 3),
+        'turns_per_sec': round(len(latencies) / wall, 1) if wall > 0 else 0.0,
+        'p50_ms': round(_percentile(latencies, 50) * 1000, 1),
+        'p95_ms': round(_percentile(latencies, 95) * 1000, 1),
+        'p99_ms': round(_percentile(latencies, 99) * 1000, 1),
+        'mean_ms': round(statistics.fmean(latencies) * 1000, 1) if latencies else 0.0,
+        'first_reply_p50_ms': round(_percentile(first_replies, 50) * 1000, 1),
+        'first_reply_p95_ms': round(_percentile(first_replies, 95) * 1000, 1),
+        'llm_calls': bot.fake_llm.calls - calls_before,
+        'llm_failures': bot.fake_llm.failures - failures_before,
+        'llm_prompt_tokens': bot.fake_llm.prompt_tokens - prompt_tokens_before,
+    }
+
+
+async def _session_memory(bot, users: int, id_base: int) -> float:
+    """Bytes retained per user with an active training (case generated, one answered question)."""
+    ctx = _Context()
+    bot.user_data.clear()
+    gc.collect()
+    tracemalloc.start()
+    baseline = tracemalloc.get_traced_memory()[0]
+    for i in range(users):
+        await bot.start_command(_Update(id_base + i, '/start'), ctx)
+        await bot.handle_message(_Update(id_base + i, 'начать'), ctx)
+    await asyncio.gather(*(bot.handle_message(_Update(id_base + i, QUESTIONS[0]), ctx) for i in range(users)))
+    gc.collect()
+    retained = tracemalloc.get_traced_memory()[0] - baseline
+    tracemalloc.stop()
+    return retained / users
+
+
+async def _main(args: argparse.Namespace, out) -> List[Dict[str, Any]]:
+    import bot
+
+    bot._ensure_scenario_loaded()
+    bot.user_store.start()
+    results = []
+    try:
+        for level, users in enumerate(args.users):
+            bot.user_data.clear()
+            result = await _run_level(bot, users, args.questions, id_base=(level + 1) * 10_000_000)
+            if args.memory:
+                result['bytes_per_session'] = round(
+                    await _session_memory(bot, users, id_base=(level + 1) * 10_000_000 + 5_000_000)
+                )
+            result['session_cache'] = bot.user_data.stats()
+            if bot.analysis_cache is not None:
+                result['analysis_cache'] = bot.analysis_cache.stats()
+            results.append(result)
+            print(
+                f"users={users:>6}  turns={result['turns']:>7}  {result['turns_per_sec']:>8} turns/s  "
+                f"p50={result['p50_ms']}ms  p95={result['p95_ms']}ms  p99={result['p99_ms']}ms  "
+                f"first_reply p50={result['first_reply_p50_ms']}ms p95={result['first_reply_p95_ms']}ms  "
+                f"mem/session={result.get('bytes_per_session', '-')} B  "
+                f"llm_calls={result['llm_calls']} failures={result['llm_failures']} prompt_tokens={result['llm_prompt_tokens']}  "
+                f"analysis_cache_hit_rate={result.get('analysis_cache', {}).get('hit_rate', '-')}",
+                file=out,
+                flush=True,
+            )
+    finally:
+        await bot.user_store.stop()
+    return results
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--users', default='1,100,10000', help='comma-separated concurrent user counts')
+    parser.add_argument('--questions', type=int, default=6, help='questions per training')
+    parser.add_argument('--latency', help="fake provider latency spec, e.g. 'lognormal:0.4,0.5'")
+    parser.add_argument('--failure-rate', type=float, help='fake provider failure probability per call')
+    parser.add_argument('--seed', type=int, help='fake provider RNG seed')
+    parser.add_argument('--no-memory', dest='memory', action='store_false', help='skip the tracemalloc pass')
+    parser.add_argument('--json', help='write results to this JSON file')
+    args = parser.parse_args()
+    args.users = [int(u) for u in args.users.split(',') if u.strip()]
+
+    _configure_env(args)
+    sys.path.insert(0, str(ROOT))
+    os.chdir(ROOT)
+    logging.disable(logging.WARNING)
+    out = sys.stdout
+    # bot печатает конфигурацию и каждый /start в stdout — глушим, чтобы не мешать отчёту
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        results = asyncio.run(_main(args, out))
+    if args.json:
+        Path(args.json).write_text(json.dumps(results, ensure_ascii=False, indent=2), encoding='utf-8')
+
+
+if __name__ == '__main__':
+    main()
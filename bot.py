@@ -1,18 +1,41 @@
 import os
+import asyncio
 import logging
-from typing import Dict, Any, Optional, List
+from typing import Dict, Any, Optional, List, Tuple, Union, Iterable, Callable, Awaitable
+from collections import ChainMap
 from datetime import datetime
 from dotenv import load_dotenv
 from telegram import Update
-from telegram.ext import Application, CommandHandler, MessageHandler, filters, ContextTypes
+from telegram.constants import ChatAction
+from telegram.ext import Application, CommandHandler, MessageHandler, TypeHandler, filters, ContextTypes
 import time
-import openai
-import httpx
+import math
+import re
+import signal
 
 from engine.scenario_loader import ScenarioLoader, ScenarioValidationError
 from engine.question_analyzer import QuestionAnalyzer
 from engine.report_generator import ReportGenerator
 from engine.case_generator import CaseGenerator
+from engine.llm_clients import LLMClientRegistry, ProviderPoolConfig, iter_sse_json
+from engine.turn_pipeline import Stage, run_stages
+from engine.user_store import UserStore, MemoryUserStore, SQLiteUserStore, WriteBehindStore
+from engine.session_cache import SessionCache
+from engine.user_state import QuestionTypeIndex, Session, UserRecord, UserStats
+from engine.achievements import AchievementEngine
+from engine.levels import LevelIndex
+from engine.fake_llm import FakeLLMProvider
+from engine.analysis_cache import AnalysisCache
+from engine.local_classifier import CharNgramClassifier, LabelLog
+from engine.dialogue import DialogueLimits, estimate_tokens
+from engine.stream_renderer import ProgressiveMessage
+from engine.chat_action import ChatActionKeeper
+from engine.turn_serializer import TurnSerializer
+from engine.circuit_breaker import BreakerConfig, BreakerRegistry, Permit, backoff_delay
+from engine.hedging import HedgeBudget, LatencyTracker
+from engine.rate_limiter import RateLimit, RateLimiterRegistry
+from engine.degradation import DegradationConfig, DegradationPolicy
+from engine.webhook_server import WebhookServer
 
 # Загрузка переменных окружения
 load_dotenv()
@@ -26,6 +49,17 @@ BOT_TOKEN = os.getenv('BOT_TOKEN')
 OPENAI_API_KEY = os.getenv('OPENAI_API_KEY')
 SCENARIO_PATH = os.getenv('SCENARIO_PATH', 'scenarios/spin_sales/config.json')
 
+# Получение апдейтов: webhook (HTTP-сервер на PORT, по умолчанию при заданном WEBHOOK_URL) или polling.
+# /health, /ready и /metrics обслуживаются тем же сервером в обоих режимах
+PORT = int(os.getenv('PORT', '8080'))
+WEBHOOK_URL = os.getenv('WEBHOOK_URL', '').rstrip('/')
+BOT_MODE = os.getenv('BOT_MODE', 'webhook' if WEBHOOK_URL else 'polling').lower()
+WEBHOOK_PATH = os.getenv('WEBHOOK_PATH', '/telegram')
+# Секрет проверяется в заголовке каждого апдейта; в режиме webhook обязателен и одинаков на всех машинах
+WEBHOOK_SECRET = os.getenv('WEBHOOK_SECRET', '')
+# Токен для /metrics (Authorization: Bearer ...); по умолчанию — WEBHOOK_SECRET, без обоих /metrics отключён
+METRICS_TOKEN = os.getenv('METRICS_TOKEN') or WEBHOOK_SECRET
+
 # LLM config
 PRIMARY_MODEL = os.getenv('PRIMARY_MODEL', 'gpt-4o-mini')
 FALLBACK_MODEL = os.getenv('FALLBACK_MODEL', 'gpt-5-mini')
@@ -51,6 +85,146 @@ CLASSIFICATION_PRIMARY_MODEL = os.getenv('CLASSIFICATION_PRIMARY_MODEL', PRIMARY
 CLASSIFICATION_FALLBACK_PROVIDER = os.getenv('CLASSIFICATION_FALLBACK_PROVIDER', 'openai')
 CLASSIFICATION_FALLBACK_MODEL = os.getenv('CLASSIFICATION_FALLBACK_MODEL', FALLBACK_MODEL)
 
+# Режим анализа вопроса: 'separate' — два вызова (классификация + контекст), 'combined' — один JSON-вызов
+QUESTION_ANALYSIS_MODE = os.getenv('QUESTION_ANALYSIS_MODE', 'separate').lower()
+
+
+# Деградация под нагрузкой: пока исчерпан бюджет задержки ходов (доля ходов дольше TURN_LATENCY_BUDGET_SEC
+# больше 1 - TURN_SLO_TARGET) или бюджет ошибок LLM, классификация и проверка контекста идут без LLM
+# (кэш, локальная модель, ключевые слова); к LLM обращается только ответ клиента
+DEGRADE_ENABLED = os.getenv('DEGRADE_ENABLED', 'true').lower() in ('1', 'true', 'yes')
+DEGRADE_CONFIG = DegradationConfig(
+    turn_budget_sec=float(os.getenv('TURN_LATENCY_BUDGET_SEC', '8')),
+    slo_target=float(os.getenv('TURN_SLO_TARGET', '0.9')),
+    error_budget=float(os.getenv('LLM_ERROR_BUDGET', '0.2')),
+    window_sec=float(os.getenv('DEGRADE_WINDOW_SEC', '60')),
+    min_samples=int(os.getenv('DEGRADE_MIN_SAMPLES', '10')),
+    hold_sec=float(os.getenv('DEGRADE_HOLD_SEC', '30')),
+)
+
+LLM_ERROR_MESSAGE = "Произошла ошибка при генерации ответа. Попробуйте ещё раз позже."
+
+# Пауза между повторами основного провайдера: экспонента с джиттером, не больше максимума
+LLM_RETRY_BACKOFF_SEC = float(os.getenv('LLM_RETRY_BACKOFF_SEC', '0.5'))
+LLM_RETRY_BACKOFF_MAX_SEC = float(os.getenv('LLM_RETRY_BACKOFF_MAX_SEC', '8'))
+
+# Таймауты стадий хода (классификация, ответ клиента, проверка контекста выполняются параллельно).
+# По умолчанию стадия дожидается всей цепочки call_llm: попытки основного провайдера с паузами
+# и резервный провайдер — таймаут стадии не должен отрезать fallback-модель
+LLM_CHAIN_TIMEOUT_SEC = (LLM_MAX_RETRIES + 2) * LLM_TIMEOUT_SEC + LLM_MAX_RETRIES * LLM_RETRY_BACKOFF_MAX_SEC
+CLASSIFICATION_STAGE_TIMEOUT_SEC = float(os.getenv('CLASSIFICATION_STAGE_TIMEOUT_SEC', str(LLM_CHAIN_TIMEOUT_SEC)))
+CONTEXT_STAGE_TIMEOUT_SEC = float(os.getenv('CONTEXT_STAGE_TIMEOUT_SEC', str(LLM_CHAIN_TIMEOUT_SEC)))
+RESPONSE_STAGE_TIMEOUT_SEC = float(os.getenv('RESPONSE_STAGE_TIMEOUT_SEC', str(LLM_CHAIN_TIMEOUT_SEC)))
+
+# Предохранитель на каждый провайдер/модель (общий для всех конвейеров): размыкается по доле ошибок
+# или медленных вызовов в скользящем окне, затем пробные вызовы после паузы с экспоненциальным ростом
+LLM_BREAKER_ENABLED = os.getenv('LLM_BREAKER_ENABLED', 'true').lower() in ('1', 'true', 'yes')
+LLM_BREAKER_CONFIG = BreakerConfig(
+    window_sec=float(os.getenv('LLM_BREAKER_WINDOW_SEC', '60')),
+    min_calls=int(os.getenv('LLM_BREAKER_MIN_CALLS', '20')),
+    error_rate=float(os.getenv('LLM_BREAKER_ERROR_RATE', '0.5')),
+    slow_call_sec=float(os.getenv('LLM_BREAKER_SLOW_CALL_SEC', str(LLM_TIMEOUT_SEC))),
+    slow_rate=float(os.getenv('LLM_BREAKER_SLOW_RATE', '0.5')),
+    open_sec=float(os.getenv('LLM_BREAKER_OPEN_SEC', '5')),
+    max_open_sec=float(os.getenv('LLM_BREAKER_MAX_OPEN_SEC', '120')),
+    half_open_probes=int(os.getenv('LLM_BREAKER_HALF_OPEN_PROBES', '1')),
+)
+
+# Хеджирование: если основной провайдер не ответил за перцентиль своей задержки, тот же запрос
+# уходит на резервный, побеждает первый ответ. Включается по конвейерам (напр. "response"),
+# доля хеджированных запросов ограничена LLM_HEDGE_MAX_RATE
+LLM_HEDGE_PIPELINES = frozenset(
+    p.strip() for p in os.getenv('LLM_HEDGE_PIPELINES', '').split(',') if p.strip()
+)
+LLM_HEDGE_PERCENTILE = float(os.getenv('LLM_HEDGE_PERCENTILE', '95'))
+LLM_HEDGE_DELAY_SEC = float(os.getenv('LLM_HEDGE_DELAY_SEC', '2.0'))
+LLM_HEDGE_MAX_RATE = float(os.getenv('LLM_HEDGE_MAX_RATE', '0.1'))
+
+# Потоковые ответы: сообщение отправляется с первыми токенами и дописывается правками (не чаще интервала)
+LLM_STREAMING = os.getenv('LLM_STREAMING', 'true').lower() in ('1', 'true', 'yes')
+STREAM_EDIT_INTERVAL_SEC = float(os.getenv('STREAM_EDIT_INTERVAL_SEC', '1.0'))
+# Индикатор «печатает…» обновляется, пока идёт ход (Telegram держит его ~5 с); 0 — выключен
+TYPING_REFRESH_SEC = float(os.getenv('TYPING_REFRESH_SEC', '4'))
+
+# Ходы одного пользователя выполняются строго по одному; сообщения во время хода:
+# queue — ждут очереди, drop — отклоняются, merge — быстрые вопросы подряд объединяются в один ход
+TURN_POLICY = os.getenv('TURN_POLICY', 'queue').lower()
+TURN_MAX_PENDING = int(os.getenv('TURN_MAX_PENDING', '5'))
+TURN_BUSY_MESSAGE = "⏳ Подождите, ответ на предыдущее сообщение ещё готовится."
+# Параллельная обработка апдейтов разных пользователей: true/false или число одновременных апдейтов
+CONCURRENT_UPDATES = os.getenv('CONCURRENT_UPDATES', 'true').lower()
+
+# Общая для всех кейсов часть промпта клиента — стоит первой, чтобы префикс кэшировался провайдером
+CLIENT_RESPONSE_PRINCIPLES = (
+    "Вы клиент из кейса, параметры которого приведены ниже. Отвечайте на вопрос продавца.\n\n"
+    "ПРИНЦИПЫ ОТВЕТОВ:\n"
+    "- Отвечайте нейтрально и сдержанно, как реальный занятой руководитель\n"
+    "- НЕ раскрывайте проблемы сами - только на конкретные SPIN-вопросы\n"
+    "- На ситуационные вопросы: давайте факты и цифры\n"
+    "- На проблемные: признавайте проблемы, но не драматизируйте\n"
+    "- На извлекающие: раскрывайте последствия постепенно, намёками\n"
+    "- На направляющие: подтверждайте ценность предложенных решений\n\n"
+    "СТИЛЬ: Короткие реалистичные ответы (2-4 предложения), профессиональный тон."
+)
+
+# Пулы HTTP-соединений к провайдерам LLM (общие значения + переопределения OPENAI_*/ANTHROPIC_*)
+LLM_MAX_CONNECTIONS = int(os.getenv('LLM_MAX_CONNECTIONS', '20'))
+LLM_MAX_KEEPALIVE_CONNECTIONS = int(os.getenv('LLM_MAX_KEEPALIVE_CONNECTIONS', '10'))
+LLM_KEEPALIVE_EXPIRY_SEC = float(os.getenv('LLM_KEEPALIVE_EXPIRY_SEC', '60'))
+LLM_HTTP2 = os.getenv('LLM_HTTP2', 'true').lower() in ('1', 'true', 'yes')
+
+# Клиентский лимит запросов/мин и оценочных токенов/мин на каждую модель провайдера (0 — без лимита).
+# Вызовы ждут свободной ёмкости в очереди по приоритету конвейера вместо 429 от провайдера
+LLM_RATE_BURST_SEC = float(os.getenv('LLM_RATE_BURST_SEC', '10'))
+LLM_PRIORITY = {'response': 0, 'classification': 1, 'context': 1, 'analysis': 1, 'feedback': 2}
+
+def _rate_limit(prefix: str, rpm: str, tpm: str) -> RateLimit:
+    return RateLimit(
+        requests_per_min=float(os.getenv(f'{prefix}_RPM', rpm)),
+        tokens_per_min=float(os.getenv(f'{prefix}_TPM', tpm)),
+        burst_sec=LLM_RATE_BURST_SEC,
+    )
+
+def _pool_config(prefix: str) -> ProviderPoolConfig:
+    return ProviderPoolConfig(
+        max_connections=int(os.getenv(f'{prefix}_MAX_CONNECTIONS', str(LLM_MAX_CONNECTIONS))),
+        max_keepalive_connections=int(os.getenv(f'{prefix}_MAX_KEEPALIVE_CONNECTIONS', str(LLM_MAX_KEEPALIVE_CONNECTIONS))),
+        keepalive_expiry=float(os.getenv(f'{prefix}_KEEPALIVE_EXPIRY_SEC', str(LLM_KEEPALIVE_EXPIRY_SEC))),
+        http2=os.getenv(f'{prefix}_HTTP2', str(LLM_HTTP2)).lower() in ('1', 'true', 'yes'),
+        timeout=LLM_TIMEOUT_SEC,
+    )
+
+# Постоянное хранилище пользователей (sqlite | memory) с отложенной записью
+USER_STORE = os.getenv('USER_STORE', 'sqlite').lower()
+USER_STORE_PATH = os.getenv('USER_STORE_PATH', 'data/users.sqlite3')
+USER_STORE_FLUSH_SEC = float(os.getenv('USER_STORE_FLUSH_SEC', '2'))
+USER_STORE_MAX_PENDING = int(os.getenv('USER_STORE_MAX_PENDING', '500'))
+USER_STORE_WARM_LIMIT = int(os.getenv('USER_STORE_WARM_LIMIT', '1000'))
+
+# Ограниченный кэш пользователей в памяти (LRU + TTL простоя); вытесненные записи сохраняются в хранилище
+SESSION_CACHE_MAX_ENTRIES = int(os.getenv('SESSION_CACHE_MAX_ENTRIES', '5000'))
+SESSION_CACHE_IDLE_TTL_SEC = float(os.getenv('SESSION_CACHE_IDLE_TTL_SEC', '3600'))
+SESSION_SPILL_ON_EVICT = os.getenv('SESSION_SPILL_ON_EVICT', 'true').lower() in ('1', 'true', 'yes')
+
+# Кэш результатов классификации/проверки контекста (точный + по схожести триграмм), опционально на диске
+CLASSIFICATION_CACHE_ENABLED = os.getenv('CLASSIFICATION_CACHE_ENABLED', 'true').lower() in ('1', 'true', 'yes')
+CLASSIFICATION_CACHE_MAX_ENTRIES = int(os.getenv('CLASSIFICATION_CACHE_MAX_ENTRIES', '20000'))
+CLASSIFICATION_CACHE_TTL_SEC = float(os.getenv('CLASSIFICATION_CACHE_TTL_SEC', str(7 * 24 * 3600)))
+CLASSIFICATION_CACHE_SIMILARITY = float(os.getenv('CLASSIFICATION_CACHE_SIMILARITY', '0.85'))
+CLASSIFICATION_CACHE_PATH = os.getenv('CLASSIFICATION_CACHE_PATH', '')
+
+# Локальный классификатор перед LLM (модель обучается из журнала меток: python -m engine.local_classifier)
+LOCAL_CLASSIFIER_PATH = os.getenv('LOCAL_CLASSIFIER_PATH', '')
+LOCAL_CLASSIFIER_THRESHOLD = float(os.getenv('LOCAL_CLASSIFIER_THRESHOLD', '0.9'))
+CLASSIFICATION_LOG_PATH = os.getenv('CLASSIFICATION_LOG_PATH', '')
+
+# Память диалога клиента: последние ходы дословно (не больше N и бюджета токенов), старые — в резюме
+DIALOGUE_LIMITS = DialogueLimits(
+    max_turns=int(os.getenv('DIALOGUE_MAX_TURNS', '6')),
+    token_budget=int(os.getenv('DIALOGUE_TOKEN_BUDGET', '1200')),
+    summary_budget=int(os.getenv('DIALOGUE_SUMMARY_TOKENS', '300')),
+)
+
 # Отладочная информация
 print(f"BOT_TOKEN: {BOT_TOKEN}")
 print(f"OPENAI_API_KEY: {OPENAI_API_KEY[:20] if OPENAI_API_KEY else 'None'}...")
@@ -60,138 +234,203 @@ print(f"FALLBACK_MODEL: {FALLBACK_MODEL}")
 print(f"RESP PIPE: {RESPONSE_PRIMARY_PROVIDER}:{RESPONSE_PRIMARY_MODEL} -> {RESPONSE_FALLBACK_PROVIDER}:{RESPONSE_FALLBACK_MODEL}")
 print(f"FDBK PIPE: {FEEDBACK_PRIMARY_PROVIDER}:{FEEDBACK_PRIMARY_MODEL} -> {FEEDBACK_FALLBACK_PROVIDER}:{FEEDBACK_FALLBACK_MODEL}")
 print(f"CLSF PIPE: {CLASSIFICATION_PRIMARY_PROVIDER}:{CLASSIFICATION_PRIMARY_MODEL} -> {CLASSIFICATION_FALLBACK_PROVIDER}:{CLASSIFICATION_FALLBACK_MODEL}")
+print(f"USER_STORE: {USER_STORE} ({USER_STORE_PATH})")
+
+def _create_user_store() -> UserStore:
+    if USER_STORE == 'sqlite':
+        try:
+            return SQLiteUserStore(USER_STORE_PATH)
+        except Exception:
+            logger.exception("Не удалось открыть SQLite-хранилище, данные будут храниться только в памяти")
+    return MemoryUserStore()
 
-# Хранилище данных пользователей
-user_data: Dict[int, Dict[str, Any]] = {}
+def _on_user_evicted(user_id: int, data: Dict[str, Any]) -> None:
+    if SESSION_SPILL_ON_EVICT:
+        user_store.mark_dirty(user_id, data)
+
+# Хранилище данных пользователей: рабочие данные в ограниченном кэше, сохранение — отложенной записью
+user_store = WriteBehindStore(_create_user_store(), USER_STORE_FLUSH_SEC, USER_STORE_MAX_PENDING)
+user_data = SessionCache(SESSION_CACHE_MAX_ENTRIES, SESSION_CACHE_IDLE_TTL_SEC, on_evict=_on_user_evicted)
 
 # Глобальные объекты сценария и движка
 scenario_loader = ScenarioLoader()
-question_analyzer = QuestionAnalyzer()
+analysis_cache: Optional[AnalysisCache] = AnalysisCache(
+    CLASSIFICATION_CACHE_MAX_ENTRIES,
+    CLASSIFICATION_CACHE_TTL_SEC,
+    CLASSIFICATION_CACHE_SIMILARITY,
+    CLASSIFICATION_CACHE_PATH or None,
+) if CLASSIFICATION_CACHE_ENABLED else None
+
+def _load_local_classifier() -> Optional[CharNgramClassifier]:
+    if not LOCAL_CLASSIFIER_PATH:
+        return None
+    try:
+        model = CharNgramClassifier.load(LOCAL_CLASSIFIER_PATH)
+        logger.info(f"Локальный классификатор загружен: {LOCAL_CLASSIFIER_PATH}, порог {LOCAL_CLASSIFIER_THRESHOLD}")
+        return model
+    except Exception as e:
+        logger.warning(f"Локальный классификатор не загружен ({LOCAL_CLASSIFIER_PATH}): {e}")
+        return None
+
+question_analyzer = QuestionAnalyzer(
+    cache=analysis_cache,
+    local_classifier=_load_local_classifier(),
+    local_threshold=LOCAL_CLASSIFIER_THRESHOLD,
+    label_log=LabelLog(CLASSIFICATION_LOG_PATH) if CLASSIFICATION_LOG_PATH else None,
+)
 report_generator = ReportGenerator()
 case_generator: Optional[CaseGenerator] = None
 scenario_config: Optional[Dict[str, Any]] = None
+question_type_index: Optional[QuestionTypeIndex] = None
+achievement_engine: Optional[AchievementEngine] = None
+level_index: Optional[LevelIndex] = None
+
+# Поля, которые меняются при завершении тренировки (входы правил достижений)
+TRAINING_RESULT_FIELDS = (
+    'total_trainings', 'total_questions', 'best_score', 'total_xp', 'current_level', 'master_streak',
+    'last_contextual_questions', 'total_contextual_questions', 'last_training_date',
+    'question_count', 'contextual_questions', 'clarity_level', 'per_type_counts',
+)
+
+# Долгоживущие клиенты провайдеров LLM (создаются при старте Application, закрываются при остановке)
+llm_clients = LLMClientRegistry(
+    {'openai': _pool_config('OPENAI'), 'anthropic': _pool_config('ANTHROPIC')},
+    openai_api_key=OPENAI_API_KEY,
+)
+
+# Офлайн-заглушка LLM (provider=fake): без сети, с настраиваемыми задержками и отказами
+fake_llm = FakeLLMProvider.from_env()
+llm_breakers = BreakerRegistry(LLM_BREAKER_CONFIG, enabled=LLM_BREAKER_ENABLED)
+llm_latency = LatencyTracker()
+hedge_budget = HedgeBudget(max_rate=LLM_HEDGE_MAX_RATE)
+degradation = DegradationPolicy(DEGRADE_CONFIG, enabled=DEGRADE_ENABLED)
+llm_rate_limits = RateLimiterRegistry({
+    'openai': _rate_limit('OPENAI', '500', '200000'),
+    'anthropic': _rate_limit('ANTHROPIC', '50', '50000'),
+    'fake': _rate_limit('FAKE_LLM', '0', '0'),
+})
+
+# Сериализация ходов по пользователю (ключ — user_id); управляющие слова не объединяются с вопросами
+CONTROL_WORDS = ('начать', 'старт', 'завершить', 'да')
+turn_serializer = TurnSerializer(
+    policy=TURN_POLICY,
+    max_pending=TURN_MAX_PENDING,
+    mergeable=lambda text: text.strip().lower() not in CONTROL_WORDS,
+)
+
+def _new_user_data() -> UserRecord:
+    """Начальные session/stats нового пользователя."""
+    _ensure_scenario_loaded()
+    return UserRecord.new(question_type_index, DIALOGUE_LIMITS)
 
-def get_user_data(user_id: int) -> Dict[str, Any]:
+def _with_defaults(u: Union[UserRecord, Dict[str, Any]]) -> UserRecord:
+    """Приведение сохранённой записи (dict из хранилища, возможно старого формата) к UserRecord."""
+    if isinstance(u, UserRecord):
+        return u
+    _ensure_scenario_loaded()
+    return UserRecord.from_dict(u, question_type_index, DIALOGUE_LIMITS)
+
+async def _prefetch_user_data(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Загрузка записи пользователя в кэш сессий до обработчиков апдейта (чтение диска — в потоке)."""
+    user = update.effective_user
+    if user is None or user.id in user_data:
+        return
+    u = await user_store.load_async(user.id)
+    if u is not None:
+        user_data.setdefault(user.id, _with_defaults(u))
+
+def _find_user_data(user_id: int) -> Optional[UserRecord]:
+    """Данные пользователя из памяти или хранилища; None, если пользователь неизвестен."""
+    u = user_data.get(user_id)
+    if u is None:
+        # Обычно запись уже подгружена _prefetch_user_data; синхронное чтение — страховка
+        # на случай вытеснения из кэша между подгрузкой и обработчиком
+        u = user_store.load(user_id)
+        if u is not None:
+            u = user_data[user_id] = _with_defaults(u)
+    return u
+
+def get_user_data(user_id: int) -> UserRecord:
     """Получение данных пользователя c инициализацией session/stats."""
-    if user_id not in user_data:
-        user_data[user_id] = {
-            'session': {
-                'question_count': 0,
-                'clarity_level': 0,
-                'per_type_counts': {},
-                'client_case': '',
-                'case_data': None,  # Сохраним данные кейса
-                'last_question_type': '',
-                'chat_state': 'new',
-                'contextual_questions': 0,
-                'last_client_response': '',
-                'context_streak': 0
-            },
-            'stats': {
-                'total_trainings': 0,
-                'total_questions': 0,
-                'best_score': 0,
-                'total_xp': 0,
-                'current_level': 1,
-                'badges_earned': [],
-                'achievements_unlocked': [],
-                'master_streak': 0,
-                'total_contextual_questions': 0,
-                'last_contextual_questions': 0,
-                'last_training_date': None,
-                'recent_cases': []  # Хеши последних 5 кейсов
-            }
-        }
-    return user_data[user_id]
+    u = _find_user_data(user_id)
+    if u is None:
+        u = user_data[user_id] = _new_user_data()
+    return u
+
+def save_user_data(user_id: int, u: UserRecord) -> None:
+    """Отметить данные пользователя для фоновой записи в хранилище (без ожидания диска)."""
+    user_store.mark_dirty(user_id, u)
+    user_data.evict_expired()
 
 def reset_session(user_id: int) -> None:
     """Очистка данных текущей сессии и возврат в ожидание старта."""
     u = get_user_data(user_id)
-    cfg = _ensure_scenario_loaded()
-    u['session'] = {
-        'question_count': 0,
-        'clarity_level': 0,
-        'per_type_counts': {t['id']: 0 for t in cfg['question_types']},
-        'client_case': '',
-        'case_data': None,  # Очищаем данные кейса
-        'last_question_type': '',
-        'chat_state': 'waiting_start'
-    }
+    _ensure_scenario_loaded()
+    u.session = Session(question_type_index, chat_state='waiting_start', dialogue_limits=DIALOGUE_LIMITS)
+    save_user_data(user_id, u)
+
+def update_stats(user_id: int, session_score: int) -> List[Dict[str, Any]]:
+    """Обновление общей статистики пользователя на основе завершенной сессии.
 
-def update_stats(user_id: int, session_score: int) -> None:
-    """Обновление общей статистики пользователя на основе завершенной сессии."""
+    Возвращает достижения, разблокированные этой сессией (для финального отчёта).
+    """
     u = get_user_data(user_id)
-    s = u['session']
-    st = u['stats']
+    s = u.session
+    st = u.stats
+    session_score = int(session_score)
     
     # Базовая статистика
-    st['total_trainings'] += 1
-    st['total_questions'] += int(s.get('question_count', 0))
-    st['best_score'] = max(int(st.get('best_score', 0)), int(session_score))
-    st['last_training_date'] = datetime.now().isoformat()
+    st.total_trainings += 1
+    st.total_questions += s.question_count
+    st.best_score = max(st.best_score, session_score)
+    st.last_training_date = datetime.now().isoformat()
     
     # XP и уровень
-    st['total_xp'] = int(st.get('total_xp', 0)) + int(session_score)
-    cfg = _ensure_scenario_loaded()
-    old_level = int(st.get('current_level', 1))
-    new_level = _calculate_level(int(st['total_xp']), cfg.get('ranking', {}).get('levels', []))
-    st['current_level'] = new_level
+    st.total_xp += session_score
+    _ensure_scenario_loaded()
+    old_level = st.current_level
+    new_level = level_index.level_for_xp(st.total_xp)
+    st.current_level = new_level
     
     # Серия Маэстро
-    if int(session_score) >= 221:
-        st['master_streak'] = int(st.get('master_streak', 0)) + 1
+    if session_score >= 221:
+        st.master_streak += 1
     else:
-        st['master_streak'] = 0
+        st.master_streak = 0
     
     # Контекстуальные вопросы: обновляем общие показатели
-    last_contextual = int(s.get('contextual_questions', 0))
-    st['last_contextual_questions'] = last_contextual
-    st['total_contextual_questions'] = int(st.get('total_contextual_questions', 0)) + last_contextual
+    last_contextual = s.contextual_questions
+    st.last_contextual_questions = last_contextual
+    st.total_contextual_questions += last_contextual
 
     # Достижения (включая Active Listening)
-    _check_achievements(user_id)
+    newly_unlocked = _check_achievements(user_id, TRAINING_RESULT_FIELDS)
     
     # Лог об уровне
     if new_level > old_level:
         logger.info(f"🎉 Пользователь {user_id} повысил уровень: {old_level} → {new_level}")
         # Сохраняем информацию для показа пользователю
-        st['level_up_notification'] = {
+        st.level_up_notification = {
             'old_level': old_level,
             'new_level': new_level,
             'should_show': True
         }
+    save_user_data(user_id, u)
+    return newly_unlocked
 
-def _calculate_level(xp: int, levels: List[Dict]) -> int:
-    """Определение уровня по опыту"""
-    try:
-        for lvl in sorted(levels, key=lambda l: int(l.get('min_xp', 0))):
-            if xp < int(lvl.get('min_xp', 0)):
-                break
-        # Найти максимальный уровень, чей min_xp <= xp
-        eligible = [int(l.get('level', 1)) for l in levels if xp >= int(l.get('min_xp', 0))]
-        return max(eligible) if eligible else 1
-    except Exception:
-        return 1
+def _check_achievements(user_id: int, changed: Optional[Iterable[str]] = None):
+    """Проверка и разблокировка достижений.
 
-def _check_achievements(user_id: int):
-    """Проверка и разблокировка достижений"""
+    changed — поля статистики/сессии, изменившиеся с прошлой проверки (None — проверить все правила).
+    """
     u = get_user_data(user_id)
-    st = u['stats']
-    cfg = _ensure_scenario_loaded()
-    achievements = cfg.get('achievements', {}).get('list', [])
-    
-    newly_unlocked = []
-    for ach in achievements:
-        if ach.get('id') in st.get('achievements_unlocked', []):
-            continue
-        condition = ach.get('condition', '')
-        try:
-            if eval(condition, {"__builtins__": {}}, st):
-                st['achievements_unlocked'].append(ach['id'])
-                newly_unlocked.append(ach)
-                logger.info(f"🎖️ Достижение разблокировано: {ach.get('name')}")
-        except Exception as e:
-            logger.error(f"Ошибка проверки достижения {ach.get('id')}: {e}")
+    st = u.stats
+    _ensure_scenario_loaded()
+    # Условия видят статистику пользователя и показатели только что завершённой сессии
+    newly_unlocked = achievement_engine.evaluate(ChainMap(st, u.session), st.achievements_unlocked, changed)
+    for ach in newly_unlocked:
+        st.achievements_unlocked.append(ach['id'])
+        logger.info(f"🎖️ Достижение разблокировано: {ach.get('name')}")
     return newly_unlocked
 
 async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -220,11 +459,11 @@ async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 def log_case_statistics(user_id: int):
     """Логирование статистики сгенерированных кейсов"""
-    user = user_data.get(user_id)
-    if not user or not user['session'].get('case_data'):
+    user = user_data.peek(user_id)
+    if user is None or not user.session.case_data:
         return
     
-    case_data = user['session']['case_data']
+    case_data = user.session.case_data
     logger.info(f"""
     === СТАТИСТИКА КЕЙСА ===
     User ID: {user_id}
@@ -237,9 +476,59 @@ def log_case_statistics(user_id: int):
     ========================
     """)
 
-async def call_llm(kind: str, system_prompt: str, user_message: str) -> str:
-    """Вызов LLM по конвейеру kind ('response'|'feedback') с фолбэком и провайдерами."""
-    assert kind in ('response', 'feedback', 'classification', 'context')
+def _max_tokens(kind: str, provider: str) -> int:
+    """Лимит токенов ответа для конвейера и провайдера."""
+    if kind == 'classification':
+        return 20
+    if kind == 'analysis':
+        return 60
+    if kind == 'context' and provider == 'anthropic':
+        return 10
+    return 400
+
+async def call_llm(
+    kind: str,
+    system_prompt: str,
+    user_message: str,
+    cache_system: bool = False,
+    messages: Optional[List[Dict[str, str]]] = None,
+    on_text: Optional[Callable[[str], Awaitable[None]]] = None,
+) -> str:
+    """Вызов LLM по конвейеру kind ('response'|'feedback') с фолбэком и провайдерами.
+
+    cache_system — системный промпт неизменен между вызовами (префикс тренировки):
+    для Anthropic он помечается cache_control, OpenAI кэширует одинаковый префикс автоматически.
+    messages — история диалога (user/assistant по очереди, последним — user_message) вместо одного сообщения.
+    on_text — потоковый режим (SSE): вызывается с накопленным текстом текущей попытки по мере генерации.
+    """
+    chat = messages or [{"role": "user", "content": user_message}]
+    # Оценка входных токенов для лимита токенов/мин (до ответа фактический расход неизвестен)
+    prompt_tokens = estimate_tokens(system_prompt) + sum(estimate_tokens(m["content"]) for m in chat)
+    text_sink = on_text
+    # Попытка, чей текст показывается пользователю: при хеджировании поток не должен перемежаться
+    stream_owner: Optional[object] = None
+
+    def _emitter(attempt_id: object, first_text_at: List[float]) -> Callable[[str], Awaitable[None]]:
+        async def emit(text: str) -> None:
+            nonlocal text_sink, stream_owner
+            if not text:
+                return
+            if not first_text_at:
+                first_text_at.append(time.monotonic())
+            if text_sink is None:
+                return
+            if stream_owner is None:
+                stream_owner = attempt_id
+            elif stream_owner is not attempt_id:
+                return
+            try:
+                await text_sink(text)
+            except Exception as e:
+                # Сбой отображения не должен обрывать генерацию: дальше без промежуточного текста
+                logger.warning(f"Stream display failed ({kind}): {type(e).__name__}: {e}")
+                text_sink = None
+        return emit
+    assert kind in ('response', 'feedback', 'classification', 'context', 'analysis')
 
     if kind == 'response':
         primary_provider = RESPONSE_PRIMARY_PROVIDER
@@ -257,37 +546,46 @@ async def call_llm(kind: str, system_prompt: str, user_message: str) -> str:
         fallback_provider = CLASSIFICATION_FALLBACK_PROVIDER
         fallback_model = CLASSIFICATION_FALLBACK_MODEL
 
-    async def _invoke_openai(model_name: str) -> str:
-        client = openai.AsyncOpenAI(
-            api_key=OPENAI_API_KEY,
-            http_client=httpx.AsyncClient(
-                timeout=httpx.Timeout(LLM_TIMEOUT_SEC),
-                limits=httpx.Limits(max_connections=1, max_keepalive_connections=1)
-            )
-        )
+    async def _invoke_openai(model_name: str, emit: Callable[[str], Awaitable[None]]) -> str:
+        client = llm_clients.openai_client()
         # Для части моделей (напр. gpt-5-*) параметр max_tokens не поддерживается
         openai_payload = {
             "model": model_name,
-            "messages": [
-                {"role": "system", "content": system_prompt},
-                {"role": "user", "content": user_message}
-            ],
-            "temperature": 0.0 if kind == 'classification' else 0.7,
+            "messages": [{"role": "system", "content": system_prompt}, *chat],
+            "temperature": 0.0 if kind in ('classification', 'analysis') else 0.7,
         }
+        if kind == 'analysis':
+            # Комбинированный анализ возвращает строго JSON-объект
+            openai_payload["response_format"] = {"type": "json_object"}
         if str(model_name).startswith("gpt-5"):
-            openai_payload["max_completion_tokens"] = 20 if kind == 'classification' else 400
+            openai_payload["max_completion_tokens"] = _max_tokens(kind, 'openai')
             logger.info(f"OpenAI payload (gpt-5*): keys={list(openai_payload.keys())}")
         else:
-            openai_payload["max_tokens"] = 20 if kind == 'classification' else 400
+            openai_payload["max_tokens"] = _max_tokens(kind, 'openai')
             logger.info(f"OpenAI payload: keys={list(openai_payload.keys())}")
+        if on_text is not None:
+            openai_payload["stream"] = True
         try:
             resp = await client.chat.completions.create(**openai_payload)
         except Exception as e:
             logger.error(f"OpenAI request failed model={model_name} keys={list(openai_payload.keys())} error={e}")
             raise
+        if on_text is not None:
+            text = ''
+            async for chunk in resp:
+                delta = chunk.choices[0].delta.content if chunk.choices else None
+                if delta:
+                    text += delta
+                    await emit(text)
+            if not text.strip():
+                raise RuntimeError("OpenAI stream returned no text")
+            return text.strip()
+        if cache_system:
+            details = getattr(getattr(resp, 'usage', None), 'prompt_tokens_details', None)
+            logger.debug(f"OpenAI prompt cache: cached_tokens={getattr(details, 'cached_tokens', None)}")
         return resp.choices[0].message.content.strip()
 
-    async def _invoke_anthropic(model_name: str) -> str:
+    async def _invoke_anthropic(model_name: str, emit: Callable[[str], Awaitable[None]]) -> str:
         if not ANTHROPIC_API_KEY:
             raise RuntimeError("Anthropic API key not set")
         url = "https://api.anthropic.com/v1/messages"
@@ -296,53 +594,203 @@ async def call_llm(kind: str, system_prompt: str, user_message: str) -> str:
             "anthropic-version": "2023-06-01",
             "content-type": "application/json"
         }
+        system: Any = system_prompt
+        if cache_system:
+            # Точка кэширования после системного промпта: меняется только сообщение пользователя
+            system = [{"type": "text", "text": system_prompt, "cache_control": {"type": "ephemeral"}}]
+        anthropic_chat = chat
+        if cache_system and len(chat) > 1:
+            # Вторая точка кэширования — конец истории: на следующем ходу она станет префиксом
+            anthropic_chat = list(chat)
+            last = anthropic_chat[-2]
+            anthropic_chat[-2] = {
+                "role": last["role"],
+                "content": [{"type": "text", "text": last["content"], "cache_control": {"type": "ephemeral"}}],
+            }
         payload = {
             "model": model_name,
-            "max_tokens": 10 if kind == 'context' else (20 if kind == 'classification' else 400),
-            "system": system_prompt,
-            "messages": [{"role": "user", "content": user_message}],
-            "temperature": 0.0 if kind in ('classification','context') else 0.7
+            "max_tokens": _max_tokens(kind, 'anthropic'),
+            "system": system,
+            "messages": anthropic_chat,
+            "temperature": 0.0 if kind in ('classification', 'context', 'analysis') else 0.7
         }
-        async with httpx.AsyncClient(timeout=httpx.Timeout(LLM_TIMEOUT_SEC)) as client:
-            r = await client.post(url, headers=headers, json=payload)
-            r.raise_for_status()
-            data = r.json()
-            # content: [{"type":"text","text":"..."}, ...]
-            content = data.get('content', [])
-            if content and isinstance(content, list) and 'text' in content[0]:
-                return content[0]['text'].strip()
-            raise RuntimeError("Anthropic response format unexpected")
-
-    async def _invoke(provider: str, model: str) -> str:
+        client = llm_clients.http_client('anthropic')
+        if on_text is not None:
+            payload["stream"] = True
+            text = ''
+            async with client.stream('POST', url, headers=headers, json=payload) as r:
+                r.raise_for_status()
+                async for event in iter_sse_json(r):
+                    etype = event.get('type')
+                    if etype == 'content_block_delta' and (event.get('delta') or {}).get('type') == 'text_delta':
+                        text += event['delta'].get('text', '')
+                        await emit(text)
+                    elif etype == 'error':
+                        raise RuntimeError(f"Anthropic stream error: {event.get('error')}")
+                    elif etype == 'message_start' and cache_system:
+                        usage = (event.get('message') or {}).get('usage') or {}
+                        logger.debug(
+                            f"Anthropic prompt cache: read={usage.get('cache_read_input_tokens')} "
+                            f"created={usage.get('cache_creation_input_tokens')}"
+                        )
+            if not text.strip():
+                raise RuntimeError("Anthropic stream returned no text")
+            return text.strip()
+        r = await client.post(url, headers=headers, json=payload)
+        r.raise_for_status()
+        data = r.json()
+        if cache_system:
+            usage = data.get('usage') or {}
+            logger.debug(
+                f"Anthropic prompt cache: read={usage.get('cache_read_input_tokens')} "
+                f"created={usage.get('cache_creation_input_tokens')}"
+            )
+        # content: [{"type":"text","text":"..."}, ...]
+        content = data.get('content', [])
+        if content and isinstance(content, list) and 'text' in content[0]:
+            return content[0]['text'].strip()
+        raise RuntimeError("Anthropic response format unexpected")
+
+    async def _invoke(provider: str, model: str, emit: Callable[[str], Awaitable[None]]) -> str:
         if provider == 'openai':
-            return await _invoke_openai(model)
+            return await _invoke_openai(model, emit)
         elif provider == 'anthropic':
-            return await _invoke_anthropic(model)
+            return await _invoke_anthropic(model, emit)
+        elif provider == 'fake':
+            if on_text is None:
+                return await fake_llm.complete(kind, model, system_prompt, user_message, chat)
+            text = ''
+            async for delta in fake_llm.stream(kind, model, system_prompt, user_message, chat):
+                text += delta
+                await emit(text)
+            return text.strip()
         else:
             raise RuntimeError(f"Unknown provider: {provider}")
 
-    # Primary with retries
-    for attempt in range(LLM_MAX_RETRIES + 1):
+    async def _attempt(provider: str, model: str, breaker: Any, permit: Permit) -> str:
+        """Один вызов эндпоинта по пропуску предохранителя: очередь лимита, учёт в предохранителе и в статистике задержек."""
+        nonlocal stream_owner
+        attempt_id = object()
+        first_text_at: List[float] = []
         try:
-            logger.info(f"LLM primary: {kind} provider={primary_provider} model={primary_model} attempt={attempt+1}")
-            return await _invoke(primary_provider, primary_model)
-        except Exception as e:
-            logger.warning(f"Primary failed ({kind}): {type(e).__name__}: {e}")
-            if attempt < LLM_MAX_RETRIES:
-                continue
-    # Fallback
-    try:
-        logger.info(f"LLM fallback: {kind} provider={fallback_provider} model={fallback_model}")
-        return await _invoke(fallback_provider, fallback_model)
-    except Exception as e:
-        logger.error(f"Fallback failed ({kind}): {type(e).__name__}: {e}")
-        return "Произошла ошибка при генерации ответа. Попробуйте ещё раз позже."
-    
+            waited = await llm_rate_limits.acquire(provider, model, LLM_PRIORITY[kind], prompt_tokens + _max_tokens(kind, provider))
+        except asyncio.CancelledError:
+            # Пропуск (в том числе пробный) возвращается, даже если запрос не дождался очереди
+            breaker.record_cancelled(0.0, permit)
+            raise
+        if waited > 0:
+            logger.info(f"LLM rate limit: {kind} waited {waited:.2f}s for {provider}:{model}")
+        started = time.monotonic()
+        try:
+            result = await _invoke(provider, model, _emitter(attempt_id, first_text_at))
+        except asyncio.CancelledError:
+            breaker.record_cancelled(time.monotonic() - started, permit)
+            raise
+        except Exception:
+            breaker.record_failure(time.monotonic() - started, permit)
+            degradation.record_call(False)
+            if stream_owner is attempt_id:
+                stream_owner = None
+            raise
+        elapsed = time.monotonic() - started
+        breaker.record_success(elapsed, permit)
+        degradation.record_call(True)
+        # В потоковом режиме пользователь ждёт первый текст — по нему и считается задержка
+        llm_latency.record(provider, model, first_text_at[0] - started if first_text_at else elapsed)
+        return result
+
+    async def _hedged(breaker: Any, permit: Permit) -> Tuple[Optional[str], bool]:
+        """Основной вызов с хеджем на резервный; возвращает (ответ или None, был ли хедж)."""
+        hedge_budget.on_request()
+        primary = asyncio.create_task(_attempt(primary_provider, primary_model, breaker, permit))
+        pending = {primary}
+        hedge: Optional[asyncio.Task] = None
+        try:
+            observed = llm_latency.percentile(primary_provider, primary_model, LLM_HEDGE_PERCENTILE)
+            delay = LLM_HEDGE_DELAY_SEC if math.isnan(observed) else max(LLM_HEDGE_DELAY_SEC, observed)
+            done, _ = await asyncio.wait(pending, timeout=delay)
+            # Основной уже отвечает потоком — дублировать запрос незачем
+            if not done and stream_owner is None:
+                fallback_breaker = llm_breakers.get(fallback_provider, fallback_model)
+                fallback_permit = None
+                if not fallback_breaker.is_open() and hedge_budget.try_spend():
+                    fallback_permit = fallback_breaker.allow()
+                if fallback_permit is not None:
+                    logger.info(
+                        f"LLM hedge: {kind} provider={fallback_provider} model={fallback_model} "
+                        f"after {delay:.2f}s"
+                    )
+                    hedge = asyncio.create_task(_attempt(fallback_provider, fallback_model, fallback_breaker, fallback_permit))
+                    pending.add(hedge)
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    error = task.exception()
+                    if error is None:
+                        if task is hedge:
+                            hedge_budget.wins += 1
+                        return task.result(), hedge is not None
+                    leg = 'Hedge' if task is hedge else 'Primary'
+                    logger.warning(f"{leg} failed ({kind}): {type(error).__name__}: {error}")
+            return None, hedge is not None
+        finally:
+            # Проигравший запрос отменяется; его отмена учитывается в предохранителе
+            for task in pending:
+                task.cancel()
+            if pending:
+                await asyncio.gather(*pending, return_exceptions=True)
+
+    # Основной провайдер с повторами (экспоненциальная пауза с джиттером), затем резервный.
+    # Эндпоинт с разомкнутой цепью пропускается сразу, без ожидания таймаутов
+    # Номер первой попытки каждого плеча: после хеджированного вызова часть попыток уже сделана
+    primary_first, fallback_first = 0, 0
+    if kind in LLM_HEDGE_PIPELINES and (fallback_provider, fallback_model) != (primary_provider, primary_model):
+        breaker = llm_breakers.get(primary_provider, primary_model)
+        permit = breaker.allow()
+        if permit is not None:
+            logger.info(f"LLM primary: {kind} provider={primary_provider} model={primary_model} attempt=1 (hedged)")
+            result, hedged = await _hedged(breaker, permit)
+            if result is not None:
+                return result
+            primary_first, fallback_first = 1, int(hedged)
+            if LLM_MAX_RETRIES:
+                await asyncio.sleep(backoff_delay(0, LLM_RETRY_BACKOFF_SEC, LLM_RETRY_BACKOFF_MAX_SEC))
+    legs = (
+        ('primary', primary_provider, primary_model, primary_first, LLM_MAX_RETRIES + 1),
+        ('fallback', fallback_provider, fallback_model, fallback_first, 1),
+    )
+    for leg, provider, model, first, attempts in legs:
+        breaker = llm_breakers.get(provider, model)
+        for attempt in range(first, attempts):
+            permit = breaker.allow()
+            if permit is None:
+                logger.warning(f"LLM {leg} skipped ({kind}): circuit open for {provider}:{model}")
+                break
+            logger.info(f"LLM {leg}: {kind} provider={provider} model={model} attempt={attempt+1}")
+            try:
+                return await _attempt(provider, model, breaker, permit)
+            except Exception as e:
+                logger.warning(f"{leg.capitalize()} failed ({kind}): {type(e).__name__}: {e}")
+                if attempt + 1 < attempts:
+                    await asyncio.sleep(backoff_delay(attempt, LLM_RETRY_BACKOFF_SEC, LLM_RETRY_BACKOFF_MAX_SEC))
+    logger.error(f"All LLM endpoints failed or unavailable ({kind})")
+    return LLM_ERROR_MESSAGE
+
 def _ensure_scenario_loaded() -> Dict[str, Any]:
-    global scenario_config, case_generator
+    global scenario_config, case_generator, question_type_index, achievement_engine, level_index
     if scenario_config is None:
         try:
             loaded = scenario_loader.load_scenario(SCENARIO_PATH)
+            question_type_index = QuestionTypeIndex(loaded.config['question_types'])
+            # Ключевые слова типов и маркеры контекста — один автомат Ахо–Корасик
+            question_analyzer.compile_keywords(loaded.config['question_types'])
+            # Условия достижений компилируются один раз при загрузке сценария
+            achievement_engine = AchievementEngine(
+                loaded.config.get('achievements', {}).get('list', []),
+                known_fields=UserStats._FIELDS + Session._FIELDS,
+            )
+            # Таблица уровней сортируется один раз: поиск уровня по XP — бинарный
+            level_index = LevelIndex(loaded.config.get('ranking', {}).get('levels', []))
             scenario_config = loaded.config
             
             # Инициализируем CaseGenerator если есть case_variants
@@ -358,6 +806,10 @@ def _ensure_scenario_loaded() -> Dict[str, Any]:
 async def start_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Обработчик команды /start"""
     print(f"🚀 Команда /start вызвана пользователем {update.effective_user.id}")
+    # Сброс сессии встаёт в очередь за текущим ходом пользователя и никогда не отбрасывается
+    await turn_serializer.run(update.effective_user.id, '/start', lambda _: _start_turn(update), coalesce=False)
+
+async def _start_turn(update: Update) -> None:
     user_id = update.effective_user.id
     
     # Инициализируем и переводим в ожидание старта
@@ -380,54 +832,104 @@ async def scenario_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         logger.error(f"Ошибка отображения сценария: {e}")
         await update.message.reply_text("Ошибка получения информации о сценарии.")
 
+def _typing(update: Update) -> ChatActionKeeper:
+    """Фоновый индикатор «печатает…» для чата (запуск — start() или async with)."""
+    return ChatActionKeeper(lambda: update.effective_chat.send_action(ChatAction.TYPING), TYPING_REFRESH_SEC)
+
+def _progressive_reply(
+    update: Update,
+    render: Callable[[str], str] = lambda text: text,
+    indicator: Optional[ChatActionKeeper] = None,
+) -> Optional[ProgressiveMessage]:
+    """Сообщение-ответ, которое дописывается по мере генерации (None — потоковый режим выключен)."""
+    if not LLM_STREAMING:
+        return None
+
+    async def send(text: str) -> Any:
+        # Первый текст в чате — индикатор больше не нужен
+        if indicator is not None:
+            indicator.stop()
+        return await update.message.reply_text(text)
+
+    return ProgressiveMessage(send, min_interval=STREAM_EDIT_INTERVAL_SEC, render=render)
+
+async def _reply_final(
+    update: Update,
+    renderer: Optional[ProgressiveMessage],
+    text: str,
+    indicator: Optional[ChatActionKeeper] = None,
+) -> None:
+    """Итоговый текст: последней правкой потокового сообщения или обычным ответом."""
+    if indicator is not None:
+        indicator.stop()
+    if renderer is None:
+        await update.message.reply_text(text)
+    else:
+        await renderer.finish(text)
+
 async def handle_feedback(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Обработка запроса обратной связи"""
     user_id = update.effective_user.id
     user = get_user_data(user_id)
     
-    session = user['session']
-    if not session['last_question_type']:
+    session = user.session
+    if not session.last_question_type:
         await update.message.reply_text('Сначала задайте вопрос клиенту.')
         return
     
     cfg = _ensure_scenario_loaded()
     # Counters by type from current session
-    per_type = session.get('per_type_counts', {})
-    situational_q = int(per_type.get('situational', 0))
-    problem_q = int(per_type.get('problem', 0))
-    implication_q = int(per_type.get('implication', 0))
-    need_payoff_q = int(per_type.get('need_payoff', 0))
+    situational_q = session.type_count('situational')
+    problem_q = session.type_count('problem')
+    implication_q = session.type_count('implication')
+    need_payoff_q = session.type_count('need_payoff')
     feedback_prompt = scenario_loader.get_prompt(
         'feedback',
-        last_question_type=session['last_question_type'],
-        question_count=session['question_count'],
-        clarity_level=session['clarity_level'],
+        last_question_type=session.last_question_type,
+        question_count=session.question_count,
+        clarity_level=session.clarity_level,
         situational_q=situational_q,
         problem_q=problem_q,
         implication_q=implication_q,
         need_payoff_q=need_payoff_q,
     )
 
-    try:
-        feedback = await call_llm('feedback', feedback_prompt, 'Проанализируй ситуацию')
-        await update.message.reply_text(
-            f"📊 ОБРАТНАЯ СВЯЗЬ ОТ НАСТАВНИКА:\n\n{feedback}\n\nТеперь попробуйте задать улучшенный вопрос."
-        )
-    except Exception as e:
-        logger.error(f"Ошибка получения обратной связи: {e}")
-        await update.message.reply_text(scenario_loader.get_message('error_generic'))
-
-async def send_final_report(update: Update, user: Dict[str, Any]):
-    """Отправка финального отчета (универсально)."""
+    header = "📊 ОБРАТНАЯ СВЯЗЬ ОТ НАСТАВНИКА:\n\n"
+    async with _typing(update) as indicator:
+        renderer = _progressive_reply(update, render=lambda text: header + text, indicator=indicator)
+        try:
+            feedback = await call_llm(
+                'feedback', feedback_prompt, 'Проанализируй ситуацию',
+                on_text=renderer.update if renderer else None,
+            )
+            await _reply_final(
+                update, renderer, f"{header}{feedback}\n\nТеперь попробуйте задать улучшенный вопрос.", indicator
+            )
+        except Exception as e:
+            logger.error(f"Ошибка получения обратной связи: {e}")
+            if renderer:
+                renderer.cancel()
+            indicator.stop()
+            await update.message.reply_text(scenario_loader.get_message('error_generic'))
+
+async def send_final_report(update: Update, user: UserRecord, newly_unlocked: List[Dict[str, Any]]):
+    """Отправка финального отчета (универсально); newly_unlocked — результат update_stats."""
+    async with _typing(update) as indicator:
+        full_report = _build_final_report(update, user, newly_unlocked)
+        indicator.stop()
+        await update.message.reply_text(full_report)
+
+def _build_final_report(update: Update, user: UserRecord, newly_unlocked: List[Dict[str, Any]]) -> str:
+    """Текст финального отчёта: оценка, кейс, статистика, ранг и достижения."""
     cfg = _ensure_scenario_loaded()
-    session = user['session']
-    case_data = session.get('case_data')
+    session = user.session
+    case_data = session.case_data
 
     # Подсчет очков через анализатор, используя конфиг
     temp_user = {
-        'question_count': session['question_count'],
-        'clarity_level': session['clarity_level'],
-        'per_type_counts': session['per_type_counts'],
+        'question_count': session.question_count,
+        'clarity_level': session.clarity_level,
+        'per_type_counts': session.per_type_counts,
     }
     temp_user['total_score'] = QuestionAnalyzer().calculate_score(session, cfg['question_types'])
 
@@ -446,29 +948,25 @@ async def send_final_report(update: Update, user: Dict[str, Any]):
 """
 
     # Общая статистика пользователя
-    stats = user['stats']
+    stats = user.stats
     stats_info = f"""
 📈 ВАША ОБЩАЯ СТАТИСТИКА:
-Пройдено тренировок: {stats['total_trainings']}
-Всего вопросов задано: {stats['total_questions']}
-Лучший результат: {stats['best_score']} баллов
+Пройдено тренировок: {stats.total_trainings}
+Всего вопросов задано: {stats.total_questions}
+Лучший результат: {stats.best_score} баллов
 """
 
     # НОВОЕ: Ранг и достижения
-    levels = cfg.get('ranking', {}).get('levels', [])
-    stats = user['stats']
-    current_level_data = next((l for l in levels if l.get('level') == stats.get('current_level', 1)), (levels[0] if levels else {'level': 1, 'name': 'Новичок', 'emoji': '🌱', 'min_xp': 0, 'description': ''}))
-    next_level_data = next((l for l in levels if l.get('level') == stats.get('current_level', 1) + 1), None)
+    current_level_data = level_index.get(stats.current_level)
+    next_level_data, xp_to_next, _ = level_index.progress(stats.total_xp, stats.current_level)
     xp_progress = ""
     if next_level_data:
-        current_xp = int(stats.get('total_xp', 0))
-        xp_to_next = int(next_level_data.get('min_xp', 0)) - current_xp
         if xp_to_next > 0:
             xp_progress = f"\nДо следующего уровня: {xp_to_next} XP"
     rank_info = f"""
 ⭐ ВАШ РАНГ:
 {current_level_data.get('emoji', '')} Уровень {current_level_data.get('level', 1)}: {current_level_data.get('name', '')}
-Опыт (XP): {stats.get('total_xp', 0)}{xp_progress}
+Опыт (XP): {stats.total_xp}{xp_progress}
 {current_level_data.get('description', '')}
 
 💡 Используйте /rank для детального просмотра прогресса и достижений
@@ -476,15 +974,15 @@ async def send_final_report(update: Update, user: Dict[str, Any]):
 
     # Проверка повышения уровня
     level_up_msg = ""
-    if stats.get('level_up_notification', {}).get('should_show'):
-        notif = stats['level_up_notification']
-        level_data = next((l for l in levels if l.get('level') == notif['new_level']), None)
+    notif = stats.level_up_notification
+    if notif and notif.get('should_show'):
+        level_data = level_index.find(notif['new_level'])
         level_emoji = level_data.get('emoji', '🎉') if level_data else '🎉'
         level_name = level_data.get('name', '') if level_data else ''
         level_up_msg = f"\n\n🎊 ПОЗДРАВЛЯЕМ! ВЫ ПОВЫСИЛИ УРОВЕНЬ!\n{level_emoji} Уровень {notif['old_level']} → Уровень {notif['new_level']}: {level_name}\n\nИспользуйте /rank для подробностей\n"
-        stats['level_up_notification']['should_show'] = False
+        notif['should_show'] = False
 
-    newly_unlocked = _check_achievements(update.effective_user.id)
+    # Достижения, разблокированные завершением этой сессии в update_stats
     achievements_info = ""
     if newly_unlocked:
         achievements_info = "\n\n🎖️ НОВЫЕ ДОСТИЖЕНИЯ:\n" + "\n".join(
@@ -493,8 +991,8 @@ async def send_final_report(update: Update, user: Dict[str, Any]):
         )
 
     # Активное слушание — статистика
-    contextual_q = int(user['session'].get('contextual_questions', 0))
-    qcount = int(user['session'].get('question_count', 0))
+    contextual_q = session.contextual_questions
+    qcount = session.question_count
     contextual_pct = int((contextual_q / qcount) * 100) if qcount > 0 else 0
     listening_section = f"""
 👂 АКТИВНОЕ СЛУШАНИЕ:
@@ -508,45 +1006,83 @@ async def send_final_report(update: Update, user: Dict[str, Any]):
         listening_section += "⚠️ Совет: стройте вопросы на основе ответов клиента\n"
 
     # Объединяем отчёт с дополнительной информацией
-    full_report = f"{report}{case_info}{stats_info}{listening_section}{rank_info}{level_up_msg}{achievements_info}\n\n🎯 Для новой тренировки напишите \"начать\" или используйте /help для справки"
-    await update.message.reply_text(full_report)
+    return f"{report}{case_info}{stats_info}{listening_section}{rank_info}{level_up_msg}{achievements_info}\n\n🎯 Для новой тренировки напишите \"начать\" или используйте /help для справки"
+
+def build_client_prompt(case_data: Dict[str, Any], client_case: str) -> str:
+    """Системный промпт клиента на всю тренировку: статичные принципы, затем данные кейса.
+
+    Вопрос продавца передаётся отдельным сообщением пользователя, поэтому промпт
+    остаётся неизменным префиксом и кэшируется провайдером между ходами.
+    """
+    return (
+        f"{CLIENT_RESPONSE_PRINCIPLES}\n\n"
+        f"ПАРАМЕТРЫ КЕЙСА:\n"
+        f"РОЛЬ: {case_data.get('position', '')} в компании \"{(case_data.get('company') or {}).get('type', '')}\"\n"
+        f"КОНТЕКСТ: {client_case}\n\n"
+        f"ДОПОЛНИТЕЛЬНАЯ ИНФОРМАЦИЯ:\n"
+        f"- Объём закупок: {case_data.get('volume', '')}\n"
+        f"- Частота: {case_data.get('frequency', '')}\n"
+        f"- Количество поставщиков: {case_data.get('suppliers_count', '')}\n"
+        f"- Тип ситуации: {(case_data.get('situation') or {}).get('type', '')}\n"
+        f"- Характер закупки: {case_data.get('urgency', '')}"
+    )
+
+def _client_prompt(session: Session) -> str:
+    """Промпт клиента из сессии (для сессий, сохранённых до его появления, строится и запоминается)."""
+    if not session.client_prompt:
+        session.client_prompt = build_client_prompt(session.case_data or {}, session.client_case)
+    return session.client_prompt
 
 async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Обработка текстовых сообщений"""
+    """Обработка текстовых сообщений: не больше одного хода пользователя одновременно."""
+    received_at = time.monotonic()
+    accepted = await turn_serializer.run(
+        update.effective_user.id,
+        update.message.text,
+        lambda text: _handle_turn(update, context, text, received_at),
+    )
+    if not accepted:
+        await update.message.reply_text(TURN_BUSY_MESSAGE)
+
+async def _handle_turn(
+    update: Update,
+    context: ContextTypes.DEFAULT_TYPE,
+    message_text: str,
+    received_at: Optional[float] = None,
+) -> None:
+    """Один ход тренировки; message_text — текст сообщения (или объединённых сообщений при TURN_POLICY=merge).
+
+    received_at — время получения сообщения (time.monotonic): ожидание в очереди входит в бюджет задержки хода.
+    """
     user_id = update.effective_user.id
-    message_text = update.message.text
     cfg = _ensure_scenario_loaded()
     rules = cfg['game_rules']
     
     # Обработка запуска тренировки из состояния ожидания
     u = get_user_data(user_id)
-    sess = u['session']
-    if sess.get('chat_state') == 'waiting_start':
+    sess = u.session
+    if sess.chat_state == 'waiting_start':
         if message_text.lower() in ['начать', 'старт']:
             # ГЕНЕРИРУЕМ КЕЙС ЗДЕСЬ
             try:
-                # Получаем список недавних кейсов для исключения повторов
-                recent_cases = u['stats'].get('recent_cases', [])
-                
-                # Генерируем случайный уникальный кейс
-                case_data = case_generator.generate_random_case(exclude_recent=recent_cases)
+                # Следующий кейс из персональной перестановки: без повторов, пока не пройдены все комбинации
+                st = u.stats
+                if not st.case_seed:
+                    st.case_seed = case_generator.new_seed()
+                case_data = case_generator.generate_case_at(st.case_seed, st.case_cursor)
+                st.case_cursor += 1
                 
                 # Сохраняем данные кейса
-                sess['case_data'] = case_data
+                sess.case_data = case_data
                 
                 # Генерируем кейс напрямую без GPT (мгновенно)
                 client_case = case_generator.build_case_direct(case_data)
                 
-                # Сохраняем сгенерированный кейс
-                sess['client_case'] = client_case
-                sess['chat_state'] = 'training_active'
-                
-                # Добавляем хеш кейса в историю
-                case_hash = case_generator._get_case_hash(case_data)
-                recent_cases.append(case_hash)
-                if len(recent_cases) > 5:
-                    recent_cases.pop(0)
-                u['stats']['recent_cases'] = recent_cases
+                # Сохраняем сгенерированный кейс и неизменный до конца тренировки промпт клиента
+                sess.client_case = client_case
+                sess.client_prompt = build_client_prompt(case_data, client_case)
+                sess.chat_state = 'training_active'
+                save_user_data(user_id, u)
                 
                 # Логируем статистику кейса сразу после генерации
                 log_case_statistics(user_id)
@@ -581,11 +1117,11 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
         cfg = _ensure_scenario_loaded()
         
         # 1️⃣ Сначала обновляем статистику
-        total_score = QuestionAnalyzer().calculate_score(user['session'], cfg['question_types'])
-        update_stats(user_id, total_score)
+        total_score = QuestionAnalyzer().calculate_score(user.session, cfg['question_types'])
+        newly_unlocked = update_stats(user_id, total_score)
         
         # 2️⃣ Потом показываем отчёт
-        await send_final_report(update, user)
+        await send_final_report(update, user, newly_unlocked)
         
         # 3️⃣ Логируем статистику кейса
         log_case_statistics(user_id)
@@ -599,139 +1135,202 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return
     
     user = get_user_data(user_id)
-    session = user['session']
+    session = user.session
     
-    if session['question_count'] >= rules['max_questions']:
+    if session.question_count >= rules['max_questions']:
         cfg = _ensure_scenario_loaded()
         # 1️⃣ Сначала обновляем статистику
         total_score = QuestionAnalyzer().calculate_score(session, cfg['question_types'])
-        update_stats(user_id, total_score)
+        newly_unlocked = update_stats(user_id, total_score)
         # 2️⃣ Потом показываем отчёт
-        await send_final_report(update, user)
+        await send_final_report(update, user, newly_unlocked)
         # 3️⃣ Логируем статистику кейса
         log_case_statistics(user_id)
         # 4️⃣ Очищаем сессию
         reset_session(user_id)
         return
     
+    renderer: Optional[ProgressiveMessage] = None
+    # «Печатает…» с начала хода до первого сообщения (или ошибки)
+    indicator = _typing(update).start()
     try:
-        # Определяем тип вопроса из конфига
-        # Классификация через LLM с fallback
-        qtype = await question_analyzer.classify_question(
-            message_text,
-            cfg['question_types'],
-            session.get('client_case', ''),
-            lambda kind, sys, usr: call_llm(kind, sys, usr),
-            cfg.get('prompts', {})
+        # Ответ клиента не зависит от типа вопроса, а проверка контекста — только от прошлого ответа,
+        # поэтому все три вызова LLM выполняются параллельно
+        case_data = session.case_data or {}
+        client_prompt = _client_prompt(session)
+        last_resp = session.last_client_response
+        # Вопрос идёт последним сообщением после ограниченной истории диалога
+        question_message = f"Вопрос продавца: {message_text}"
+        # Отпечаток кейса для кэша классификации: тип компании и продукт (без случайных объёмов и цифр)
+        case_key = f"{(case_data.get('company') or {}).get('type', '')}|{(case_data.get('product') or {}).get('name', '')}"
+
+        # Бюджет задержки хода и ошибок LLM: при исчерпании вспомогательные стадии обходятся без LLM
+        received_at = received_at if received_at is not None else time.monotonic()
+        elapsed = time.monotonic() - received_at
+        degraded = degradation.reasons(elapsed)
+        analysis_llm = None if degraded else (lambda kind, sys, usr: call_llm(kind, sys, usr))
+        context_llm = None if degraded else (lambda kind, sys, usr: call_llm('context', sys, usr))
+        classification_timeout = CLASSIFICATION_STAGE_TIMEOUT_SEC
+        context_timeout = CONTEXT_STAGE_TIMEOUT_SEC
+        if degraded:
+            # В деградированном ходе вспомогательные стадии не должны выводить его за пределы остатка бюджета;
+            # в обычном ходе действуют полные таймауты стадий (вся цепочка primary + fallback)
+            remaining = max(0.5, degradation.remaining(elapsed))
+            classification_timeout = min(classification_timeout, remaining)
+            context_timeout = min(context_timeout, remaining)
+
+        # Генерируем ответ клиента с учетом данных кейса; при потоковом режиме он появляется в чате сразу
+        renderer = _progressive_reply(update, indicator=indicator)
+        response_stage = Stage(
+            'response',
+            lambda: call_llm(
+                'response',
+                client_prompt,
+                question_message,
+                cache_system=True,
+                messages=session.dialogue_messages(question_message),
+                on_text=renderer.update if renderer else None,
+            ),
+            RESPONSE_STAGE_TIMEOUT_SEC,
+            lambda: LLM_ERROR_MESSAGE,
         )
+        if QUESTION_ANALYSIS_MODE == 'combined':
+            # Тип вопроса и активное слушание одним структурированным запросом (fallback — два вызова)
+            stages = [
+                Stage(
+                    'analysis',
+                    lambda: question_analyzer.analyze_question(
+                        message_text,
+                        cfg['question_types'],
+                        session.client_case,
+                        last_resp,
+                        analysis_llm,
+                        scenario_loader.prompts,
+                        case_key,
+                    ),
+                    classification_timeout,
+                    lambda: (
+                        question_analyzer.classify_question_fallback(message_text, cfg['question_types']),
+                        bool(last_resp) and question_analyzer.check_context_usage_fallback(message_text, last_resp),
+                    ),
+                ),
+                response_stage,
+            ]
+        else:
+            stages = [
+                # Классификация через LLM с fallback на ключевые слова
+                Stage(
+                    'classification',
+                    lambda: question_analyzer.classify_question(
+                        message_text,
+                        cfg['question_types'],
+                        session.client_case,
+                        analysis_llm,
+                        scenario_loader.prompts,
+                        case_key,
+                    ),
+                    classification_timeout,
+                    lambda: question_analyzer.classify_question_fallback(message_text, cfg['question_types']),
+                ),
+                response_stage,
+            ]
+            # === Активное слушание: проверяем, использовал ли вопрос контекст прошлого ответа ===
+            if last_resp:
+                stages.append(Stage(
+                    'context',
+                    lambda: question_analyzer.check_context_usage(
+                        message_text,
+                        last_resp,
+                        context_llm,
+                        scenario_loader.prompts
+                    ),
+                    context_timeout,
+                    lambda: question_analyzer.check_context_usage_fallback(message_text, last_resp),
+                ))
+        turn = await run_stages(stages)
+        degradation.record_turn(time.monotonic() - received_at)
+        if degraded:
+            logger.warning(
+                f"Degraded turn user={user_id}: stages without LLM="
+                f"{','.join(stage.name for stage in stages if stage is not response_stage)} reasons={','.join(degraded)}"
+            )
+
+        if 'analysis' in turn.stages:
+            qtype, is_contextual = turn['analysis']
+        else:
+            qtype = turn['classification']
+            is_contextual = bool(last_resp) and turn['context']
         question_type_name = qtype.get('name', qtype.get('id'))
         
         # Обновляем счетчики
-        session['question_count'] += 1
-        session['last_question_type'] = question_type_name
+        session.question_count += 1
+        session.last_question_type = question_type_name
 
-        qid = qtype.get('id')
-        session['per_type_counts'][qid] = int(session['per_type_counts'].get(qid, 0)) + 1
-        session['clarity_level'] += question_analyzer.calculate_clarity_increase(qtype)
+        session.increment_type(qtype.get('id'))
+        session.clarity_level += question_analyzer.calculate_clarity_increase(qtype)
         
-        session['clarity_level'] = min(session['clarity_level'], 100)
+        session.clarity_level = min(session.clarity_level, 100)
         
-        # Генерируем ответ клиента с учетом данных кейса
-        case_data = session.get('case_data') or {}
-        enriched_prompt = (
-            f"Вы клиент из кейса со следующими параметрами:\n\n"
-            f"РОЛЬ: {case_data.get('position', '')} в компании \"{(case_data.get('company') or {}).get('type', '')}\"\n"
-            f"КОНТЕКСТ: {session.get('client_case', '')}\n\n"
-            f"ДОПОЛНИТЕЛЬНАЯ ИНФОРМАЦИЯ:\n"
-            f"- Объём закупок: {case_data.get('volume', '')}\n"
-            f"- Частота: {case_data.get('frequency', '')}\n"
-            f"- Количество поставщиков: {case_data.get('suppliers_count', '')}\n"
-            f"- Тип ситуации: {(case_data.get('situation') or {}).get('type', '')}\n"
-            f"- Характер закупки: {case_data.get('urgency', '')}\n\n"
-            f"ПРИНЦИПЫ ОТВЕТОВ:\n"
-            f"- Отвечайте нейтрально и сдержанно, как реальный занятой руководитель\n"
-            f"- НЕ раскрывайте проблемы сами - только на конкретные SPIN-вопросы\n"
-            f"- На ситуационные вопросы: давайте факты и цифры\n"
-            f"- На проблемные: признавайте проблемы, но не драматизируйте\n"
-            f"- На извлекающие: раскрывайте последствия постепенно, намёками\n"
-            f"- На направляющие: подтверждайте ценность предложенных решений\n\n"
-            f"СТИЛЬ: Короткие реалистичные ответы (2-4 предложения), профессиональный тон.\n\n"
-            f"Вопрос продавца: {message_text}"
-        )
-        client_response = await call_llm('response', enriched_prompt, "Ответь на вопрос как клиент")
-
-        # === Активное слушание: проверяем, использовал ли вопрос контекст прошлого ответа ===
-        is_contextual = False
-        last_resp = session.get('last_client_response', '')
-        if last_resp:
-            is_contextual = await question_analyzer.check_context_usage(
-                message_text,
-                last_resp,
-                lambda kind, sys, usr: call_llm('context', sys, usr),
-                cfg.get('prompts', {})
-            )
+        client_response = turn['response']
+
         context_badge = ""
         if is_contextual:
-            session['contextual_questions'] = int(session.get('contextual_questions', 0)) + 1
+            session.contextual_questions += 1
             contextual_bonus = int(cfg.get('scoring', {}).get('question_weights', {}).get('contextual_bonus', 0))
-            session['clarity_level'] = min(100, session['clarity_level'] + contextual_bonus)
+            session.clarity_level = min(100, session.clarity_level + contextual_bonus)
             context_badge = " 👂"
         # Сохраняем последний ответ клиента для следующей итерации
-        session['last_client_response'] = client_response
-        
+        session.last_client_response = client_response
+        if client_response != LLM_ERROR_MESSAGE:
+            session.remember_turn(question_message, client_response)
+        save_user_data(user_id, user)
+
+        def turn_feedback() -> str:
+            # Ответ клиента с типом вопроса и строкой прогресса (шаблоны скомпилированы при загрузке)
+            return scenario_loader.get_message(
+                'question_feedback',
+                question_type=question_type_name + context_badge,
+                client_response=client_response,
+                progress_line=scenario_loader.get_message(
+                    'progress', count=session.question_count, max=rules['max_questions'], clarity=session.clarity_level
+                ),
+            )
+
         # Проверяем условия завершения
-        if session['question_count'] >= rules['max_questions'] or session['clarity_level'] >= rules['target_clarity']:
-            if session['clarity_level'] >= rules['target_clarity'] and session['question_count'] >= rules['min_questions_for_completion']:
+        if session.question_count >= rules['max_questions'] or session.clarity_level >= rules['target_clarity']:
+            if session.clarity_level >= rules['target_clarity'] and session.question_count >= rules['min_questions_for_completion']:
+                await _reply_final(update, renderer, turn_feedback(), indicator)
                 await update.message.reply_text(
-                    scenario_loader.get_message(
-                        'question_feedback',
-                        question_type=question_type_name + context_badge,
-                        client_response=client_response,
-                        progress_line=scenario_loader.get_message(
-                            'progress', count=session['question_count'], max=rules['max_questions'], clarity=session['clarity_level']
-                        )
-                    )
-                )
-                await update.message.reply_text(
-                    scenario_loader.get_message('clarity_reached', clarity=session['clarity_level'])
+                    scenario_loader.get_message('clarity_reached', clarity=session.clarity_level)
                 )
-            elif session['question_count'] >= rules['max_questions']:
+            elif session.question_count >= rules['max_questions']:
                 cfg = _ensure_scenario_loaded()
+                if renderer is not None and renderer.message is not None:
+                    # Ответ клиента уже начал выводиться потоком — дописываем его перед отчётом
+                    await renderer.finish(client_response)
+                indicator.stop()
                 # 1️⃣ Сначала обновляем статистику
                 total_score = QuestionAnalyzer().calculate_score(session, cfg['question_types'])
-                update_stats(user_id, total_score)
+                newly_unlocked = update_stats(user_id, total_score)
                 # 2️⃣ Потом показываем отчёт
-                await send_final_report(update, user)
+                await send_final_report(update, user, newly_unlocked)
                 # 3️⃣ Логируем статистику кейса
                 log_case_statistics(user_id)
                 # 4️⃣ Очищаем сессию
                 reset_session(user_id)
             else:
-                await update.message.reply_text(
-                    scenario_loader.get_message(
-                        'question_feedback',
-                        question_type=question_type_name + context_badge,
-                        client_response=client_response,
-                        progress_line=scenario_loader.get_message(
-                            'progress', count=session['question_count'], max=rules['max_questions'], clarity=session['clarity_level']
-                        )
-                    )
-                )
+                await _reply_final(update, renderer, turn_feedback(), indicator)
         else:
-            await update.message.reply_text(
-                scenario_loader.get_message(
-                    'question_feedback',
-                    question_type=question_type_name + context_badge,
-                    client_response=client_response,
-                    progress_line=scenario_loader.get_message(
-                        'progress', count=session['question_count'], max=rules['max_questions'], clarity=session['clarity_level']
-                    )
-                )
-            )
+            await _reply_final(update, renderer, turn_feedback(), indicator)
     
     except Exception as e:
         logger.error(f"Ошибка обработки сообщения: {e}")
+        if renderer is not None:
+            renderer.cancel()
+        indicator.stop()
         await update.message.reply_text(scenario_loader.get_message('error_generic'))
+    finally:
+        indicator.stop()
 
 async def validate_config_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Проверка конфигурации на логические ошибки"""
@@ -764,7 +1363,9 @@ async def validate_config_command(update: Update, context: ContextTypes.DEFAULT_
         if 'volume_range' not in product:
             warnings.append(f"⚠️ {product['name']}: нет поля volume_range")
 
+    space = case_generator.case_space.report()
     result = "📊 РЕЗУЛЬТАТЫ ПРОВЕРКИ:\n\n"
+    result += f"📐 Пространство кейсов: {space['total']} валидных комбинаций ({space['companies']} типов компаний)\n\n"
     if errors:
         result += "🚨 ОШИБКИ:\n" + "\n".join(errors) + "\n\n"
     if warnings:
@@ -805,31 +1406,35 @@ async def stats_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Показать статистику пользователя"""
     user_id = update.effective_user.id
     
-    if user_id not in user_data:
+    user = _find_user_data(user_id)
+    if user is None:
         await update.message.reply_text('У вас пока нет статистики. Начните тренировку командой /start')
         return
     
-    stats = user_data[user_id]['stats']
-    session = user_data[user_id]['session']
+    _ensure_scenario_loaded()
+    stats = user.stats
+    session = user.session
+    level_data = level_index.get(stats.current_level)
     
     session_status = "❌ Нет активной тренировки"
-    if session['chat_state'] == 'waiting_start':
+    if session.chat_state == 'waiting_start':
         session_status = "⏳ Ожидается начало тренировки"
-    elif session['chat_state'] == 'training_active':
-        session_status = f"✅ Активная тренировка ({session['question_count']}/10 вопросов)"
+    elif session.chat_state == 'training_active':
+        session_status = f"✅ Активная тренировка ({session.question_count}/10 вопросов)"
     
     stats_message = f"""📊 ВАША СТАТИСТИКА:
 
 🎯 Общие показатели:
-- Пройдено тренировок: {stats['total_trainings']}
-- Всего задано вопросов: {stats['total_questions']}
-- Лучший результат: {stats['best_score']} баллов
+- Пройдено тренировок: {stats.total_trainings}
+- Всего задано вопросов: {stats.total_questions}
+- Лучший результат: {stats.best_score} баллов
+- Уровень: {level_data.get('emoji', '')} {level_data.get('level', 1)} «{level_data.get('name', '')}», {stats.total_xp} XP
 
 🏆 Заработанные награды:
-{chr(10).join(stats['badges_earned'][-5:]) if stats['badges_earned'] else '• Пока нет наград'}
+{chr(10).join(stats.badges_earned[-5:]) if stats.badges_earned else '• Пока нет наград'}
 
 ⏱ Последняя тренировка:
-{stats['last_training_date'] if stats['last_training_date'] else 'Ещё не проводилась'}
+{stats.last_training_date if stats.last_training_date else 'Ещё не проводилась'}
 
 📍 Текущий статус:
 {session_status}
@@ -842,17 +1447,18 @@ async def case_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Показать информацию о текущем кейсе"""
     user_id = update.effective_user.id
     
-    if user_id not in user_data:
+    user = _find_user_data(user_id)
+    if user is None:
         await update.message.reply_text('Начните тренировку командой /start')
         return
     
-    session = user_data[user_id]['session']
+    session = user.session
     
-    if session['chat_state'] != 'training_active':
+    if session.chat_state != 'training_active':
         await update.message.reply_text('Нет активного кейса. Начните тренировку написав "начать"')
         return
     
-    case_data = session.get('case_data')
+    case_data = session.case_data
     if not case_data:
         await update.message.reply_text('Данные кейса недоступны')
         return
@@ -873,8 +1479,8 @@ async def case_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
 🎯 Ситуация: {case_data['situation']['type']}
 
 📊 Ваш прогресс:
-- Вопросов задано: {session['question_count']}/10
-- Уровень ясности: {session['clarity_level']}%
+- Вопросов задано: {session.question_count}/10
+- Уровень ясности: {session.clarity_level}%
 
 💬 Продолжайте задавать вопросы клиенту!"""
 
@@ -903,32 +1509,28 @@ async def rank_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Показать текущий ранг и прогресс"""
     user_id = update.effective_user.id
     
-    if user_id not in user_data:
+    user = _find_user_data(user_id)
+    if user is None:
         await update.message.reply_text('У вас пока нет статистики. Начните тренировку командой /start')
         return
     
     cfg = _ensure_scenario_loaded()
-    stats = user_data[user_id]['stats']
-    levels = cfg.get('ranking', {}).get('levels', [])
-    current_level = stats.get('current_level', 1)
-    current_level_data = next((l for l in levels if l.get('level') == current_level), (levels[0] if levels else {'level': 1, 'name': 'Новичок', 'emoji': '🌱', 'min_xp': 0, 'description': ''}))
-    next_level_data = next((l for l in levels if l.get('level') == current_level + 1), None)
-    current_xp = int(stats.get('total_xp', 0))
+    stats = user.stats
+    current_level = stats.current_level
+    current_level_data = level_index.get(current_level)
+    current_xp = stats.total_xp
+    next_level_data, xp_to_next, percent = level_index.progress(current_xp, current_level)
     
     if next_level_data:
-        xp_needed = int(next_level_data.get('min_xp', 0)) - int(current_level_data.get('min_xp', 0))
-        xp_current = current_xp - int(current_level_data.get('min_xp', 0))
-        percent = max(0, min(100, int((xp_current / xp_needed) * 100))) if xp_needed > 0 else 100
         filled = "█" * (percent // 10)
         empty = "░" * (10 - percent // 10)
         progress_bar = f"\n[{filled}{empty}] {percent}%"
-        xp_to_next = int(next_level_data.get('min_xp', 0)) - current_xp
         next_level_info = f"\n\n📊 До уровня {next_level_data.get('level')} \"{next_level_data.get('name', '')}\":\nНужно: {max(xp_to_next, 0)} XP{progress_bar}"
     else:
         next_level_info = "\n\n🏆 Вы достигли максимального уровня!"
     
     achievements = cfg.get('achievements', {}).get('list', [])
-    unlocked = stats.get('achievements_unlocked', [])
+    unlocked = stats.achievements_unlocked
     achievements_text = f"\n\n🎖️ ДОСТИЖЕНИЯ ({len(unlocked)}/{len(achievements)}):\n"
     for ach in achievements:
         status = "✅" if ach.get('id') in unlocked else "⬜"
@@ -943,10 +1545,149 @@ async def rank_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
 🎯 Продолжайте тренировки для повышения уровня!"""
 
     await update.message.reply_text(rank_message)
+async def _post_init(application: Application) -> None:
+    """Создание общих пулов соединений к LLM при старте приложения."""
+    providers = {
+        RESPONSE_PRIMARY_PROVIDER, RESPONSE_FALLBACK_PROVIDER,
+        FEEDBACK_PRIMARY_PROVIDER, FEEDBACK_FALLBACK_PROVIDER,
+        CLASSIFICATION_PRIMARY_PROVIDER, CLASSIFICATION_FALLBACK_PROVIDER,
+    }
+    await llm_clients.start([p for p in providers if p in ('openai', 'anthropic')])
+    # Прогрев данных недавно активных пользователей и запуск фоновой записи
+    warmed = 0
+    warm_limit = min(USER_STORE_WARM_LIMIT, SESSION_CACHE_MAX_ENTRIES) if SESSION_CACHE_MAX_ENTRIES > 0 else USER_STORE_WARM_LIMIT
+    for user_id, data in user_store.recent(warm_limit):
+        user_data.setdefault(user_id, _with_defaults(data))
+        warmed += 1
+    logger.info(f"Загружено пользователей из хранилища: {warmed}")
+    user_store.start()
+    if analysis_cache is not None and CLASSIFICATION_CACHE_PATH:
+        try:
+            restored = await asyncio.to_thread(analysis_cache.load)
+            logger.info(f"Кэш классификации: восстановлено записей {restored}")
+        except Exception as e:
+            logger.warning(f"Не удалось загрузить кэш классификации: {e}")
+
+async def _post_shutdown(application: Application) -> None:
+    """Сохранение данных пользователей и закрытие пулов соединений к LLM при остановке."""
+    logger.info(f"Кэш сессий: {user_data.stats()}")
+    logger.info(f"Ходы пользователей: {turn_serializer.stats()}")
+    logger.info(f"Предохранители LLM: {llm_breakers.stats()}")
+    logger.info(f"Лимиты LLM: {llm_rate_limits.stats()}")
+    logger.info(f"Деградация ходов: {degradation.stats()}")
+    if LLM_HEDGE_PIPELINES:
+        logger.info(f"Хеджирование LLM: {hedge_budget.stats()}")
+    if question_analyzer.local_classifier is not None:
+        logger.info(
+            f"Локальный классификатор: ответил {question_analyzer.local_answered}, "
+            f"передал в LLM {question_analyzer.local_routed}"
+        )
+    if question_analyzer.label_log is not None:
+        question_analyzer.label_log.close()
+    if analysis_cache is not None:
+        logger.info(f"Кэш классификации: {analysis_cache.stats()}")
+        if CLASSIFICATION_CACHE_PATH:
+            try:
+                saved = await asyncio.to_thread(analysis_cache.save)
+                logger.info(f"Кэш классификации сохранён: {saved} записей")
+            except Exception as e:
+                logger.warning(f"Не удалось сохранить кэш классификации: {e}")
+    await user_store.stop()
+    await llm_clients.aclose()
+
+def _concurrent_updates() -> Union[bool, int]:
+    """CONCURRENT_UPDATES: true/false или лимит одновременно обрабатываемых апдейтов."""
+    if CONCURRENT_UPDATES.isdigit():
+        return int(CONCURRENT_UPDATES)
+    return CONCURRENT_UPDATES in ('1', 'true', 'yes')
+
+def _metrics() -> Dict[str, Any]:
+    """Снимок метрик для /metrics."""
+    metrics: Dict[str, Any] = {
+        'sessions': user_data.stats(),
+        'turns': turn_serializer.stats(),
+        'llm_breakers': llm_breakers.stats(),
+        'llm_rate_limits': llm_rate_limits.stats(),
+        'degradation': degradation.stats(),
+    }
+    if LLM_HEDGE_PIPELINES:
+        metrics['llm_hedging'] = hedge_budget.stats()
+    if analysis_cache is not None:
+        metrics['analysis_cache'] = analysis_cache.stats()
+    return metrics
+
+async def _serve(application: Application) -> None:
+    """Жизненный цикл бота на одном event loop: HTTP-сервер, приём апдейтов, остановка по сигналу."""
+    webhook = BOT_MODE == 'webhook'
+    ready = False
+
+    async def enqueue(data: Dict[str, Any]) -> None:
+        # Только постановка в очередь: ответ Telegram уходит сразу, ход обрабатывается в фоне
+        await application.update_queue.put(Update.de_json(data, application.bot))
+
+    server = WebhookServer(
+        '0.0.0.0',
+        PORT,
+        on_update=enqueue if webhook else None,
+        webhook_path=WEBHOOK_PATH if webhook else None,
+        secret_token=WEBHOOK_SECRET if webhook else None,
+        ready=lambda: ready and scenario_config is not None,
+        metrics=_metrics,
+        metrics_token=METRICS_TOKEN or None,
+    )
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, stop.set)
+        except NotImplementedError:
+            pass
+
+    initialized = False
+    try:
+        await application.initialize()
+        initialized = True
+        if application.post_init:
+            await application.post_init(application)
+        await server.start()
+        if webhook:
+            await application.bot.set_webhook(
+                url=f"{WEBHOOK_URL}{WEBHOOK_PATH}",
+                secret_token=WEBHOOK_SECRET,
+                allowed_updates=Update.ALL_TYPES,
+            )
+            logger.info(f"Webhook установлен: {WEBHOOK_URL}{WEBHOOK_PATH}")
+        else:
+            await application.updater.start_polling()
+            logger.info("Получение апдейтов: long polling")
+        await application.start()
+        ready = True
+        await stop.wait()
+    finally:
+        ready = False
+        logger.info("Остановка бота...")
+        # Webhook не удаляется: входящий апдейт разбудит остановленную машину (auto_start_machines)
+        if application.updater.running:
+            await application.updater.stop()
+        if application.running:
+            await application.stop()
+        await server.stop()
+        if initialized:
+            await application.shutdown()
+            if application.post_shutdown:
+                await application.post_shutdown(application)
+
 def main():
     """Запуск бота"""
     # Создание приложения
-    application = Application.builder().token(BOT_TOKEN).build()
+    application = (
+        Application.builder()
+        .token(BOT_TOKEN)
+        .concurrent_updates(_concurrent_updates())
+        .post_init(_post_init)
+        .post_shutdown(_post_shutdown)
+        .build()
+    )
     
     # Предварительная загрузка сценария с обработкой ошибок
     try:
@@ -955,7 +1696,8 @@ def main():
         logger.exception("Критическая ошибка загрузки сценария. Проверьте SCENARIO_PATH и формат config.json")
         # Продолжаем запускать бота, но команды будут возвращать ошибки при обращении к сценарию
     
-    # Добавление обработчиков
+    # Добавление обработчиков; группа -1 выполняется раньше остальных для каждого апдейта
+    application.add_handler(TypeHandler(Update, _prefetch_user_data), group=-1)
     application.add_handler(CommandHandler("start", start_command))
     application.add_handler(CommandHandler("help", help_command))
     application.add_handler(CommandHandler("scenario", scenario_command))
@@ -967,51 +1709,17 @@ def main():
     application.add_handler(CommandHandler("rank", rank_command))
     application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handle_message))
     
-    # Запуск бота
-    logger.info("SPIN Training Bot запущен!")
-    
-    # Запускаем простой веб-сервер для health checks
-    from http.server import HTTPServer, BaseHTTPRequestHandler
-    import socket
-    import threading
-    
-    class HealthCheckHandler(BaseHTTPRequestHandler):
-        def do_GET(self):
-            if self.path == '/health':
-                self.send_response(200)
-                self.send_header('Content-type', 'text/plain')
-                self.end_headers()
-                self.wfile.write(b'OK')
-            else:
-                self.send_response(404)
-                self.end_headers()
-        
-        def log_message(self, format, *args):
-            # Отключаем логирование HTTP запросов
-            pass
-    
-    # Находим свободный порт
-    def find_free_port():
-        with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
-            s.bind(('', 0))
-            s.listen(1)
-            port = s.getsockname()[1]
-        return port
-    
-    port = int(os.getenv('PORT', 8080))
-    
-    # Запускаем health-check сервер в отдельном потоке
-    try:
-        server = HTTPServer(('0.0.0.0', port), HealthCheckHandler)
-        logger.info(f"Health check server запущен на порту {port}")
-        server_thread = threading.Thread(target=server.serve_forever, daemon=True)
-        server_thread.start()
-    except Exception as e:
-        logger.error(f"Ошибка запуска health check сервера: {e}")
+    if BOT_MODE not in ('webhook', 'polling'):
+        raise SystemExit(f"Неизвестный BOT_MODE={BOT_MODE!r}: ожидается webhook или polling")
+    if BOT_MODE == 'webhook' and not WEBHOOK_URL:
+        raise SystemExit("BOT_MODE=webhook требует WEBHOOK_URL (публичный https-адрес бота)")
+    if BOT_MODE == 'webhook' and not re.fullmatch(r'[A-Za-z0-9_-]{1,256}', WEBHOOK_SECRET):
+        raise SystemExit("BOT_MODE=webhook требует WEBHOOK_SECRET: 1-256 символов A-Z, a-z, 0-9, _ и - (fly secrets set WEBHOOK_SECRET=...)")
 
-    # Запускаем бота (основной поток)
+    # Запуск бота
+    logger.info(f"SPIN Training Bot запущен! Режим: {BOT_MODE}, порт {PORT}")
     try:
-        application.run_polling()
+        asyncio.run(_serve(application))
     except Exception:
         logger.exception("Критическая ошибка запуска бота")
 
@@ -0,0 +1,13 @@
+#!/bin/sh
+set -e
+
+# Volume Fly.io монтируется с владельцем root: отдаём каталог хранилища пользователю бота
+# и запускаем процесс уже без прав root
+if [ "$(id -u)" = "0" ]; then
+    store_dir="$(dirname "${USER_STORE_PATH:-data/users.sqlite3}")"
+    mkdir -p "$store_dir"
+    chown -R botuser:botuser "$store_dir"
+    exec setpriv --reuid=botuser --regid=botuser --init-groups "$@"
+fi
+
+exec "$@"
@@ -0,0 +1,173 @@
+"""Achievement rule engine.
+
+Conditions from ``achievements.list[].condition`` are parsed once with
+``ast`` and compiled into plain Python closures. Only a whitelisted subset
+of expressions is accepted (names, literals, comparisons, boolean and
+arithmetic operators), so no ``eval`` happens at check time. Rules are
+indexed by the fields they read, which lets callers re-evaluate only the
+rules whose inputs changed.
+"""
+
+import ast
+import logging
+import operator
+from dataclasses import dataclass
+from typing import Any, Callable, Collection, Dict, FrozenSet, Iterable, List, Mapping, Optional
+
+from .scenario_loader import ScenarioValidationError
+
+logger = logging.getLogger(__name__)
+
+Evaluator = Callable[[Mapping[str, Any]], Any]
+
+_COMPARE_OPS = {
+    ast.Eq: operator.eq,
+    ast.NotEq: operator.ne,
+    ast.Lt: operator.lt,
+    ast.LtE: operator.le,
+    ast.Gt: operator.gt,
+    ast.GtE: operator.ge,
+    ast.In: lambda a, b: a in b,
+    ast.NotIn: lambda a, b: a not in b,
+}
+
+_BIN_OPS = {
+    ast.Add: operator.add,
+    ast.Sub: operator.sub,
+    ast.Mult: operator.mul,
+    ast.Div: operator.truediv,
+    ast.FloorDiv: operator.floordiv,
+    ast.Mod: operator.mod,
+}
+
+_UNARY_OPS = {
+    ast.Not: operator.not_,
+    ast.USub: operator.neg,
+    ast.UAdd: operator.pos,
+}
+
+
+def _compile_node(node: ast.AST, names: set) -> Evaluator:
+    if isinstance(node, ast.Constant) and isinstance(node.value, (int, float, str, bool, type(None))):
+        value = node.value
+        return lambda ns: value
+    if isinstance(node, ast.Name) and isinstance(node.ctx, ast.Load):
+        name = node.id
+        names.add(name)
+        return lambda ns: ns[name]
+    if isinstance(node, (ast.List, ast.Tuple, ast.Set)):
+        items = [_compile_node(elt, names) for elt in node.elts]
+        return lambda ns: tuple(item(ns) for item in items)
+    if isinstance(node, ast.BoolOp):
+        values = [_compile_node(v, names) for v in node.values]
+        if isinstance(node.op, ast.And):
+            def _and(ns):
+                result = True
+                for value in values:
+                    result = value(ns)
+                    if not result:
+                        return result
+                return result
+            return _and
+        def _or(ns):
+            result = False
+            for value in values:
+                result = value(ns)
+                if result:
+                    return result
+            return result
+        return _or
+    if isinstance(node, ast.UnaryOp) and type(node.op) in _UNARY_OPS:
+        op = _UNARY_OPS[type(node.op)]
+        operand = _compile_node(node.operand, names)
+        return lambda ns: op(operand(ns))
+    if isinstance(node, ast.BinOp) and type(node.op) in _BIN_OPS:
+        op = _BIN_OPS[type(node.op)]
+        left = _compile_node(node.left, names)
+        right = _compile_node(node.right, names)
+        return lambda ns: op(left(ns), right(ns))
+    if isinstance(node, ast.Compare) and all(type(o) in _COMPARE_OPS for o in node.ops):
+        left = _compile_node(node.left, names)
+        ops = [_COMPARE_OPS[type(o)] for o in node.ops]
+        rights = [_compile_node(c, names) for c in node.comparators]
+
+        def _compare(ns):
+            current = left(ns)
+            for op, right in zip(ops, rights):
+                value = right(ns)
+                if not op(current, value):
+                    return False
+                current = value
+            return True
+        return _compare
+    raise ScenarioValidationError(f"Unsupported expression in achievement condition: {ast.dump(node)[:80]}")
+
+
+def compile_condition(condition: str) -> "tuple[Evaluator, FrozenSet[str]]":
+    """Compile a condition string; returns the evaluator and the names it reads."""
+    try:
+        tree = ast.parse(condition, mode='eval')
+    except SyntaxError as e:
+        raise ScenarioValidationError(f"Invalid achievement condition {condition!r}: {e}") from e
+    names: set = set()
+    evaluator = _compile_node(tree.body, names)
+    return evaluator, frozenset(names)
+
+
+@dataclass(frozen=True)
+class AchievementRule:
+    """A compiled achievement: config entry, evaluator and input fields."""
+    id: str
+    achievement: Dict[str, Any]
+    evaluate: Evaluator
+    fields: FrozenSet[str]
+
+
+class AchievementEngine:
+    """Compiled achievement rules indexed by the fields they depend on."""
+
+    def __init__(self, achievements: List[Dict[str, Any]], known_fields: Optional[Collection[str]] = None) -> None:
+        self.rules: List[AchievementRule] = []
+        self.rules_by_field: Dict[str, List[AchievementRule]] = {}
+        for ach in achievements:
+            condition = str(ach.get('condition', '')).strip()
+            if not condition:
+                raise ScenarioValidationError(f"Achievement {ach.get('id')} has no condition")
+            evaluate, fields = compile_condition(condition)
+            if known_fields is not None:
+                unknown = fields - set(known_fields)
+                if unknown:
+                    raise ScenarioValidationError(
+                        f"Achievement {ach.get('id')} uses unknown fields: {', '.join(sorted(unknown))}"
+                    )
+            rule = AchievementRule(ach.get('id'), ach, evaluate, fields)
+            self.rules.append(rule)
+            for field in fields:
+                self.rules_by_field.setdefault(field, []).append(rule)
+        logger.info("Achievement rules compiled: %d (fields: %s)", len(self.rules), ", ".join(sorted(self.rules_by_field)))
+
+    def candidates(self, changed: Optional[Iterable[str]] = None) -> List[AchievementRule]:
+        """Rules to re-evaluate: all when ``changed`` is None, otherwise those reading a changed field."""
+        if changed is None:
+            return self.rules
+        selected = {id(rule): rule for field in changed for rule in self.rules_by_field.get(field, ())}
+        # Сохраняем порядок из конфига сценария
+        return [rule for rule in self.rules if id(rule) in selected]
+
+    def evaluate(
+        self,
+        namespace: Mapping[str, Any],
+        unlocked: Collection[str],
+        changed: Optional[Iterable[str]] = None,
+    ) -> List[Dict[str, Any]]:
+        """Return config entries of locked achievements whose condition now holds."""
+        newly_unlocked = []
+        for rule in self.candidates(changed):
+            if rule.id in unlocked:
+                continue
+            try:
+                if rule.evaluate(namespace):
+                    newly_unlocked.append(rule.achievement)
+            except Exception as e:
+                logger.error("Achievement %s evaluation failed: %s", rule.id, e)
+        return newly_unlocked
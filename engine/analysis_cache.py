@@ -0,0 +1,185 @@
+"""Cache of LLM question-analysis results (SPIN type and context check).
+
+Classification labels are keyed by the normalized question text plus a
+case-context fingerprint; context-check verdicts by the normalized question
+plus a fingerprint of the client's last response. Entries live in a bounded
+LRU/TTL ``SessionCache`` and can be snapshotted to a JSON file. A character
+trigram similarity tier lets near-duplicate questions ("Сколько у вас
+сейчас поставщиков?" vs "Сколько поставщиков у вас сейчас?") reuse a cached
+label when their Dice similarity reaches the threshold.
+"""
+
+import hashlib
+import json
+import logging
+import re
+import time
+from collections import Counter
+from pathlib import Path
+from typing import Any, Dict, FrozenSet, Optional, Set, Tuple
+
+from .session_cache import SessionCache
+
+logger = logging.getLogger(__name__)
+
+CacheKey = Tuple[str, str, str]
+
+_NON_WORD = re.compile(r"[^\w\s]+")
+_SPACES = re.compile(r"\s+")
+
+
+def normalize_question(text: str) -> str:
+    """Lowercase, ё→е, drop punctuation and collapse whitespace."""
+    text = (text or "").lower().replace("ё", "е")
+    return _SPACES.sub(" ", _NON_WORD.sub(" ", text)).strip()
+
+
+def fingerprint(text: str) -> str:
+    """Short stable hash of a (normalized) text."""
+    return hashlib.sha1(normalize_question(text).encode("utf-8")).hexdigest()[:16]
+
+
+def _trigrams(normalized: str) -> FrozenSet[str]:
+    padded = f" {normalized} "
+    return frozenset(padded[i:i + 3] for i in range(len(padded) - 2))
+
+
+class AnalysisCache:
+    """Exact + similarity cache for classification, exact cache for context checks."""
+
+    def __init__(
+        self,
+        max_entries: int = 20000,
+        ttl: float = 7 * 24 * 3600,
+        similarity_threshold: float = 0.85,
+        path: Optional[str] = None,
+        clock=time.time,
+    ) -> None:
+        self.similarity_threshold = similarity_threshold
+        self.path = Path(path).expanduser() if path else None
+        self._clock = clock
+        self._entries = SessionCache(max_entries, ttl, on_evict=self._on_evict, clock=clock)
+        # (context_key, trigram) -> нормализованные вопросы с этим триграммом
+        self._postings: Dict[Tuple[str, str], Set[str]] = {}
+        self._grams: Dict[Tuple[str, str], FrozenSet[str]] = {}
+        self.exact_hits = 0
+        self.similar_hits = 0
+        self.misses = 0
+        self.stores = 0
+
+    # --- классификация ---
+
+    def get_label(self, question: str, context_key: str, record: bool = True) -> Optional[str]:
+        """Cached label (exact, then similar); ``record=False`` leaves hit/miss counters untouched."""
+        normalized = normalize_question(question)
+        label = self._entries.get(('classification', normalized, context_key))
+        if label is not None:
+            self.exact_hits += record
+            return label
+        if self.similarity_threshold > 0:
+            label = self._similar_label(normalized, context_key)
+            if label is not None:
+                self.similar_hits += record
+                return label
+        self.misses += record
+        return None
+
+    def put_label(self, question: str, context_key: str, label: str) -> None:
+        normalized = normalize_question(question)
+        self._entries[('classification', normalized, context_key)] = label
+        self._index(normalized, context_key)
+        self.stores += 1
+
+    def _index(self, normalized: str, context_key: str) -> None:
+        grams = _trigrams(normalized)
+        self._grams[(context_key, normalized)] = grams
+        for gram in grams:
+            self._postings.setdefault((context_key, gram), set()).add(normalized)
+
+    def _similar_label(self, normalized: str, context_key: str) -> Optional[str]:
+        grams = _trigrams(normalized)
+        shared: Counter = Counter()
+        for gram in grams:
+            shared.update(self._postings.get((context_key, gram), ()))
+        best, best_score = None, 0.0
+        for candidate, common in shared.items():
+            score = 2.0 * common / (len(grams) + len(self._grams[(context_key, candidate)]))
+            if score > best_score:
+                best, best_score = candidate, score
+        if best is None or best_score < self.similarity_threshold:
+            return None
+        return self._entries.get(('classification', best, context_key))
+
+    # --- проверка контекста ---
+
+    def get_context(self, question: str, last_response: str, record: bool = True) -> Optional[bool]:
+        verdict = self._entries.get(('context', normalize_question(question), fingerprint(last_response)))
+        if verdict is None:
+            self.misses += record
+            return None
+        self.exact_hits += record
+        return verdict
+
+    def put_context(self, question: str, last_response: str, verdict: bool) -> None:
+        self._entries[('context', normalize_question(question), fingerprint(last_response))] = bool(verdict)
+        self.stores += 1
+
+    # --- служебное ---
+
+    def _on_evict(self, key: CacheKey, value: Any) -> None:
+        kind, normalized, context_key = key
+        if kind != 'classification':
+            return
+        for gram in self._grams.pop((context_key, normalized), ()):
+            bucket = self._postings.get((context_key, gram))
+            if bucket is not None:
+                bucket.discard(normalized)
+                if not bucket:
+                    del self._postings[(context_key, gram)]
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.exact_hits + self.similar_hits + self.misses
+        cache_stats = self._entries.stats()
+        return {
+            'size': cache_stats['size'],
+            'exact_hits': self.exact_hits,
+            'similar_hits': self.similar_hits,
+            'misses': self.misses,
+            'hit_rate': round((self.exact_hits + self.similar_hits) / lookups, 4) if lookups else 0.0,
+            'stores': self.stores,
+            'evictions_lru': cache_stats['evictions_lru'],
+            'evictions_ttl': cache_stats['evictions_ttl'],
+        }
+
+    def load(self) -> int:
+        """Load a JSON snapshot (if ``path`` is set); returns the number of entries restored."""
+        if self.path is None or not self.path.exists():
+            return 0
+        try:
+            rows = json.loads(self.path.read_text(encoding='utf-8'))
+        except (OSError, ValueError) as e:
+            logger.warning("Analysis cache snapshot %s is unreadable: %s", self.path, e)
+            return 0
+        now = self._clock()
+        ttl = self._entries.idle_ttl
+        restored = 0
+        for kind, normalized, context_key, value, stored_at in rows:
+            if ttl > 0 and now - stored_at > ttl:
+                continue
+            # Сохраняем исходное время записи: перезапуск не должен продлевать TTL
+            self._entries.restore((kind, normalized, context_key), value, stored_at)
+            if kind == 'classification':
+                self._index(normalized, context_key)
+            restored += 1
+        return restored
+
+    def save(self) -> int:
+        """Write a JSON snapshot (if ``path`` is set); returns the number of entries written."""
+        if self.path is None:
+            return 0
+        rows = [[*key, value, stored_at] for key, value, stored_at in self._entries.items()]
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = self.path.with_suffix(self.path.suffix + '.tmp')
+        tmp.write_text(json.dumps(rows, ensure_ascii=False), encoding='utf-8')
+        tmp.replace(self.path)
+        return len(rows)
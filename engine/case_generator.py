@@ -2,10 +2,16 @@ import random
 import logging
 from typing import Dict, List, Any
 
+from .case_space import CaseSpace
+
 logger = logging.getLogger(__name__)
 
 class CaseGenerator:
     """Генератор случайных кейсов для тренировки"""
+
+    FALLBACK_POSITIONS = ("Владелец бизнеса", "Управляющий", "Коммерческий директор")
+    # Максимальный объём капитального оборудования: больше — нереалистичный кейс
+    CAPITAL_VOLUME_CAP = 50
     
     def __init__(self, case_variants: Dict[str, Any]):
         """
@@ -26,7 +32,37 @@ class CaseGenerator:
         for product in self.variants.get('products', []):
             compatible = product.get('compatible_companies', [])
             self.product_company_index[product['name']] = compatible
-        
+
+        # Обратный индекс: тип компании -> совместимые продукты
+        self.products_by_company: Dict[str, List[Dict[str, Any]]] = {}
+        for product in self.variants.get('products', []):
+            for company_type in product.get('compatible_companies', []):
+                self.products_by_company.setdefault(company_type, []).append(product)
+
+        # Выбираем только компании, для которых существует хотя бы один валидный кейс
+        self.valid_companies: List[Dict[str, Any]] = []
+        self.sizes_by_company: Dict[str, List[str]] = {}
+        for company in self.variants.get('companies', []):
+            if not self.products_by_company.get(company['type']):
+                logger.error(f"❌ НЕТ совместимых продуктов для {company['type']}! Компания исключена из генерации")
+                continue
+            self.sizes_by_company[company['type']] = list(company.get('typical_sizes') or self.variants['company_sizes'])
+            self.valid_companies.append(company)
+
+        # Размер компании -> допустимые должности
+        self.positions_by_size: Dict[str, List[str]] = {}
+        for sizes in self.sizes_by_company.values():
+            for size in sizes:
+                if size in self.positions_by_size:
+                    continue
+                positions = self.variants.get('positions_by_size', {}).get(size, [])
+                if not positions:
+                    logger.error(f"Нет должностей для размера {size} — fallback к универсальным")
+                    positions = list(self.FALLBACK_POSITIONS)
+                self.positions_by_size[size] = positions
+        if not self.valid_companies:
+            raise ValueError("case_variants: нет ни одной компании с совместимыми продуктами")
+
         # Группируем продукты по единицам измерения для оптимизации генерации объёмов
         self.products_by_unit = {}
         for product in self.variants.get('products', []):
@@ -34,101 +70,65 @@ class CaseGenerator:
             if unit not in self.products_by_unit:
                 self.products_by_unit[unit] = []
             self.products_by_unit[unit].append(product)
+
+        # Все валидные комбинации (компания, размер, должность, продукт) с весами
+        self.case_space = CaseSpace(
+            self.valid_companies, self.sizes_by_company, self.positions_by_size, self.products_by_company
+        )
     
-    def generate_random_case(self, exclude_recent: List[str] = None) -> Dict[str, Any]:
+    def generate_random_case(self) -> Dict[str, Any]:
         """
-        Генерация случайного ЛОГИЧНОГО кейса с валидацией
+        Генерация случайного ЛОГИЧНОГО кейса (взвешенная выборка из пространства валидных кейсов)
         """
-        max_attempts = 30
-        attempts = 0
-        last_case = None
-        
-        while attempts < max_attempts:
-            # ШАГ 1: Компания
-            company = random.choice(self.variants['companies'])
-            # ШАГ 2: Размер
-            size = self._select_compatible_size(company)
-            # ШАГ 3: Должность
-            position = self._select_position_for_size(size)
-            # ШАГ 4: Продукт
-            product = self._select_compatible_product(company)
-            # ШАГ 5: Объём
-            volume = self._generate_volume(product, size)
-            # ШАГ 6: Частота
-            frequency = self._select_frequency(product)
-            # ШАГ 7: Характер закупки
-            urgency = random.choice(['плановая закупка', 'замена поставщика', 'новый проект', 'срочная потребность'])
-            # ШАГ 8: Остальное
-            region = random.choice(self.variants['regions'])
-            situation = random.choice(self.variants['base_situations'])
-            suppliers_count = random.randint(1, 5)
-
-            case_data = {
-                'position': position,
-                'company': company,
-                'company_size': size,
-                'region': region,
-                'product': product,
-                'situation': situation,
-                'volume': volume,
-                'suppliers_count': suppliers_count,
-                'frequency': frequency,
-                'urgency': urgency
-            }
-
-            validated = self._validate_case_logic(case_data)
-            logger.info(f"\n╔════════ ГЕНЕРАЦИЯ КЕЙСА ════════╗\n"
-                        f"║ Компания: {company['type']}\n"
-                        f"║ Размер: {size}\n"
-                        f"║ Должность: {position}\n"
-                        f"║ Продукт: {product['name']}\n"
-                        f"║ Объём: {volume}\n"
-                        f"║ Частота: {frequency}\n"
-                        f"║ Регион: {region}\n"
-                        f"║ Валидация: {'PASSED' if validated else 'FAILED'}\n"
-                        f"╚══════════════════════════════════╝")
-
-            if not validated:
-                attempts += 1
-                last_case = case_data
-                continue
+        return self._build_case(self.case_space.sample())
 
-            # Проверка уникальности
-            case_hash = self._get_case_hash(case_data)
-            if exclude_recent is None or case_hash not in exclude_recent:
-                logger.info(f"✅ Сгенерирован логичный кейс: {position} | {company['type']} ({size}) | {product['name']} | {volume}")
-                return case_data
-            attempts += 1
-            last_case = case_data
+    def generate_case_at(self, seed: int, cursor: int) -> Dict[str, Any]:
+        """
+        Кейс номер ``cursor`` в персональной перестановке пользователя ``seed``
 
-        logger.warning("Не удалось найти полностью уникальный кейс после валидации")
-        return last_case or {}
-    
-    def _select_compatible_size(self, company: Dict[str, Any]) -> str:
-        typical_sizes = company.get('typical_sizes', self.variants['company_sizes'])
-        return random.choice(typical_sizes)
-
-    def _select_position_for_size(self, company_size: str) -> str:
-        positions = self.variants.get('positions_by_size', {}).get(company_size, [])
-        if not positions:
-            logger.error(f"Нет должностей для размера {company_size} — fallback к универсальным")
-            positions = ["Владелец бизнеса", "Управляющий", "Коммерческий директор"]
-        return random.choice(positions)
-
-    def _select_compatible_product(self, company: Dict[str, Any]) -> Dict[str, Any]:
-        compatible_products = [
-            p for p in self.variants['products']
-            if company['type'] in p.get('compatible_companies', [])
-        ]
-        if not compatible_products:
-            logger.error(f"❌ НЕТ совместимых продуктов для {company['type']}! Проверьте config.json")
-            compatible_products = [p for p in self.variants['products'] if 'услуг' in p.get('name', '').lower()]
-            if not compatible_products:
-                logger.critical("Критическая ошибка: нет даже универсальных продуктов! Берём первые 3")
-                compatible_products = self.variants['products'][:3]
-        product = random.choice(compatible_products)
-        logger.info(f"Выбран продукт: {product['name']} для {company['type']}")
-        return product
+        Внутри одного прохода по пространству кейсов комбинация
+        (должность, компания, размер, продукт) не повторяется.
+        """
+        return self._build_case(self.case_space.at(seed, cursor))
+
+    @staticmethod
+    def new_seed() -> int:
+        """Сид персональной перестановки кейсов для нового пользователя"""
+        return random.getrandbits(31) or 1
+
+    def _build_case(self, index: int) -> Dict[str, Any]:
+        """Заполнение переменных параметров кейса для выбранной комбинации"""
+        company, size, position, product = self.case_space.combos[index]
+        volume = self._generate_volume(product, size)
+        frequency = self._select_frequency(product)
+        urgency = random.choice(['плановая закупка', 'замена поставщика', 'новый проект', 'срочная потребность'])
+        region = random.choice(self.variants['regions'])
+        situation = random.choice(self.variants['base_situations'])
+        suppliers_count = random.randint(1, 5)
+
+        case_data = {
+            'position': position,
+            'company': company,
+            'company_size': size,
+            'region': region,
+            'product': product,
+            'situation': situation,
+            'volume': volume,
+            'suppliers_count': suppliers_count,
+            'frequency': frequency,
+            'urgency': urgency
+        }
+        logger.info(f"\n╔════════ ГЕНЕРАЦИЯ КЕЙСА ════════╗\n"
+                    f"║ Компания: {company['type']}\n"
+                    f"║ Размер: {size}\n"
+                    f"║ Должность: {position}\n"
+                    f"║ Продукт: {product['name']}\n"
+                    f"║ Объём: {volume}\n"
+                    f"║ Частота: {frequency}\n"
+                    f"║ Регион: {region}\n"
+                    f"║ Комбинация: #{index} из {len(self.case_space)}\n"
+                    f"╚══════════════════════════════════╝")
+        return case_data
     
     def _generate_volume(self, product: Dict[str, Any], company_size: str) -> str:
         """Генерация АДЕКВАТНОГО объёма с учётом размера компании и продукта"""
@@ -144,6 +144,10 @@ class CaseGenerator:
         base_max = int(volume_range.get('max', base_min))
         scaled_min = max(1, int(base_min * multiplier))
         scaled_max = max(scaled_min, int(base_max * multiplier))
+        if product.get('is_capital_equipment'):
+            # Не выходим за реалистичный лимит для капитального оборудования
+            cap = max(self.CAPITAL_VOLUME_CAP, base_max)
+            scaled_min, scaled_max = min(scaled_min, cap), min(scaled_max, cap)
         volume = random.randint(scaled_min, scaled_max)
         unit = product.get('unit', 'единиц')
         logger.info(f"Объём для {company_size}: {volume} {unit} (диапазон: {scaled_min}-{scaled_max})")
@@ -159,62 +163,6 @@ class CaseGenerator:
             return random.choice(['по проекту', 'при модернизации'])
         return 'ежемесячно'
 
-    def _validate_case_logic(self, case_data: Dict[str, Any]) -> bool:
-        """Валидация логичности сгенерированного кейса."""
-        errors = []
-
-        product = case_data['product']
-        company_type = case_data['company']['type']
-        size = case_data['company_size']
-        position = case_data['position']
-        frequency = case_data['frequency']
-
-        # 1) Совместимость продукт-компания
-        if company_type not in product.get('compatible_companies', []):
-            errors.append(f"Продукт {product.get('name')} несовместим с {company_type}")
-
-        # 2) Должность соответствует размеру
-        valid_positions = self.variants.get('positions_by_size', {}).get(size, [])
-        if valid_positions and position not in valid_positions:
-            errors.append(f"Должность {position} не подходит для {size}")
-
-        # 3) Объём адекватен: извлечь число
-        try:
-            volume_num = int(str(case_data['volume']).split()[0])
-        except Exception:
-            volume_num = None
-        if volume_num is not None and product.get('is_capital_equipment'):
-            if volume_num > max(50, product.get('volume_range', {}).get('max', 50)):
-                errors.append(f"Слишком большой объём ({volume_num}) для капввода {product.get('name')}")
-
-        # 4) Частота соответствует продукту (если варианты заданы)
-        valid_freqs = product.get('frequency_options')
-        if isinstance(valid_freqs, list) and valid_freqs and frequency not in valid_freqs:
-            errors.append(f"Частота '{frequency}' не подходит для {product.get('name')}")
-
-        # 5) Размер компании типичен для типа компании (если указаны типичные)
-        typical_sizes = case_data['company'].get('typical_sizes')
-        if isinstance(typical_sizes, list) and typical_sizes and size not in typical_sizes:
-            errors.append(f"Размер {size} нетипичен для {company_type}")
-
-        if errors:
-            logger.warning("❌ Кейс не прошёл валидацию:\n" + "\n".join(f"  - {e}" for e in errors))
-            return False
-        logger.info("✅ Кейс прошёл все проверки валидации")
-        return True
-    
-    def _get_case_hash(self, case_data: Dict[str, Any]) -> str:
-        """
-        Создание уникального хеша кейса для проверки повторов
-        
-        Args:
-            case_data: Данные кейса
-            
-        Returns:
-            Строка-хеш
-        """
-        return f"{case_data['position']}-{case_data['company']['type']}-{case_data['product']['name']}"
-    
     def build_case_prompt(self, case_data: Dict[str, Any]) -> str:
         """
         Построение промпта для GPT с конкретными параметрами кейса
@@ -0,0 +1,106 @@
+"""Enumerated space of valid case combinations.
+
+Every valid (company, size, position, product) combination from
+``case_variants`` is enumerated once at scenario load. Cases are then drawn
+either by weighted sampling or, per user, by walking a seeded weighted
+permutation of the whole space, so a user sees every combination once
+before any repeats and drawing the next case does not depend on history:
+the pass order is recomputed from ``(seed, cycle)``, so no per-user state
+is kept or replayed.
+"""
+
+import logging
+import math
+import random
+from array import array
+from bisect import bisect_right
+from itertools import accumulate
+from typing import Any, Dict, List, NamedTuple, Optional, Sequence
+
+logger = logging.getLogger(__name__)
+
+
+class CaseCombo(NamedTuple):
+    company: Dict[str, Any]
+    size: str
+    position: str
+    product: Dict[str, Any]
+
+
+def _weight(item: Dict[str, Any]) -> float:
+    return float(item.get('weight', 1.0))
+
+
+class CaseSpace:
+    """All valid combinations with their sampling weights.
+
+    Default weights reproduce the former step-by-step generator: company
+    uniformly (or by its ``weight``), then size, position and product
+    uniformly within it (products by their ``weight``).
+    """
+
+    def __init__(
+        self,
+        companies: Sequence[Dict[str, Any]],
+        sizes_by_company: Dict[str, List[str]],
+        positions_by_size: Dict[str, List[str]],
+        products_by_company: Dict[str, List[Dict[str, Any]]],
+    ) -> None:
+        self.combos: List[CaseCombo] = []
+        weights: List[float] = []
+        self.by_company: Dict[str, int] = {}
+        for company in companies:
+            ctype = company['type']
+            sizes = sizes_by_company[ctype]
+            products = products_by_company[ctype]
+            product_total = sum(_weight(p) for p in products)
+            if _weight(company) <= 0 or product_total <= 0:
+                continue
+            start = len(self.combos)
+            for size in sizes:
+                positions = positions_by_size[size]
+                share = _weight(company) / len(sizes) / len(positions)
+                for position in positions:
+                    for product in products:
+                        if _weight(product) <= 0:
+                            continue
+                        self.combos.append(CaseCombo(company, size, position, product))
+                        weights.append(share * _weight(product) / product_total)
+            self.by_company[ctype] = len(self.combos) - start
+        if not self.combos:
+            raise ValueError("case_variants: пространство валидных кейсов пусто")
+        self.weights = array('d', weights)
+        self._cum_weights = list(accumulate(weights))
+        logger.info("Case space: %d valid combinations across %d companies", len(self.combos), len(self.by_company))
+
+    def __len__(self) -> int:
+        return len(self.combos)
+
+    def sample(self, rng: Optional[random.Random] = None) -> int:
+        """Weighted draw (with replacement); returns a combo index."""
+        rng = rng or random
+        idx = bisect_right(self._cum_weights, rng.random() * self._cum_weights[-1])
+        return min(idx, len(self.combos) - 1)
+
+    def _permutation(self, seed: int, cycle: int) -> List[int]:
+        rng = random.Random(seed * 1_000_003 + cycle)
+        # Взвешенная перестановка без возвращения (Efraimidis–Spirakis): ключ -ln(u)/w по возрастанию
+        keys = [-math.log(1.0 - rng.random()) / w for w in self.weights]
+        return sorted(range(len(keys)), key=keys.__getitem__)
+
+    def at(self, seed: int, cursor: int) -> int:
+        """Combo index at ``cursor`` of the user's permutation.
+
+        Consecutive cursors within one pass over the space never repeat a
+        combination; the next pass uses a fresh permutation.
+        """
+        cycle, pos = divmod(cursor, len(self.combos))
+        return self._permutation(seed, cycle)[pos]
+
+    def report(self) -> Dict[str, Any]:
+        """Size of the case space, overall and per company type."""
+        return {
+            'total': len(self.combos),
+            'companies': len(self.by_company),
+            'by_company': dict(self.by_company),
+        }
@@ -0,0 +1,59 @@
+"""Background keeper for chat actions such as "typing…".
+
+Telegram shows a chat action for about five seconds or until the bot sends
+a message, so a long LLM turn needs the action re-sent periodically. The
+keeper does that in a background task until it is stopped; failures to
+send the action are logged and never affect the turn itself.
+"""
+
+import asyncio
+import logging
+from typing import Any, Awaitable, Callable, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class ChatActionKeeper:
+    """Re-sends a chat action every ``interval`` seconds while a turn runs.
+
+    Use as ``async with`` or via ``start``/``stop``; ``stop`` is idempotent
+    and may be called as soon as the first reply goes out.
+    """
+
+    def __init__(self, send_action: Callable[[], Awaitable[Any]], interval: float = 4.0) -> None:
+        self._send_action = send_action
+        self.interval = interval
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self) -> 'ChatActionKeeper':
+        if self._task is None and self.interval > 0:
+            self._task = asyncio.create_task(self._run())
+        return self
+
+    def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    @property
+    def active(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                await self._send_action()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.debug("Chat action failed: %s", e)
+            await asyncio.sleep(self.interval)
+
+    async def __aenter__(self) -> 'ChatActionKeeper':
+        self.start()
+        # Даём задаче отправить первое действие до синхронной работы вызывающего кода
+        await asyncio.sleep(0)
+        return self
+
+    async def __aexit__(self, *exc_info: Any) -> None:
+        self.stop()
@@ -0,0 +1,237 @@
+"""Circuit breakers for LLM provider endpoints.
+
+One breaker per ``(provider, model)`` is shared by every pipeline that
+points at that endpoint. A breaker watches a rolling time window of call
+outcomes; when the error rate or the share of slow calls crosses its
+threshold it opens, and calls are routed elsewhere without waiting for
+timeouts. After a jittered, exponentially growing pause it lets a limited
+number of probe calls through (half-open): a successful probe closes the
+circuit, a failed one opens it again for longer. ``allow()`` hands out a
+``Permit`` that marks probes, so late results of calls admitted while the
+circuit was still closed never decide the half-open state.
+"""
+
+import logging
+import random
+import time
+from collections import deque
+from dataclasses import dataclass
+from typing import Callable, Deque, Dict, NamedTuple, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+
+def backoff_delay(attempt: int, base: float, cap: float, rng: Optional[random.Random] = None) -> float:
+    """Exponential backoff with "equal jitter": uniform in [d/2, d], d = min(cap, base * 2**attempt)."""
+    delay = min(cap, base * (2 ** attempt))
+    return (rng or random).uniform(delay / 2, delay)
+
+
+class Permit(NamedTuple):
+    """Admission to one call; ``probe`` marks a half-open trial call."""
+    probe: bool
+
+
+CALL = Permit(False)
+PROBE = Permit(True)
+
+
+@dataclass
+class BreakerConfig:
+    """Thresholds shared by all breakers of a registry."""
+    window_sec: float = 60.0
+    min_calls: int = 20
+    error_rate: float = 0.5
+    slow_call_sec: float = 30.0
+    slow_rate: float = 0.5
+    open_sec: float = 5.0
+    max_open_sec: float = 120.0
+    half_open_probes: int = 1
+
+
+class CircuitBreaker:
+    """Rolling-window breaker for a single endpoint.
+
+    Every permit returned by ``allow()`` must be passed back to exactly one
+    of ``record_success``, ``record_failure`` or ``record_cancelled``.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        config: BreakerConfig,
+        clock: Callable[[], float] = time.monotonic,
+        rng: Optional[random.Random] = None,
+    ) -> None:
+        self.name = name
+        self.config = config
+        self._clock = clock
+        self._rng = rng or random.Random()
+        # (время, ошибка, медленный вызов)
+        self._window: Deque[Tuple[float, bool, bool]] = deque()
+        self._errors = 0
+        self._slow = 0
+        self.state = CLOSED
+        self._open_until = 0.0
+        self._consecutive_trips = 0
+        self._probes = 0
+        self.trips = 0
+        self.rejected = 0
+
+    def _prune(self, now: float) -> None:
+        horizon = now - self.config.window_sec
+        window = self._window
+        while window and window[0][0] < horizon:
+            _, error, slow = window.popleft()
+            self._errors -= error
+            self._slow -= slow
+
+    def is_open(self) -> bool:
+        """Open and still cooling down (no probe would be allowed yet)."""
+        return self.state == OPEN and self._clock() < self._open_until
+
+    def allow(self) -> Optional[Permit]:
+        """A permit if a call may be sent to this endpoint now, otherwise ``None``."""
+        if self.state == CLOSED:
+            return CALL
+        now = self._clock()
+        if self.state == OPEN:
+            if now < self._open_until:
+                self.rejected += 1
+                return None
+            self.state = HALF_OPEN
+            self._probes = 0
+            logger.info("Circuit %s half-open: probing", self.name)
+        if self._probes < self.config.half_open_probes:
+            self._probes += 1
+            return PROBE
+        self.rejected += 1
+        return None
+
+    def _probe_done(self, permit: Permit) -> bool:
+        """Release a probe slot; whether the result decides the half-open state."""
+        if not permit.probe or self.state != HALF_OPEN:
+            return False
+        self._probes = max(0, self._probes - 1)
+        return True
+
+    def record_success(self, latency: float, permit: Permit = CALL) -> None:
+        slow = latency >= self.config.slow_call_sec
+        if self._probe_done(permit):
+            if slow:
+                self._trip()
+            else:
+                self._close()
+            return
+        self._record(False, slow)
+
+    def record_failure(self, latency: float = 0.0, permit: Permit = CALL) -> None:
+        if self._probe_done(permit):
+            self._trip()
+            return
+        self._record(True, latency >= self.config.slow_call_sec)
+
+    def record_cancelled(self, latency: float, permit: Permit = CALL) -> None:
+        """A call abandoned by the caller (e.g. stage timeout) counts only if it was already slow."""
+        if self._probe_done(permit):
+            if latency >= self.config.slow_call_sec:
+                self._trip()
+            return
+        if latency >= self.config.slow_call_sec:
+            self._record(False, True)
+
+    def _record(self, error: bool, slow: bool) -> None:
+        now = self._clock()
+        self._window.append((now, error, slow))
+        self._errors += error
+        self._slow += slow
+        self._prune(now)
+        calls = len(self._window)
+        if self.state == CLOSED and calls >= self.config.min_calls:
+            if self._errors / calls >= self.config.error_rate or self._slow / calls >= self.config.slow_rate:
+                self._trip()
+
+    def _trip(self) -> None:
+        cfg = self.config
+        pause = backoff_delay(self._consecutive_trips, cfg.open_sec, cfg.max_open_sec, self._rng)
+        self._consecutive_trips += 1
+        self.trips += 1
+        self.state = OPEN
+        self._open_until = self._clock() + pause
+        logger.warning(
+            "Circuit %s OPEN for %.1fs (errors=%d slow=%d of %d calls in window)",
+            self.name, pause, self._errors, self._slow, len(self._window),
+        )
+
+    def _close(self) -> None:
+        self.state = CLOSED
+        self._consecutive_trips = 0
+        self._window.clear()
+        self._errors = self._slow = 0
+        logger.info("Circuit %s closed", self.name)
+
+    def stats(self) -> Dict[str, object]:
+        self._prune(self._clock())
+        calls = len(self._window)
+        return {
+            'state': self.state,
+            'calls': calls,
+            'error_rate': round(self._errors / calls, 3) if calls else 0.0,
+            'slow_rate': round(self._slow / calls, 3) if calls else 0.0,
+            'trips': self.trips,
+            'rejected': self.rejected,
+        }
+
+
+class _AlwaysClosed:
+    """Breaker stand-in when circuit breaking is disabled."""
+
+    state = CLOSED
+
+    def is_open(self) -> bool:
+        return False
+
+    def allow(self) -> Permit:
+        return CALL
+
+    def record_success(self, latency: float, permit: Permit = CALL) -> None:
+        pass
+
+    def record_failure(self, latency: float = 0.0, permit: Permit = CALL) -> None:
+        pass
+
+    def record_cancelled(self, latency: float, permit: Permit = CALL) -> None:
+        pass
+
+
+_ALWAYS_CLOSED = _AlwaysClosed()
+
+
+class BreakerRegistry:
+    """Breakers keyed by ``(provider, model)``, shared across pipelines."""
+
+    def __init__(self, config: BreakerConfig, enabled: bool = True, clock: Callable[[], float] = time.monotonic) -> None:
+        self.config = config
+        self.enabled = enabled
+        self._clock = clock
+        self._breakers: Dict[Tuple[str, str], CircuitBreaker] = {}
+
+    def get(self, provider: str, model: str):
+        if not self.enabled:
+            return _ALWAYS_CLOSED
+        key = (provider, model)
+        breaker = self._breakers.get(key)
+        if breaker is None:
+            breaker = self._breakers[key] = CircuitBreaker(f"{provider}:{model}", self.config, self._clock)
+        return breaker
+
+    def is_open(self, provider: str, model: str) -> bool:
+        breaker = self._breakers.get((provider, model))
+        return breaker is not None and breaker.is_open()
+
+    def stats(self) -> Dict[str, Dict[str, object]]:
+        return {breaker.name: breaker.stats() for breaker in self._breakers.values()}
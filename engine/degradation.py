@@ -0,0 +1,142 @@
+"""SLO-aware degradation of the auxiliary LLM stages of a turn.
+
+A training turn needs one LLM call for the client's reply; question
+classification and the context check only enrich the feedback and have
+cheap local fallbacks. When providers are slow or failing, those extra
+calls add load and latency exactly when there is none to spare, so the
+policy switches them off while either budget is exhausted:
+
+- latency: more than ``1 - slo_target`` of recent turns took longer than
+  ``turn_budget_sec`` (or the current turn has already spent its budget
+  waiting);
+- errors: the share of failed LLM calls in the window exceeds
+  ``error_budget``.
+
+Once tripped, degraded mode is held for ``hold_sec`` to avoid flapping and
+then re-evaluated on the rolling window.
+"""
+
+import math
+import time
+from collections import deque
+from dataclasses import dataclass
+from typing import Callable, Deque, Dict, List, Tuple
+
+TURN_BUDGET = 'turn_budget'
+LATENCY_SLO = 'latency_slo'
+ERROR_BUDGET = 'error_budget'
+
+
+@dataclass
+class DegradationConfig:
+    """Thresholds of the degradation policy."""
+    turn_budget_sec: float = 8.0
+    slo_target: float = 0.9
+    error_budget: float = 0.2
+    window_sec: float = 60.0
+    min_samples: int = 10
+    hold_sec: float = 30.0
+
+
+class _RateWindow:
+    """Share of "bad" samples over a rolling time window."""
+
+    __slots__ = ('_samples', '_bad')
+
+    def __init__(self) -> None:
+        self._samples: Deque[Tuple[float, bool]] = deque()
+        self._bad = 0
+
+    def add(self, now: float, bad: bool) -> None:
+        self._samples.append((now, bad))
+        self._bad += bad
+
+    def prune(self, horizon: float) -> None:
+        samples = self._samples
+        while samples and samples[0][0] < horizon:
+            self._bad -= samples.popleft()[1]
+
+    def __len__(self) -> int:
+        return len(self._samples)
+
+    @property
+    def rate(self) -> float:
+        return self._bad / len(self._samples) if self._samples else 0.0
+
+
+class DegradationPolicy:
+    """Decides per turn whether classification and context checks may use the LLM."""
+
+    def __init__(
+        self,
+        config: DegradationConfig,
+        enabled: bool = True,
+        clock: Callable[[], float] = time.monotonic,
+    ) -> None:
+        self.config = config
+        self.enabled = enabled
+        self._clock = clock
+        self._turns = _RateWindow()
+        self._calls = _RateWindow()
+        self._hold_until = 0.0
+        self._hold_reasons: List[str] = []
+        self.turns = 0
+        self.degraded_turns = 0
+        self.by_reason: Dict[str, int] = {}
+
+    def _prune(self, now: float) -> None:
+        horizon = now - self.config.window_sec
+        self._turns.prune(horizon)
+        self._calls.prune(horizon)
+
+    def record_turn(self, latency: float) -> None:
+        now = self._clock()
+        self._turns.add(now, latency > self.config.turn_budget_sec)
+        self._prune(now)
+
+    def record_call(self, ok: bool) -> None:
+        now = self._clock()
+        self._calls.add(now, not ok)
+        self._prune(now)
+
+    def remaining(self, elapsed: float) -> float:
+        """Latency budget left for a turn that has already taken ``elapsed`` seconds."""
+        if not self.enabled:
+            return math.inf
+        return self.config.turn_budget_sec - elapsed
+
+    def reasons(self, elapsed: float = 0.0) -> List[str]:
+        """Why the current turn must degrade (empty list — full pipeline)."""
+        self.turns += 1
+        if not self.enabled:
+            return []
+        cfg = self.config
+        now = self._clock()
+        self._prune(now)
+        reasons = list(self._hold_reasons) if now < self._hold_until else []
+        tripped = []
+        if len(self._turns) >= cfg.min_samples and self._turns.rate > 1.0 - cfg.slo_target:
+            tripped.append(LATENCY_SLO)
+        if len(self._calls) >= cfg.min_samples and self._calls.rate > cfg.error_budget:
+            tripped.append(ERROR_BUDGET)
+        if tripped:
+            self._hold_until = now + cfg.hold_sec
+            self._hold_reasons = tripped
+            reasons = tripped
+        if elapsed >= cfg.turn_budget_sec:
+            reasons = reasons + [TURN_BUDGET]
+        if reasons:
+            self.degraded_turns += 1
+            for reason in reasons:
+                self.by_reason[reason] = self.by_reason.get(reason, 0) + 1
+        return reasons
+
+    def stats(self) -> Dict[str, object]:
+        self._prune(self._clock())
+        return {
+            'turns': self.turns,
+            'degraded_turns': self.degraded_turns,
+            'by_reason': dict(self.by_reason),
+            'slow_turn_rate': round(self._turns.rate, 3),
+            'llm_error_rate': round(self._calls.rate, 3),
+        }
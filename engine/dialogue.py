@@ -0,0 +1,122 @@
+"""Bounded dialogue memory for the simulated client.
+
+Recent question/answer turns are kept verbatim in a fixed-size ring buffer
+capped both in turns and in estimated tokens. Turns pushed out of the
+window are folded into a short running summary (the question and the first
+sentence of the client's answer), which is itself token-capped, so the
+context sent to the LLM stays flat however long the training runs.
+
+Limits live in one shared immutable ``DialogueLimits`` that the bot builds
+from the environment and passes in, so a session only stores a reference.
+"""
+
+import re
+from typing import Any, Dict, List, NamedTuple, Optional, Tuple
+
+_SENTENCE_END_RE = re.compile(r'(?<=[.!?…])\s')
+
+Turn = Tuple[str, str]
+
+
+class DialogueLimits(NamedTuple):
+    """Window size in turns and token budgets of the verbatim turns and the summary."""
+    max_turns: int = 6
+    token_budget: int = 1200
+    summary_budget: int = 300
+
+
+DEFAULT_LIMITS = DialogueLimits()
+
+
+def estimate_tokens(text: str) -> int:
+    """Rough token count (about 3 characters per token for Russian text)."""
+    return (len(text) + 2) // 3
+
+
+def _shorten(text: str, limit: int) -> str:
+    text = ' '.join(text.split())
+    return text if len(text) <= limit else text[:limit - 1].rstrip() + '…'
+
+
+def _first_sentence(text: str) -> str:
+    return _SENTENCE_END_RE.split(text.strip(), maxsplit=1)[0]
+
+
+class DialogueMemory:
+    """Sliding window of recent turns plus an incremental summary of older ones."""
+
+    __slots__ = ('limits', '_ring', '_head', '_size', '_tokens', 'summary', '_summary_tokens')
+
+    def __init__(self, limits: DialogueLimits = DEFAULT_LIMITS) -> None:
+        self.limits = limits
+        self._ring: List[Optional[Turn]] = [None] * max(1, limits.max_turns)
+        self._head = 0
+        self._size = 0
+        self._tokens = 0
+        self.summary: List[str] = []
+        self._summary_tokens = 0
+
+    def __len__(self) -> int:
+        return self._size
+
+    @property
+    def turns(self) -> List[Turn]:
+        """Turns in the window, oldest first."""
+        ring, cap = self._ring, len(self._ring)
+        return [ring[(self._head + i) % cap] for i in range(self._size)]
+
+    def add(self, question: str, answer: str) -> None:
+        """Append a turn; turns beyond the window are folded into the summary."""
+        cap = len(self._ring)
+        if self._size == cap:
+            self._evict()
+        self._ring[(self._head + self._size) % cap] = (question, answer)
+        self._size += 1
+        self._tokens += estimate_tokens(question) + estimate_tokens(answer)
+        while self._size > 1 and self._tokens > self.limits.token_budget:
+            self._evict()
+
+    def _evict(self) -> None:
+        question, answer = self._ring[self._head]
+        self._ring[self._head] = None
+        self._head = (self._head + 1) % len(self._ring)
+        self._size -= 1
+        self._tokens -= estimate_tokens(question) + estimate_tokens(answer)
+        line = f"— {_shorten(question, 120)} → {_shorten(_first_sentence(answer), 200)}"
+        self.summary.append(line)
+        self._summary_tokens += estimate_tokens(line)
+        # Самые старые строки резюме уходят первыми
+        while len(self.summary) > 1 and self._summary_tokens > self.limits.summary_budget:
+            self._summary_tokens -= estimate_tokens(self.summary.pop(0))
+
+    def messages(self, question: str) -> List[Dict[str, str]]:
+        """Chat messages for the next turn: summary, recent turns and the new question.
+
+        The summary is prepended to the oldest user message, so roles keep
+        strictly alternating (required by Anthropic) without invented turns.
+        """
+        messages: List[Dict[str, str]] = []
+        for past_question, past_answer in self.turns:
+            messages.append({'role': 'user', 'content': past_question})
+            messages.append({'role': 'assistant', 'content': past_answer})
+        messages.append({'role': 'user', 'content': question})
+        if self.summary:
+            recap = 'Ранее в разговоре:\n' + '\n'.join(self.summary)
+            messages[0] = {'role': 'user', 'content': f"{recap}\n\n{messages[0]['content']}"}
+        return messages
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {'turns': [list(turn) for turn in self.turns], 'summary': list(self.summary)}
+
+    @classmethod
+    def from_dict(cls, data: Optional[Dict[str, Any]], limits: DialogueLimits = DEFAULT_LIMITS) -> 'DialogueMemory':
+        """Restore from ``to_dict`` output, re-applying ``limits``."""
+        memory = cls(limits)
+        data = data or {}
+        for line in data.get('summary') or []:
+            memory.summary.append(str(line))
+            memory._summary_tokens += estimate_tokens(str(line))
+        for turn in data.get('turns') or []:
+            if isinstance(turn, (list, tuple)) and len(turn) == 2:
+                memory.add(str(turn[0]), str(turn[1]))
+        return memory
@@ -0,0 +1,178 @@
+"""Offline stand-in LLM provider for benchmarks and local runs.
+
+Registered in ``call_llm`` as provider ``fake``: it needs no network or API
+key, answers every pipeline kind with a plausible canned reply and simulates
+provider behaviour with configurable latency distributions and failure rates.
+
+Latency specs: ``const:<sec>``, ``uniform:<min>,<max>``,
+``lognormal:<median>,<sigma>``, ``exp:<mean>``. The prompt (system prompt
+plus the dialogue ``messages``) adds ``prompt_token_time`` per estimated
+token on top of the sampled latency, so a growing dialogue history slows
+the fake down the way prefill slows a real provider. In streaming mode this
+is the time to first token; the remaining words follow every
+``token_interval`` seconds (a non-streamed call returns after the same
+total time).
+"""
+
+import asyncio
+import json
+import math
+import os
+import random
+from dataclasses import dataclass, field
+from typing import AsyncIterator, Callable, Dict, Optional, Sequence
+
+from .dialogue import estimate_tokens
+
+LatencySampler = Callable[[random.Random], float]
+
+DEFAULT_LABELS = ('situational', 'problem', 'implication', 'need_payoff')
+KINDS = ('response', 'feedback', 'classification', 'context', 'analysis')
+
+_CLIENT_REPLIES = (
+    "Сейчас закупаем около 120 тонн в месяц у двух поставщиков.",
+    "Бывает, что поставка задерживается на 5-7 дней, и линия простаивает.",
+    "Простой обходится нам примерно в 300 тысяч рублей в сутки.",
+    "Если бы сроки были стабильными, мы бы сократили складской запас на 20%.",
+)
+
+_FEEDBACK_REPLY = (
+    "Хороший вопрос: вы опираетесь на факты клиента. Попробуйте перейти к извлекающим вопросам "
+    "о последствиях проблемы."
+)
+
+
+class FakeLLMError(RuntimeError):
+    """Simulated provider failure."""
+
+
+def parse_latency(spec: str) -> LatencySampler:
+    """Build a latency sampler (seconds) from a spec like ``lognormal:0.4,0.5``."""
+    name, _, raw_args = spec.strip().partition(':')
+    try:
+        args = [float(a) for a in raw_args.split(',') if a.strip()]
+    except ValueError as e:
+        raise ValueError(f"Invalid latency spec {spec!r}") from e
+    name = name.lower()
+    if name == 'const' and len(args) == 1:
+        value = args[0]
+        return lambda rng: value
+    if name == 'uniform' and len(args) == 2:
+        low, high = args
+        return lambda rng: rng.uniform(low, high)
+    if name == 'lognormal' and len(args) == 2:
+        mu, sigma = math.log(args[0]), args[1]
+        return lambda rng: rng.lognormvariate(mu, sigma)
+    if name == 'exp' and len(args) == 1:
+        rate = 1.0 / args[0]
+        return lambda rng: rng.expovariate(rate)
+    raise ValueError(f"Invalid latency spec {spec!r}")
+
+
+@dataclass
+class FakeLLMProvider:
+    """Canned replies with simulated latency and failures.
+
+    ``latency``/``failure_rate`` are defaults; ``kind_latency`` and
+    ``kind_failure_rate`` override them per pipeline kind.
+    """
+    latency: str = 'lognormal:0.4,0.5'
+    failure_rate: float = 0.0
+    kind_latency: Dict[str, str] = field(default_factory=dict)
+    kind_failure_rate: Dict[str, float] = field(default_factory=dict)
+    labels: Sequence[str] = DEFAULT_LABELS
+    seed: Optional[int] = None
+    token_interval: float = 0.02
+    prompt_token_time: float = 0.0001
+    calls: int = 0
+    failures: int = 0
+    prompt_tokens: int = 0
+
+    def __post_init__(self) -> None:
+        self._rng = random.Random(self.seed)
+        self._default_sampler = parse_latency(self.latency)
+        self._samplers = {kind: parse_latency(spec) for kind, spec in self.kind_latency.items()}
+
+    @classmethod
+    def from_env(cls) -> 'FakeLLMProvider':
+        """Configure from ``FAKE_LLM_*`` variables (``FAKE_LLM_LATENCY_<KIND>`` etc.)."""
+        kind_latency = {}
+        kind_failure_rate = {}
+        for kind in KINDS:
+            spec = os.getenv(f'FAKE_LLM_LATENCY_{kind.upper()}')
+            if spec:
+                kind_latency[kind] = spec
+            rate = os.getenv(f'FAKE_LLM_FAILURE_RATE_{kind.upper()}')
+            if rate:
+                kind_failure_rate[kind] = float(rate)
+        seed = os.getenv('FAKE_LLM_SEED')
+        return cls(
+            latency=os.getenv('FAKE_LLM_LATENCY', 'lognormal:0.4,0.5'),
+            failure_rate=float(os.getenv('FAKE_LLM_FAILURE_RATE', '0')),
+            kind_latency=kind_latency,
+            kind_failure_rate=kind_failure_rate,
+            seed=int(seed) if seed else None,
+            token_interval=float(os.getenv('FAKE_LLM_TOKEN_INTERVAL', '0.02')),
+            prompt_token_time=float(os.getenv('FAKE_LLM_PROMPT_TOKEN_TIME', '0.0001')),
+        )
+
+    def _reply(self, kind: str) -> str:
+        rng = self._rng
+        if kind == 'classification':
+            return rng.choice(self.labels)
+        if kind == 'context':
+            return rng.choice(('yes', 'no'))
+        if kind == 'analysis':
+            return json.dumps({'type': rng.choice(self.labels), 'contextual': rng.random() < 0.5})
+        if kind == 'feedback':
+            return _FEEDBACK_REPLY
+        return rng.choice(_CLIENT_REPLIES)
+
+    async def _start(
+        self,
+        kind: str,
+        model: str,
+        system_prompt: str,
+        user_message: str,
+        messages: Optional[Sequence[Dict[str, str]]],
+    ) -> None:
+        self.calls += 1
+        chat = messages or [{'role': 'user', 'content': user_message}]
+        tokens = estimate_tokens(system_prompt) + sum(estimate_tokens(m['content']) for m in chat)
+        self.prompt_tokens += tokens
+        sampler = self._samplers.get(kind, self._default_sampler)
+        await asyncio.sleep(max(0.0, sampler(self._rng)) + tokens * self.prompt_token_time)
+        if self._rng.random() < self.kind_failure_rate.get(kind, self.failure_rate):
+            self.failures += 1
+            raise FakeLLMError(f"Simulated {kind} failure (model={model})")
+
+    async def complete(
+        self,
+        kind: str,
+        model: str,
+        system_prompt: str,
+        user_message: str,
+        messages: Optional[Sequence[Dict[str, str]]] = None,
+    ) -> str:
+        """Simulate one provider call for pipeline ``kind``."""
+        await self._start(kind, model, system_prompt, user_message, messages)
+        reply = self._reply(kind)
+        # Без стриминга ответ приходит целиком — после генерации всех слов
+        await asyncio.sleep(self.token_interval * reply.count(' '))
+        return reply
+
+    async def stream(
+        self,
+        kind: str,
+        model: str,
+        system_prompt: str,
+        user_message: str,
+        messages: Optional[Sequence[Dict[str, str]]] = None,
+    ) -> AsyncIterator[str]:
+        """Simulate a streamed call: yields the reply word by word."""
+        await self._start(kind, model, system_prompt, user_message, messages)
+        words = self._reply(kind).split(' ')
+        for i, word in enumerate(words):
+            if i:
+                await asyncio.sleep(self.token_interval)
+            yield word if i == len(words) - 1 else word + ' '
@@ -0,0 +1,71 @@
+"""Helpers for hedged LLM requests.
+
+A hedge is a duplicate request sent to the fallback endpoint when the
+primary has not answered within a delay derived from its recent latency
+percentile; whichever finishes first wins. ``LatencyTracker`` keeps the
+recent latencies per endpoint and ``HedgeBudget`` caps the share of
+requests that may be hedged so an overloaded primary cannot double the
+total load.
+"""
+
+import math
+from collections import deque
+from typing import Deque, Dict, Tuple
+
+
+class LatencyTracker:
+    """Recent latency samples per ``(provider, model)``."""
+
+    def __init__(self, max_samples: int = 200, min_samples: int = 20) -> None:
+        self.max_samples = max_samples
+        self.min_samples = min_samples
+        self._samples: Dict[Tuple[str, str], Deque[float]] = {}
+
+    def record(self, provider: str, model: str, latency: float) -> None:
+        samples = self._samples.get((provider, model))
+        if samples is None:
+            samples = self._samples[(provider, model)] = deque(maxlen=self.max_samples)
+        samples.append(latency)
+
+    def percentile(self, provider: str, model: str, pct: float) -> float:
+        """Nearest-rank percentile, or ``nan`` until ``min_samples`` are collected."""
+        samples = self._samples.get((provider, model))
+        if not samples or len(samples) < self.min_samples:
+            return math.nan
+        ordered = sorted(samples)
+        index = min(len(ordered) - 1, max(0, math.ceil(pct / 100 * len(ordered)) - 1))
+        return ordered[index]
+
+
+class HedgeBudget:
+    """Token bucket: every request earns ``max_rate`` of a hedge, a hedge spends one."""
+
+    def __init__(self, max_rate: float = 0.1, burst: float = 5.0) -> None:
+        self.max_rate = max_rate
+        self.burst = burst
+        self._tokens = burst
+        self.requests = 0
+        self.hedges = 0
+        self.denied = 0
+        self.wins = 0
+
+    def on_request(self) -> None:
+        self.requests += 1
+        self._tokens = min(self.burst, self._tokens + self.max_rate)
+
+    def try_spend(self) -> bool:
+        if self._tokens >= 1.0:
+            self._tokens -= 1.0
+            self.hedges += 1
+            return True
+        self.denied += 1
+        return False
+
+    def stats(self) -> Dict[str, float]:
+        return {
+            'requests': self.requests,
+            'hedges': self.hedges,
+            'hedge_rate': round(self.hedges / self.requests, 4) if self.requests else 0.0,
+            'denied': self.denied,
+            'hedge_wins': self.wins,
+        }
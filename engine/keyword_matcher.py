@@ -0,0 +1,82 @@
+"""Aho–Corasick multi-pattern matcher.
+
+All keywords are compiled once into a single automaton; ``find_all`` then
+reports every occurrence of every keyword in one pass over the text, so the
+cost is linear in the text length plus the number of matches, regardless
+of how many keywords a scenario defines.
+"""
+
+from collections import deque
+from typing import Any, Dict, Iterable, List, NamedTuple, Tuple
+
+
+class KeywordMatch(NamedTuple):
+    start: int
+    end: int
+    keyword: str
+    payload: Any
+
+
+class KeywordMatcher:
+    """Case-insensitive matcher over ``(keyword, payload)`` pairs."""
+
+    def __init__(self, patterns: Iterable[Tuple[str, Any]]) -> None:
+        self._goto: List[Dict[str, int]] = [{}]
+        self._fail: List[int] = [0]
+        self._out: List[List[Tuple[str, Any]]] = [[]]
+        self.size = 0
+        for keyword, payload in patterns:
+            keyword = str(keyword).lower()
+            if not keyword:
+                continue
+            self._add(keyword, payload)
+            self.size += 1
+        self._build_links()
+
+    def _add(self, keyword: str, payload: Any) -> None:
+        state = 0
+        for ch in keyword:
+            nxt = self._goto[state].get(ch)
+            if nxt is None:
+                nxt = len(self._goto)
+                self._goto[state][ch] = nxt
+                self._goto.append({})
+                self._fail.append(0)
+                self._out.append([])
+            state = nxt
+        self._out[state].append((keyword, payload))
+
+    def _build_links(self) -> None:
+        queue = deque(self._goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for ch, nxt in self._goto[state].items():
+                queue.append(nxt)
+                fail = self._fail[state]
+                while fail and ch not in self._goto[fail]:
+                    fail = self._fail[fail]
+                target = self._goto[fail].get(ch, 0)
+                self._fail[nxt] = target if target != nxt else 0
+                # Совпадения суффиксов наследуются по ссылке неудачи
+                self._out[nxt] = self._out[nxt] + self._out[self._fail[nxt]]
+
+    def find_all(self, text: str) -> List[KeywordMatch]:
+        """All keyword occurrences (overlapping included).
+
+        Positions index into ``text.lower()``, which has the same length as
+        ``text`` for Cyrillic and Latin input.
+        """
+        goto, fail, out = self._goto, self._fail, self._out
+        matches: List[KeywordMatch] = []
+        state = 0
+        for i, ch in enumerate(text.lower()):
+            while state and ch not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(ch, 0)
+            for keyword, payload in out[state]:
+                matches.append(KeywordMatch(i + 1 - len(keyword), i + 1, keyword, payload))
+        return matches
+
+    def payloads(self, text: str) -> set:
+        """Distinct payloads of all keywords found in ``text``."""
+        return {match.payload for match in self.find_all(text)}
@@ -0,0 +1,59 @@
+"""Precomputed XP → level lookup for ``ranking.levels``."""
+
+from bisect import bisect_right
+from typing import Any, Dict, List, Optional, Tuple
+
+from .scenario_loader import ScenarioValidationError
+
+DEFAULT_LEVEL: Dict[str, Any] = {'level': 1, 'name': 'Новичок', 'emoji': '🌱', 'min_xp': 0, 'description': ''}
+
+
+class LevelIndex:
+    """Level table sorted by ``min_xp`` with bisect-based lookups.
+
+    ``level_for_xp`` keeps the legacy semantics: the highest level number
+    among all levels whose ``min_xp`` is reached (1 if none).
+    """
+
+    def __init__(self, levels: List[Dict[str, Any]]) -> None:
+        try:
+            ordered = sorted(levels, key=lambda l: int(l.get('min_xp', 0)))
+            self._thresholds: List[int] = [int(l.get('min_xp', 0)) for l in ordered]
+            # Максимальный номер уровня среди первых i порогов (префиксный максимум)
+            self._best_level: List[int] = []
+            for lvl in ordered:
+                number = int(lvl.get('level', 1))
+                self._best_level.append(max(number, self._best_level[-1]) if self._best_level else number)
+            self._by_level: Dict[int, Dict[str, Any]] = {int(l.get('level', 1)): l for l in levels}
+        except (TypeError, ValueError) as e:
+            raise ScenarioValidationError(f"Invalid ranking.levels: {e}") from e
+        self._default = levels[0] if levels else DEFAULT_LEVEL
+
+    def level_for_xp(self, xp: int) -> int:
+        """Level number reached with ``xp`` experience, O(log n)."""
+        pos = bisect_right(self._thresholds, xp)
+        return self._best_level[pos - 1] if pos else 1
+
+    def get(self, level: int) -> Dict[str, Any]:
+        """Level definition (falls back to the first configured level)."""
+        return self._by_level.get(level, self._default)
+
+    def find(self, level: int) -> Optional[Dict[str, Any]]:
+        return self._by_level.get(level)
+
+    def next_level(self, level: int) -> Optional[Dict[str, Any]]:
+        return self._by_level.get(level + 1)
+
+    def progress(self, xp: int, level: int) -> Tuple[Optional[Dict[str, Any]], int, int]:
+        """Return ``(next_level, xp_to_next, percent)`` within the current level.
+
+        ``next_level`` is None at the maximum level (then percent is 100).
+        """
+        nxt = self.next_level(level)
+        if nxt is None:
+            return None, 0, 100
+        current_min = int(self.get(level).get('min_xp', 0))
+        next_min = int(nxt.get('min_xp', 0))
+        span = next_min - current_min
+        percent = max(0, min(100, int(((xp - current_min) / span) * 100))) if span > 0 else 100
+        return nxt, next_min - xp, percent
@@ -0,0 +1,127 @@
+"""Long-lived HTTP clients for LLM providers.
+
+One pooled ``httpx.AsyncClient`` is kept per provider (and a single
+``openai.AsyncOpenAI`` wrapping the OpenAI pool), so TLS sessions and
+keep-alive connections are reused across classification, response and
+context calls instead of being re-established on every request.
+"""
+
+import json
+import logging
+from dataclasses import dataclass
+from typing import Any, AsyncIterator, Dict, Optional
+
+import httpx
+import openai
+
+logger = logging.getLogger(__name__)
+
+
+async def iter_sse_json(response: httpx.Response) -> AsyncIterator[Dict[str, Any]]:
+    """Decode the JSON ``data:`` payloads of a server-sent events stream."""
+    async for line in response.aiter_lines():
+        if not line.startswith('data:'):
+            continue
+        data = line[5:].strip()
+        if not data or data == '[DONE]':
+            continue
+        try:
+            yield json.loads(data)
+        except ValueError:
+            logger.warning("Skipping malformed SSE payload: %.200s", data)
+
+
+def _http2_available() -> bool:
+    try:
+        import h2  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+@dataclass
+class ProviderPoolConfig:
+    """Connection-pool settings for a single provider."""
+    max_connections: int = 20
+    max_keepalive_connections: int = 10
+    keepalive_expiry: float = 60.0
+    http2: bool = True
+    timeout: float = 30.0
+
+
+class LLMClientRegistry:
+    """Registry of pooled provider clients.
+
+    Clients are created lazily on first use (or eagerly via ``start``) and
+    must be released with ``aclose`` on application shutdown.
+    """
+
+    def __init__(self, pool_configs: Dict[str, ProviderPoolConfig], openai_api_key: Optional[str] = None) -> None:
+        self._configs = pool_configs
+        self._openai_api_key = openai_api_key
+        self._http: Dict[str, httpx.AsyncClient] = {}
+        self._openai: Optional[openai.AsyncOpenAI] = None
+        self._openai_http: Optional[httpx.AsyncClient] = None
+
+    def _config(self, provider: str) -> ProviderPoolConfig:
+        return self._configs.get(provider) or ProviderPoolConfig()
+
+    def http_client(self, provider: str) -> httpx.AsyncClient:
+        """Return the shared pooled client for provider, creating it if needed."""
+        client = self._http.get(provider)
+        if client is None or client.is_closed:
+            cfg = self._config(provider)
+            http2 = cfg.http2
+            if http2 and not _http2_available():
+                logger.warning("HTTP/2 requested for %s but 'h2' is not installed; using HTTP/1.1 keep-alive", provider)
+                http2 = False
+            client = httpx.AsyncClient(
+                timeout=httpx.Timeout(cfg.timeout),
+                limits=httpx.Limits(
+                    max_connections=cfg.max_connections,
+                    max_keepalive_connections=cfg.max_keepalive_connections,
+                    keepalive_expiry=cfg.keepalive_expiry,
+                ),
+                http2=http2,
+            )
+            self._http[provider] = client
+            logger.info(
+                "HTTP pool created for %s: max_connections=%s keepalive=%s http2=%s",
+                provider, cfg.max_connections, cfg.max_keepalive_connections, http2,
+            )
+        return client
+
+    def openai_client(self) -> openai.AsyncOpenAI:
+        """Return the shared AsyncOpenAI client bound to the OpenAI pool."""
+        http = self.http_client('openai')
+        if self._openai is None or self._openai_http is not http:
+            self._openai = openai.AsyncOpenAI(
+                api_key=self._openai_api_key,
+                http_client=http,
+                timeout=self._config('openai').timeout,
+            )
+            self._openai_http = http
+        return self._openai
+
+    async def start(self, providers: Optional[list] = None) -> None:
+        """Eagerly create pools for the given providers (defaults to all configured)."""
+        for provider in providers or list(self._configs.keys()):
+            try:
+                if provider == 'openai':
+                    self.openai_client()
+                else:
+                    self.http_client(provider)
+            except Exception as e:
+                # Ошибка конфигурации (например, нет ключа) проявится при первом вызове провайдера
+                logger.warning("Could not initialise %s client at startup: %s", provider, e)
+
+    async def aclose(self) -> None:
+        """Close all pooled clients."""
+        for provider, client in list(self._http.items()):
+            try:
+                await client.aclose()
+            except Exception as e:
+                logger.warning("Error closing HTTP pool for %s: %s", provider, e)
+        self._http.clear()
+        self._openai = None
+        self._openai_http = None
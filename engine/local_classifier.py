@@ -0,0 +1,225 @@
+"""Local CPU-only SPIN question classifier.
+
+A multinomial logistic regression over character n-grams (2-4) and word
+unigrams, trained with plain SGD from labelled question logs. Predictions
+come with a softmax confidence, so the analyzer can answer confident
+questions locally and route only ambiguous ones to the LLM.
+
+Training data is JSON Lines with ``{"question": ..., "label": ...}`` records,
+for example the LLM-labelled log written by ``LabelLog``:
+
+    python -m engine.local_classifier data/classification_log.jsonl data/spin_classifier.json
+
+The command prints accuracy and coverage per confidence threshold on a
+held-out split to help tune ``LOCAL_CLASSIFIER_THRESHOLD``.
+"""
+
+import argparse
+import json
+import logging
+import math
+import random
+import threading
+from collections import Counter
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+from .analysis_cache import normalize_question
+
+logger = logging.getLogger(__name__)
+
+Example = Tuple[str, str]
+
+
+def extract_features(text: str) -> Dict[str, float]:
+    """L2-normalized char 2-4-gram and word counts of the normalized text."""
+    normalized = normalize_question(text)
+    padded = f" {normalized} "
+    counts: Counter = Counter()
+    for n in (2, 3, 4):
+        for i in range(len(padded) - n + 1):
+            counts[f"c{n}:{padded[i:i + n]}"] += 1
+    for word in normalized.split():
+        counts[f"w:{word}"] += 1
+    norm = math.sqrt(sum(v * v for v in counts.values())) or 1.0
+    return {feature: value / norm for feature, value in counts.items()}
+
+
+def _softmax(scores: List[float]) -> List[float]:
+    top = max(scores)
+    exps = [math.exp(s - top) for s in scores]
+    total = sum(exps)
+    return [e / total for e in exps]
+
+
+class CharNgramClassifier:
+    """Softmax classifier over sparse n-gram features."""
+
+    def __init__(self, labels: Sequence[str], weights: Dict[str, List[float]], bias: List[float]) -> None:
+        self.labels = list(labels)
+        self.weights = weights
+        self.bias = bias
+
+    def _scores(self, features: Dict[str, float]) -> List[float]:
+        scores = list(self.bias)
+        for feature, value in features.items():
+            row = self.weights.get(feature)
+            if row is not None:
+                for k, w in enumerate(row):
+                    scores[k] += w * value
+        return scores
+
+    def predict_proba(self, text: str) -> Dict[str, float]:
+        return dict(zip(self.labels, _softmax(self._scores(extract_features(text)))))
+
+    def predict(self, text: str) -> Tuple[str, float]:
+        """Most likely label and its probability."""
+        probs = _softmax(self._scores(extract_features(text)))
+        best = max(range(len(probs)), key=probs.__getitem__)
+        return self.labels[best], probs[best]
+
+    @classmethod
+    def train(
+        cls,
+        examples: Sequence[Example],
+        epochs: int = 15,
+        learning_rate: float = 0.5,
+        l2: float = 1e-5,
+        seed: int = 0,
+    ) -> 'CharNgramClassifier':
+        labels = sorted({label for _, label in examples})
+        if len(labels) < 2:
+            raise ValueError("Need examples of at least two labels to train")
+        index = {label: k for k, label in enumerate(labels)}
+        data = [(extract_features(question), index[label]) for question, label in examples]
+        weights: Dict[str, List[float]] = {}
+        bias = [0.0] * len(labels)
+        rng = random.Random(seed)
+        for epoch in range(epochs):
+            rng.shuffle(data)
+            lr = learning_rate / (1 + epoch)
+            for features, target in data:
+                scores = list(bias)
+                rows = []
+                for feature, value in features.items():
+                    row = weights.get(feature)
+                    if row is None:
+                        row = weights[feature] = [0.0] * len(labels)
+                    rows.append((row, value))
+                    for k, w in enumerate(row):
+                        scores[k] += w * value
+                probs = _softmax(scores)
+                probs[target] -= 1.0
+                for k, grad in enumerate(probs):
+                    bias[k] -= lr * grad
+                for row, value in rows:
+                    for k, grad in enumerate(probs):
+                        row[k] -= lr * (grad * value + l2 * row[k])
+        return cls(labels, weights, bias)
+
+    def to_dict(self) -> Dict[str, object]:
+        return {
+            'labels': self.labels,
+            'bias': self.bias,
+            'weights': {f: [round(w, 6) for w in row] for f, row in self.weights.items() if any(row)},
+        }
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, object]) -> 'CharNgramClassifier':
+        return cls(data['labels'], data['weights'], data['bias'])
+
+    def save(self, path: str) -> None:
+        target = Path(path).expanduser()
+        target.parent.mkdir(parents=True, exist_ok=True)
+        target.write_text(json.dumps(self.to_dict(), ensure_ascii=False), encoding='utf-8')
+
+    @classmethod
+    def load(cls, path: str) -> 'CharNgramClassifier':
+        return cls.from_dict(json.loads(Path(path).expanduser().read_text(encoding='utf-8')))
+
+
+class LabelLog:
+    """Append-only JSON Lines log of LLM-labelled questions (training data)."""
+
+    def __init__(self, path: str) -> None:
+        self.path = Path(path).expanduser()
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._file = open(self.path, 'a', encoding='utf-8', buffering=1)
+        self._lock = threading.Lock()
+
+    def append(self, question: str, label: str, source: str = 'llm') -> None:
+        line = json.dumps({'question': question, 'label': label, 'source': source}, ensure_ascii=False)
+        with self._lock:
+            self._file.write(line + '\n')
+
+    def close(self) -> None:
+        with self._lock:
+            self._file.close()
+
+
+def read_examples(paths: Iterable[str], allowed: Optional[Sequence[str]] = None) -> List[Example]:
+    """Read ``question``/``label`` pairs from JSON Lines files, de-duplicated by normalized text."""
+    examples: Dict[str, str] = {}
+    for path in paths:
+        with open(path, encoding='utf-8') as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    record = json.loads(line)
+                    question, label = record['question'], record['label']
+                except (ValueError, KeyError, TypeError):
+                    continue
+                if allowed is not None and label not in allowed:
+                    continue
+                # Последняя метка для вопроса побеждает
+                examples[normalize_question(question)] = label
+    return [(question, label) for question, label in examples.items() if question]
+
+
+def threshold_report(
+    model: CharNgramClassifier, examples: Sequence[Example], thresholds: Sequence[float]
+) -> List[Dict[str, float]]:
+    """Coverage (share answered locally) and accuracy on those, per threshold."""
+    predictions = [(model.predict(question), label) for question, label in examples]
+    rows = []
+    for threshold in thresholds:
+        covered = [(predicted == label) for (predicted, confidence), label in predictions if confidence >= threshold]
+        rows.append({
+            'threshold': threshold,
+            'coverage': round(len(covered) / len(predictions), 4) if predictions else 0.0,
+            'accuracy': round(sum(covered) / len(covered), 4) if covered else 0.0,
+        })
+    return rows
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Train the local SPIN question classifier")
+    parser.add_argument('logs', nargs='+', help='JSON Lines files with question/label records')
+    parser.add_argument('output', help='where to write the model JSON')
+    parser.add_argument('--holdout', type=float, default=0.2, help='share of examples kept for evaluation')
+    parser.add_argument('--epochs', type=int, default=15)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    examples = read_examples(args.logs)
+    rng = random.Random(args.seed)
+    rng.shuffle(examples)
+    split = int(len(examples) * (1 - args.holdout)) if args.holdout > 0 else len(examples)
+    train, test = examples[:split], examples[split:]
+    print(f"Examples: {len(examples)} (train {len(train)}, holdout {len(test)}), labels: {dict(Counter(l for _, l in examples))}")
+    model = CharNgramClassifier.train(train, epochs=args.epochs, seed=args.seed)
+    if test:
+        print("threshold  coverage  accuracy")
+        for row in threshold_report(model, test, [0.5, 0.6, 0.7, 0.8, 0.85, 0.9, 0.95]):
+            print(f"{row['threshold']:>9}  {row['coverage']:>8}  {row['accuracy']:>8}")
+    # Финальная модель обучается на всех примерах
+    if test:
+        model = CharNgramClassifier.train(examples, epochs=args.epochs, seed=args.seed)
+    model.save(args.output)
+    print(f"Model saved to {args.output}: {len(model.weights)} features")
+
+
+if __name__ == '__main__':
+    main()
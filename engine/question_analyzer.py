@@ -1,23 +1,98 @@
-from typing import Dict, List, Any, Callable, Awaitable
+from typing import Dict, List, Any, Callable, Awaitable, Optional, Tuple
+import asyncio
+import json
 import logging
+import re
+
+from .analysis_cache import AnalysisCache, fingerprint
+from .local_classifier import CharNgramClassifier, LabelLog
+from .keyword_matcher import KeywordMatcher
+from .templates import CompiledTemplate
 
 logger = logging.getLogger(__name__)
 
+# Маркеры ссылок на сказанное клиентом (эвристика активного слушания)
+CONTEXT_MARKERS = ("как вы сказали", "уточните", "по поводу", "вы упомянули", "этих", "этой проблемы", "этой ситуации")
+_NUMBER_RE = re.compile(r"\b\d+[\d\s.,]*\b")
+_MARKER = ('marker', None)
+_MARKER_MATCHER = KeywordMatcher((marker, _MARKER) for marker in CONTEXT_MARKERS)
+
+
+def _render_prompt(prompts: Dict[str, Any], name: str, **kwargs: Any) -> str:
+    """Render a prompt that is either pre-compiled by ScenarioLoader or a raw string."""
+    template = prompts.get(name, "")
+    if isinstance(template, CompiledTemplate):
+        return template.render(**kwargs)
+    return str(template).format(**kwargs)
+
 
 class QuestionAnalyzer:
     """Analyzes questions using scenario-defined question types."""
 
+    def __init__(
+        self,
+        cache: Optional[AnalysisCache] = None,
+        local_classifier: Optional[CharNgramClassifier] = None,
+        local_threshold: float = 0.9,
+        label_log: Optional[LabelLog] = None,
+    ) -> None:
+        # Кэш результатов LLM-анализа (None — без кэша)
+        self.cache = cache
+        # Локальный классификатор: уверенные ответы без LLM, остальные — в LLM
+        self.local_classifier = local_classifier
+        self.local_threshold = local_threshold
+        self.local_answered = 0
+        self.local_routed = 0
+        # Журнал меток LLM — обучающие данные для локального классификатора
+        self.label_log = label_log
+        # Автомат ключевых слов типов вопросов и маркеров контекста (строится при загрузке сценария)
+        self._matcher: KeywordMatcher = _MARKER_MATCHER
+        self._matcher_types: Optional[List[Dict[str, Any]]] = None
+
+    def compile_keywords(self, question_types: List[Dict[str, Any]]) -> KeywordMatcher:
+        """Собрать единый автомат по ключевым словам всех типов вопросов и маркерам контекста."""
+        patterns = [
+            (keyword, ('type', index))
+            for index, qtype in enumerate(question_types)
+            for keyword in qtype.get("keywords", [])
+        ]
+        patterns.extend((marker, _MARKER) for marker in CONTEXT_MARKERS)
+        self._matcher = KeywordMatcher(patterns)
+        self._matcher_types = question_types
+        logger.info(f"Keyword matcher compiled: {self._matcher.size} patterns")
+        return self._matcher
+
+    def classify_locally(self, question: str, question_types: List[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+        """Тип вопроса от локальной модели, если её уверенность не ниже порога, иначе None."""
+        if self.local_classifier is None:
+            return None
+        label, confidence = self.local_classifier.predict(question)
+        if confidence >= self.local_threshold:
+            qtype = next((qt for qt in question_types if qt.get('id') == label), None)
+            if qtype is not None:
+                self.local_answered += 1
+                logger.info(f"Local classification: {label} ({confidence:.2f})")
+                return qtype
+        self.local_routed += 1
+        return None
+
+    def _log_label(self, question: str, label: str) -> None:
+        if self.label_log is not None:
+            try:
+                self.label_log.append(question, label)
+            except Exception as e:
+                logger.warning(f"Label log write failed: {e}")
+
     def analyze_type(self, question: str, question_types: List[Dict[str, Any]]) -> Dict[str, Any]:
         """Determine question type by keyword presence.
 
-        Returns the matching question type dict. Falls back to the first type if none match.
+        Returns the first type (in scenario order) with a keyword in the question.
+        Falls back to the first type if none match.
         """
-        text = question.lower()
-        for qtype in question_types:
-            keywords = [kw.lower() for kw in qtype.get("keywords", [])]
-            if any(kw in text for kw in keywords):
-                return qtype
-        return question_types[0]
+        if self._matcher_types is not question_types:
+            self.compile_keywords(question_types)
+        indexes = [index for kind, index in self._matcher.payloads(question) if kind == 'type']
+        return question_types[min(indexes)] if indexes else question_types[0]
 
     # Fallback (старый метод)
     def classify_question_fallback(self, question: str, question_types: List[Dict[str, Any]]) -> Dict[str, Any]:
@@ -28,10 +103,39 @@ class QuestionAnalyzer:
         question: str,
         case_context: str,
         call_llm_func: Callable[[str, str, str], Awaitable[str]],
-        prompts: Dict[str, Any]
+        prompts: Dict[str, Any],
+        context_key: Optional[str] = None
     ) -> str:
-        """Классификация через LLM. Возвращает один из id: situational/problem/implication/need_payoff."""
-        prompt = str(prompts.get("question_classification", "")).format(
+        """Классификация через LLM. Возвращает один из id: situational/problem/implication/need_payoff.
+
+        context_key — отпечаток контекста кейса для кэша (по умолчанию хеш case_context).
+        """
+        context_key = self._context_key(case_context, context_key)
+        cached = self._cached_label(question, context_key)
+        if cached is not None:
+            return cached
+        return await self._classify_with_llm(question, case_context, call_llm_func, prompts, context_key)
+
+    def _context_key(self, case_context: str, context_key: Optional[str]) -> Optional[str]:
+        if self.cache is None:
+            return context_key
+        return context_key if context_key is not None else fingerprint(case_context)
+
+    def _cached_label(self, question: str, context_key: Optional[str]) -> Optional[str]:
+        return self.cache.get_label(question, context_key) if self.cache is not None else None
+
+    async def _classify_with_llm(
+        self,
+        question: str,
+        case_context: str,
+        call_llm_func: Callable[[str, str, str], Awaitable[str]],
+        prompts: Dict[str, Any],
+        context_key: Optional[str]
+    ) -> str:
+        """LLM-вызов классификации без поиска в кэше; результат кладётся в кэш."""
+        prompt = _render_prompt(
+            prompts,
+            "question_classification",
             question=question,
             context=case_context or ""
         )
@@ -44,6 +148,9 @@ class QuestionAnalyzer:
             label = label.replace("-", "_").replace(" ", "_")
         if label not in allowed:
             raise ValueError(f"Unrecognized classification label: {raw}")
+        if self.cache is not None:
+            self.cache.put_label(question, context_key, label)
+        self._log_label(question, label)
         return label
 
     async def classify_question(
@@ -52,12 +159,25 @@ class QuestionAnalyzer:
         question_types: List[Dict[str, Any]],
         case_context: str,
         call_llm_func: Callable[[str, str, str], Awaitable[str]] = None,
-        prompts: Dict[str, Any] = None
+        prompts: Dict[str, Any] = None,
+        context_key: Optional[str] = None,
+        use_local: bool = True
     ) -> Dict[str, Any]:
-        """Основной метод классификации: LLM → fallback."""
+        """Основной метод классификации: локальная модель → кэш → LLM → fallback."""
+        local = self.classify_locally(question, question_types) if use_local else None
+        if local is not None:
+            return local
+        # Кэш проверяется и без LLM: в деградированном режиме call_llm_func не передаётся
+        context_key = self._context_key(case_context, context_key)
+        cached = self._cached_label(question, context_key)
+        qtype = next((qt for qt in question_types if qt.get('id') == cached), None) if cached else None
+        if qtype is not None:
+            return qtype
         if call_llm_func is not None:
             try:
-                label = await self.classify_question_with_llm(question, case_context, call_llm_func, prompts)
+                label = await self._classify_with_llm(
+                    question, case_context, call_llm_func, prompts, context_key
+                )
                 for qt in question_types:
                     if qt.get('id') == label:
                         logger.info(f"LLM classification success: {label}")
@@ -67,6 +187,106 @@ class QuestionAnalyzer:
                 logger.warning(f"LLM classification failed ({type(e).__name__}): {e}; using fallback")
         return self.classify_question_fallback(question, question_types)
 
+    @staticmethod
+    def parse_combined_analysis(raw: str, allowed_labels: List[str]) -> Tuple[str, bool]:
+        """Строгий разбор ответа вида {"type": "<id>", "contextual": true|false}.
+
+        Допускается только обёртка в markdown-блок ```json; любые другие отклонения
+        (лишний текст, неизвестный тип, не-bool флаг) приводят к ValueError.
+        """
+        text = (raw or "").strip()
+        if text.startswith("```"):
+            text = text.strip("`").strip()
+            if text.lower().startswith("json"):
+                text = text[4:].strip()
+        data = json.loads(text)
+        if not isinstance(data, dict) or set(data.keys()) != {"type", "contextual"}:
+            raise ValueError(f"Unexpected analysis structure: {raw}")
+        label = data["type"]
+        contextual = data["contextual"]
+        if not isinstance(label, str) or label not in allowed_labels:
+            raise ValueError(f"Unrecognized classification label: {label}")
+        if not isinstance(contextual, bool):
+            raise ValueError(f"Contextual flag must be boolean: {contextual}")
+        return label, contextual
+
+    async def analyze_question_with_llm(
+        self,
+        question: str,
+        question_types: List[Dict[str, Any]],
+        case_context: str,
+        last_response: str,
+        call_llm_func: Callable[[str, str, str], Awaitable[str]],
+        prompts: Dict[str, Any]
+    ) -> Tuple[str, bool]:
+        """Один вызов LLM: тип вопроса и использование контекста в структурированном JSON."""
+        prompt = _render_prompt(
+            prompts,
+            "question_analysis",
+            question=question,
+            context=case_context or "",
+            last_response=last_response or "—"
+        )
+        raw = await call_llm_func('analysis', prompt, 'Analyze SPIN question')
+        label, contextual = self.parse_combined_analysis(raw, [qt.get('id') for qt in question_types])
+        return label, contextual and bool(last_response)
+
+    async def analyze_question(
+        self,
+        question: str,
+        question_types: List[Dict[str, Any]],
+        case_context: str,
+        last_response: str,
+        call_llm_func: Callable[[str, str, str], Awaitable[str]] = None,
+        prompts: Dict[str, Any] = None,
+        context_key: Optional[str] = None
+    ) -> Tuple[Dict[str, Any], bool]:
+        """Комбинированный анализ (тип + контекст) одним запросом → fallback на два отдельных вызова."""
+        cache = self.cache
+        if cache is not None:
+            context_key = context_key if context_key is not None else fingerprint(case_context)
+            # Пробный поиск без учёта в метриках: при частичном попадании ниже пойдут обычные вызовы,
+            # а промахи учитываются там, где ответ в итоге получен не из кэша
+            label = cache.get_label(question, context_key, record=False)
+            contextual = cache.get_context(question, last_response, record=False) if last_response else False
+            qtype = next((qt for qt in question_types if qt.get('id') == label), None)
+            if qtype is not None and contextual is not None:
+                cache.get_label(question, context_key)
+                if last_response:
+                    cache.get_context(question, last_response)
+                return qtype, contextual
+        local = self.classify_locally(question, question_types)
+        if local is not None:
+            if cache is not None:
+                cache.get_label(question, context_key)
+            # Тип уже известен — к LLM идёт только проверка контекста (её поиск в кэше учитывается внутри)
+            return local, await self.check_context_usage(question, last_response, call_llm_func, prompts)
+        if call_llm_func is not None and prompts and prompts.get('question_analysis'):
+            try:
+                label, contextual = await self.analyze_question_with_llm(
+                    question, question_types, case_context, last_response, call_llm_func, prompts
+                )
+                qtype = next(qt for qt in question_types if qt.get('id') == label)
+                logger.info(f"LLM combined analysis success: {label}, contextual={contextual}")
+                if cache is not None:
+                    # Учитываем пробный поиск до записи результата, иначе промах не попадёт в метрики
+                    cache.get_label(question, context_key)
+                    if last_response:
+                        cache.get_context(question, last_response)
+                    cache.put_label(question, context_key, label)
+                    if last_response:
+                        cache.put_context(question, last_response, contextual)
+                self._log_label(question, label)
+                return qtype, contextual
+            except Exception as e:
+                logger.warning(f"LLM combined analysis failed ({type(e).__name__}): {e}; using two-call path")
+        qtype, contextual = await asyncio.gather(
+            # Локальная модель уже не дала уверенного ответа выше
+            self.classify_question(question, question_types, case_context, call_llm_func, prompts, context_key, use_local=False),
+            self.check_context_usage(question, last_response, call_llm_func, prompts),
+        )
+        return qtype, contextual
+
     async def check_context_usage(
         self,
         question: str,
@@ -77,10 +297,17 @@ class QuestionAnalyzer:
         """Определяет, использует ли вопрос факты из последнего ответа клиента."""
         if not last_response:
             return False
+        # Кэш проверяется и без LLM: в деградированном режиме call_llm_func не передаётся
+        if self.cache is not None:
+            cached = self.cache.get_context(question, last_response)
+            if cached is not None:
+                return cached
         # Попытка через LLM
         if call_llm_func and prompts and prompts.get('context_check'):
             try:
-                prompt = str(prompts.get('context_check', '')).format(
+                prompt = _render_prompt(
+                    prompts,
+                    'context_check',
                     last_response=last_response,
                     question=question
                 )
@@ -88,9 +315,13 @@ class QuestionAnalyzer:
                 label = (raw or '').strip().lower()
                 if 'yes' in label and not 'no' in label:
                     logger.info("LLM context check: yes")
+                    if self.cache is not None:
+                        self.cache.put_context(question, last_response, True)
                     return True
                 if 'no' in label:
                     logger.info("LLM context check: no")
+                    if self.cache is not None:
+                        self.cache.put_context(question, last_response, False)
                     return False
                 raise ValueError(f"Unrecognized context label: {raw}")
             except Exception as e:
@@ -100,17 +331,12 @@ class QuestionAnalyzer:
 
     def check_context_usage_fallback(self, question: str, last_response: str) -> bool:
         q = question.lower()
-        resp = last_response.lower()
         # Числа из ответа
-        import re
-        numbers = re.findall(r"\b\d+[\d\s.,]*\b", resp)
+        numbers = _NUMBER_RE.findall(last_response)
         if any(n.strip() and n.strip() in q for n in numbers):
             return True
-        # Ключевые маркеры ссылок на сказанное
-        markers = ["как вы сказали", "уточните", "по поводу", "вы упомянули", "этих", "этой проблемы", "этой ситуации"]
-        if any(m in q for m in markers):
-            return True
-        return False
+        # Ключевые маркеры ссылок на сказанное (один проход автомата)
+        return _MARKER in self._matcher.payloads(question)
 
     def calculate_clarity_increase(self, question_type: Dict[str, Any]) -> int:
         """Return clarity points from the question type definition."""
@@ -0,0 +1,177 @@
+"""Client-side rate limiting and prioritised scheduling of LLM requests.
+
+Providers enforce requests-per-minute and tokens-per-minute limits per
+model; exceeding them returns 429s that burn retries and push traffic to
+the fallback. ``EndpointLimiter`` keeps two token buckets for one
+``(provider, model)`` — requests and estimated tokens — and makes callers
+wait for capacity instead. Waiting callers are served by priority (lower
+value first, FIFO within a priority), so interactive client replies go
+ahead of classification and the long mentor feedback during a burst.
+"""
+
+import asyncio
+import heapq
+import itertools
+import time
+from dataclasses import dataclass
+from typing import Callable, Dict, List, Optional, Tuple
+
+
+@dataclass
+class RateLimit:
+    """Per-endpoint limits; ``0`` disables the corresponding bucket."""
+    requests_per_min: float = 0.0
+    tokens_per_min: float = 0.0
+    burst_sec: float = 10.0
+
+    @property
+    def enabled(self) -> bool:
+        return self.requests_per_min > 0 or self.tokens_per_min > 0
+
+
+class TokenBucket:
+    """Classic token bucket refilled continuously at ``rate`` per second."""
+
+    __slots__ = ('rate', 'capacity', '_level', '_updated')
+
+    def __init__(self, rate: float, capacity: float, now: float) -> None:
+        self.rate = rate
+        self.capacity = capacity
+        self._level = capacity
+        self._updated = now
+
+    def _refill(self, now: float) -> None:
+        self._level = min(self.capacity, self._level + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def wait_time(self, amount: float, now: float) -> float:
+        """Seconds until ``amount`` is available (0 if it is now)."""
+        self._refill(now)
+        missing = min(amount, self.capacity) - self._level
+        return max(0.0, missing / self.rate)
+
+    def take(self, amount: float) -> None:
+        # Запрос больше ёмкости ведра ждёт полного ведра и опустошает его
+        self._level -= min(amount, self.capacity)
+
+
+class EndpointLimiter:
+    """Requests/min and tokens/min buckets with a priority wait queue."""
+
+    def __init__(self, name: str, limit: RateLimit, clock: Callable[[], float] = time.monotonic) -> None:
+        self.name = name
+        self._clock = clock
+        now = clock()
+        self._buckets: List[Tuple[TokenBucket, bool]] = []
+        if limit.requests_per_min > 0:
+            rate = limit.requests_per_min / 60
+            self._buckets.append((TokenBucket(rate, max(1.0, rate * limit.burst_sec), now), False))
+        if limit.tokens_per_min > 0:
+            rate = limit.tokens_per_min / 60
+            self._buckets.append((TokenBucket(rate, max(1.0, rate * limit.burst_sec), now), True))
+        # (приоритет, порядковый номер, оценка токенов, future)
+        self._queue: List[Tuple[int, int, int, asyncio.Future]] = []
+        self._seq = itertools.count()
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self.granted = 0
+        self.waited = 0
+        self.cancelled = 0
+        self.max_depth = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+
+    @property
+    def depth(self) -> int:
+        return sum(1 for *_, future in self._queue if not future.done())
+
+    def _wait_time(self, tokens: int, now: float) -> float:
+        return max((bucket.wait_time(tokens if is_tokens else 1, now) for bucket, is_tokens in self._buckets), default=0.0)
+
+    def _take(self, tokens: int) -> None:
+        for bucket, is_tokens in self._buckets:
+            bucket.take(tokens if is_tokens else 1)
+
+    async def acquire(self, priority: int = 0, tokens: int = 0) -> float:
+        """Wait for capacity for one request of about ``tokens`` tokens; returns the wait in seconds."""
+        if not self._queue and self._wait_time(tokens, self._clock()) <= 0:
+            self._take(tokens)
+            self.granted += 1
+            return 0.0
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._queue, (priority, next(self._seq), tokens, future))
+        self.max_depth = max(self.max_depth, len(self._queue))
+        started = self._clock()
+        if self._timer is None:
+            self._dispatch()
+        try:
+            await future
+        except asyncio.CancelledError:
+            if not future.done():
+                future.cancel()
+            self.cancelled += 1
+            # Ушедший из головы очереди запрос не должен задерживать следующих
+            if self._timer is not None:
+                self._timer.cancel()
+                self._dispatch()
+            raise
+        waited = self._clock() - started
+        self.waited += 1
+        self.wait_total += waited
+        self.wait_max = max(self.wait_max, waited)
+        return waited
+
+    def _dispatch(self) -> None:
+        """Grant queued requests in priority order while capacity lasts, then re-arm the timer."""
+        self._timer = None
+        queue = self._queue
+        while queue:
+            _, _, tokens, future = queue[0]
+            if future.done():
+                heapq.heappop(queue)
+                continue
+            delay = self._wait_time(tokens, self._clock())
+            if delay > 0:
+                self._timer = asyncio.get_running_loop().call_later(delay, self._dispatch)
+                return
+            heapq.heappop(queue)
+            self._take(tokens)
+            self.granted += 1
+            future.set_result(None)
+
+    def stats(self) -> Dict[str, float]:
+        return {
+            'granted': self.granted,
+            'waited': self.waited,
+            'cancelled': self.cancelled,
+            'depth': self.depth,
+            'max_depth': self.max_depth,
+            'wait_avg_ms': round(1000 * self.wait_total / self.waited, 1) if self.waited else 0.0,
+            'wait_max_ms': round(1000 * self.wait_max, 1),
+        }
+
+
+class RateLimiterRegistry:
+    """One ``EndpointLimiter`` per ``(provider, model)``; ``limits`` are per provider."""
+
+    def __init__(self, limits: Dict[str, RateLimit], clock: Callable[[], float] = time.monotonic) -> None:
+        self.limits = limits
+        self._clock = clock
+        self._limiters: Dict[Tuple[str, str], Optional[EndpointLimiter]] = {}
+
+    def get(self, provider: str, model: str) -> Optional[EndpointLimiter]:
+        key = (provider, model)
+        if key not in self._limiters:
+            limit = self.limits.get(provider)
+            self._limiters[key] = (
+                EndpointLimiter(f"{provider}:{model}", limit, self._clock) if limit and limit.enabled else None
+            )
+        return self._limiters[key]
+
+    async def acquire(self, provider: str, model: str, priority: int = 0, tokens: int = 0) -> float:
+        limiter = self.get(provider, model)
+        if limiter is None:
+            return 0.0
+        return await limiter.acquire(priority, tokens)
+
+    def stats(self) -> Dict[str, Dict[str, float]]:
+        return {limiter.name: limiter.stats() for limiter in self._limiters.values() if limiter is not None}
@@ -2,17 +2,46 @@ import json
 import logging
 from dataclasses import dataclass
 from pathlib import Path
-from typing import Any, Dict, Optional
+from typing import Any, Dict, FrozenSet, Optional
+
+from .templates import CompiledTemplate
 
 
 logger = logging.getLogger(__name__)
 
+# Placeholders the bot passes to each known template. Templates not listed
+# here (custom texts) are only checked for well-formed syntax.
+TEMPLATE_PLACEHOLDERS: Dict[str, Dict[str, FrozenSet[str]]] = {
+    'messages': {
+        'welcome': frozenset(),
+        'case_generated': frozenset({'client_case'}),
+        'training_complete': frozenset({'report'}),
+        'error_generic': frozenset(),
+        'progress': frozenset({'count', 'max', 'clarity'}),
+        'question_feedback': frozenset({'question_type', 'client_response', 'progress_line'}),
+        'clarity_reached': frozenset({'clarity'}),
+    },
+    'prompts': {
+        'case_generation': frozenset(),
+        'client_response': frozenset({'client_case'}),
+        'feedback': frozenset({
+            'last_question_type', 'question_count', 'clarity_level',
+            'situational_q', 'problem_q', 'implication_q', 'need_payoff_q',
+        }),
+        'question_classification': frozenset({'question', 'context'}),
+        'context_check': frozenset({'last_response', 'question'}),
+        'question_analysis': frozenset({'question', 'context', 'last_response'}),
+    },
+}
+
 
 @dataclass
 class LoadedScenario:
     """Container for a loaded scenario configuration."""
     path: Path
     config: Dict[str, Any]
+    messages: Dict[str, CompiledTemplate]
+    prompts: Dict[str, CompiledTemplate]
 
 
 class ScenarioValidationError(Exception):
@@ -50,7 +79,12 @@ class ScenarioLoader:
         # Optional deep validation for case variants if present
         if 'case_variants' in config:
             self._validate_case_variants(config['case_variants'])
-        self._loaded = LoadedScenario(path=path, config=config)
+        self._loaded = LoadedScenario(
+            path=path,
+            config=config,
+            messages=self.compile_templates(config, 'messages'),
+            prompts=self.compile_templates(config, 'prompts'),
+        )
         logger.info("Scenario loaded: %s v%s", config.get("scenario_info", {}).get("name"), config.get("scenario_info", {}).get("version"))
         return self._loaded
 
@@ -117,11 +151,44 @@ class ScenarioLoader:
             if 'unit' not in product:
                 logger.warning("Product %s missing 'unit', default will be used", product.get('name', '<unknown>'))
 
+        for item in variants.get('companies', []) + variants.get('products', []):
+            weight = item.get('weight', 1)
+            if isinstance(weight, bool) or not isinstance(weight, (int, float)) or weight < 0:
+                raise ScenarioValidationError(f"Invalid weight {weight!r} in case_variants: {item.get('type') or item.get('name')}")
+
         for situation in variants.get('base_situations', []):
             if 'type' not in situation or 'template' not in situation:
                 raise ScenarioValidationError(f"Base situation missing required fields: {situation}")
         logger.info("✅ Валидация case_variants пройдена успешно")
 
+    def compile_templates(self, config: Dict[str, Any], section: str) -> Dict[str, CompiledTemplate]:
+        """Parse every template of ``messages``/``prompts`` and check its placeholders.
+
+        Raises:
+            ScenarioValidationError on malformed templates or placeholders
+            the bot never passes for that template.
+        """
+        known = TEMPLATE_PLACEHOLDERS.get(section, {})
+        compiled: Dict[str, CompiledTemplate] = {}
+        for name, source in config.get(section, {}).items():
+            try:
+                template = CompiledTemplate(str(source), f"{section}.{name}")
+            except ValueError as e:
+                raise ScenarioValidationError(str(e)) from e
+            allowed = known.get(name)
+            if allowed is not None and not template.placeholders <= allowed:
+                unknown = ', '.join(sorted(template.placeholders - allowed))
+                raise ScenarioValidationError(
+                    f"{section}.{name}: unknown placeholder(s) {unknown}; allowed: {', '.join(sorted(allowed)) or 'none'}"
+                )
+            compiled[name] = template
+        return compiled
+
+    @property
+    def prompts(self) -> Dict[str, CompiledTemplate]:
+        """Compiled prompt templates of the loaded scenario."""
+        return self._ensure_loaded().prompts
+
     def _ensure_loaded(self) -> LoadedScenario:
         if not self._loaded:
             raise RuntimeError("Scenario not loaded. Call load_scenario() first.")
@@ -129,18 +196,16 @@ class ScenarioLoader:
 
     def get_prompt(self, prompt_name: str, **kwargs: Any) -> str:
         """Get a prompt by name and format with kwargs."""
-        loaded = self._ensure_loaded()
-        template = loaded.config["prompts"].get(prompt_name)
+        template = self._ensure_loaded().prompts.get(prompt_name)
         if template is None:
             raise KeyError(f"Prompt not found: {prompt_name}")
-        return str(template).format(**kwargs)
+        return template.render(**kwargs)
 
     def get_message(self, message_name: str, **kwargs: Any) -> str:
         """Get a message by name and format with kwargs."""
-        loaded = self._ensure_loaded()
-        template = loaded.config["messages"].get(message_name)
+        template = self._ensure_loaded().messages.get(message_name)
         if template is None:
             raise KeyError(f"Message not found: {message_name}")
-        return str(template).format(**kwargs)
+        return template.render(**kwargs)
 
 
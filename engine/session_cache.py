@@ -0,0 +1,149 @@
+"""Bounded in-memory cache of user records with LRU and idle-TTL eviction."""
+
+import logging
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, Iterator, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+class SessionCache:
+    """LRU cache with an optional idle TTL.
+
+    Entries are kept in access order, so the least recently used (and the
+    longest idle) entries sit at the front and expiry only inspects the head.
+    Evicted entries are handed to ``on_evict`` (e.g. to spill them to
+    persistent storage).
+    """
+
+    def __init__(
+        self,
+        max_entries: int = 5000,
+        idle_ttl: float = 0.0,
+        on_evict: Optional[Callable[[Hashable, Any], None]] = None,
+        clock: Callable[[], float] = time.monotonic,
+    ) -> None:
+        self.max_entries = max_entries
+        self.idle_ttl = idle_ttl
+        self.on_evict = on_evict
+        self._clock = clock
+        self._data: "OrderedDict[Hashable, Tuple[float, Any]]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions_lru = 0
+        self.evictions_ttl = 0
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def __contains__(self, key: Hashable) -> bool:
+        return self.peek(key) is not None
+
+    def __iter__(self) -> Iterator[Hashable]:
+        return iter(list(self._data.keys()))
+
+    def __getitem__(self, key: Hashable) -> Any:
+        value = self.get(key)
+        if value is None:
+            raise KeyError(key)
+        return value
+
+    def __setitem__(self, key: Hashable, value: Any) -> None:
+        self._data[key] = (self._clock(), value)
+        self._data.move_to_end(key)
+        self._evict()
+
+    def restore(self, key: Hashable, value: Any, touched: float) -> None:
+        """Insert an entry with its original ``touched`` time (e.g. from a snapshot).
+
+        Entries must be restored oldest first, as ``items()`` lists them, so
+        that expiry can keep inspecting only the head.
+        """
+        self._data[key] = (touched, value)
+        self._data.move_to_end(key)
+        self._evict()
+
+    def _expired(self, touched: float, now: float) -> bool:
+        return self.idle_ttl > 0 and now - touched > self.idle_ttl
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        """Return the value and mark it recently used; counts hits/misses."""
+        now = self._clock()
+        item = self._data.get(key)
+        if item is None or self._expired(item[0], now):
+            if item is not None:
+                self._drop(key, 'ttl')
+            self.misses += 1
+            return default
+        self.hits += 1
+        self._data[key] = (now, item[1])
+        self._data.move_to_end(key)
+        return item[1]
+
+    def peek(self, key: Hashable) -> Any:
+        """Return the value without touching recency or counters."""
+        item = self._data.get(key)
+        if item is None or self._expired(item[0], self._clock()):
+            return None
+        return item[1]
+
+    def setdefault(self, key: Hashable, value: Any) -> Any:
+        existing = self.peek(key)
+        if existing is not None:
+            return existing
+        self[key] = value
+        return value
+
+    def pop(self, key: Hashable, default: Any = None) -> Any:
+        item = self._data.pop(key, None)
+        return item[1] if item is not None else default
+
+    def items(self) -> List[Tuple[Hashable, Any, float]]:
+        """Live entries as ``(key, value, last_touched)`` in LRU order, without touching recency."""
+        now = self._clock()
+        return [(key, value, touched) for key, (touched, value) in self._data.items() if not self._expired(touched, now)]
+
+    def clear(self) -> None:
+        self._data.clear()
+
+    def _drop(self, key: Hashable, reason: str) -> None:
+        _, value = self._data.pop(key)
+        if reason == 'ttl':
+            self.evictions_ttl += 1
+        else:
+            self.evictions_lru += 1
+        if self.on_evict is not None:
+            try:
+                self.on_evict(key, value)
+            except Exception as e:
+                logger.error("Session eviction callback failed for %s: %s", key, e)
+
+    def _evict(self) -> None:
+        now = self._clock()
+        while self._data:
+            key, (touched, _) = next(iter(self._data.items()))
+            if self._expired(touched, now):
+                self._drop(key, 'ttl')
+            elif len(self._data) > self.max_entries > 0:
+                self._drop(key, 'lru')
+            else:
+                break
+
+    def evict_expired(self) -> int:
+        """Drop all idle-expired entries; returns how many were evicted."""
+        before = self.evictions_ttl
+        self._evict()
+        return self.evictions_ttl - before
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            'size': len(self._data),
+            'max_entries': self.max_entries,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': round(self.hits / lookups, 4) if lookups else 0.0,
+            'evictions_lru': self.evictions_lru,
+            'evictions_ttl': self.evictions_ttl,
+        }
@@ -0,0 +1,121 @@
+"""Progressive rendering of streamed LLM output into a single chat message.
+
+The first message is sent as soon as the stream has produced a few
+characters; after that the same message is edited as text arrives. Edits
+are coalesced: at most one per ``min_interval`` seconds, always showing the
+latest text, so long answers stay within Telegram's per-chat edit limits.
+Flood-control errors (anything exposing ``retry_after``) push the next edit
+back instead of failing the turn.
+"""
+
+import asyncio
+import logging
+import time
+from typing import Any, Awaitable, Callable, Optional
+
+logger = logging.getLogger(__name__)
+
+# Лимит длины текста сообщения Telegram
+MAX_MESSAGE_CHARS = 4096
+
+
+class ProgressiveMessage:
+    """One chat message that follows a growing text.
+
+    ``send`` posts the first version and returns the message object, which
+    must provide ``edit_text``. ``render`` turns partial text into what is
+    displayed while streaming (e.g. adds a header); ``finish`` shows its
+    text as is.
+    """
+
+    def __init__(
+        self,
+        send: Callable[[str], Awaitable[Any]],
+        min_interval: float = 1.0,
+        first_chunk_chars: int = 24,
+        render: Callable[[str], str] = lambda text: text,
+        clock: Callable[[], float] = time.monotonic,
+    ) -> None:
+        self._send = send
+        self._render = render
+        self._clock = clock
+        self.min_interval = min_interval
+        self.first_chunk_chars = first_chunk_chars
+        self.message: Any = None
+        self.edits = 0
+        self._latest = ''
+        self._shown = ''
+        self._next_edit_at = 0.0
+        self._flush_task: Optional[asyncio.Task] = None
+        self._lock = asyncio.Lock()
+
+    async def update(self, text: str) -> None:
+        """Record the text streamed so far; sends or schedules an edit as allowed."""
+        self._latest = text
+        if self.message is None:
+            if len(text.strip()) >= self.first_chunk_chars:
+                await self._show(self._render(text), first=True)
+            return
+        if self._flush_task is None or self._flush_task.done():
+            delay = self._next_edit_at - self._clock()
+            if delay <= 0:
+                await self._show(self._render(text))
+            else:
+                self._flush_task = asyncio.create_task(self._deferred_flush(delay))
+
+    def cancel(self) -> None:
+        """Drop a pending coalesced edit (on completion or error)."""
+        if self._flush_task is not None:
+            self._flush_task.cancel()
+            self._flush_task = None
+
+    async def finish(self, text: str) -> Any:
+        """Show the final text (new message or last edit) and return the message."""
+        self.cancel()
+        if self.message is None:
+            return await self._show(text, first=True, final=True)
+        for _ in range(2):
+            try:
+                await self._show(text, final=True)
+                break
+            except Exception as e:
+                retry_after = _retry_after(e)
+                if retry_after is None:
+                    raise
+                await asyncio.sleep(retry_after)
+        return self.message
+
+    async def _deferred_flush(self, delay: float) -> None:
+        await asyncio.sleep(delay)
+        await self._show(self._render(self._latest))
+
+    async def _show(self, text: str, first: bool = False, final: bool = False) -> Any:
+        async with self._lock:
+            shown = text[:MAX_MESSAGE_CHARS]
+            if self.message is not None and shown == self._shown:
+                return self.message
+            try:
+                if self.message is None:
+                    self.message = await self._send(shown)
+                else:
+                    await self.message.edit_text(shown)
+                    self.edits += 1
+            except Exception as e:
+                retry_after = _retry_after(e)
+                if final or (first and self.message is None):
+                    raise
+                # Промежуточная правка не критична: следующая покажет актуальный текст
+                self._next_edit_at = self._clock() + (retry_after or self.min_interval)
+                logger.debug("Progressive edit skipped: %s", e)
+                return self.message
+            self._shown = shown
+            self._next_edit_at = self._clock() + self.min_interval
+            return self.message
+
+
+def _retry_after(error: Exception) -> Optional[float]:
+    value = getattr(error, 'retry_after', None)
+    if value is None:
+        return None
+    # telegram.error.RetryAfter.retry_after — int или timedelta в зависимости от версии
+    return float(value.total_seconds() if hasattr(value, 'total_seconds') else value)
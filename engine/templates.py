@@ -0,0 +1,98 @@
+"""Pre-compiled ``str.format`` templates for scenario messages and prompts.
+
+A template is parsed once into alternating literal and field segments.
+Rendering only formats the field values and joins them with the literal
+segments, so the static text of a large prompt (typically a long
+instruction prefix) is never re-scanned or re-formatted per call. The
+output is identical to ``template.format(**kwargs)``.
+"""
+
+import re
+from string import Formatter
+from typing import Any, FrozenSet, List, Optional, Tuple
+
+_FORMATTER = Formatter()
+_CONVERTERS = {'s': str, 'r': repr, 'a': ascii}
+# Корень имени поля: всё до первого '.' или '['
+_FIELD_ROOT = re.compile(r'[^.\[]*')
+
+# (индекс сегмента, имя поля, конверсия, спецификация формата)
+_Field = Tuple[int, str, Optional[str], str]
+
+
+class CompiledTemplate:
+    """A ``str.format`` template parsed into reusable segments.
+
+    Only keyword placeholders are supported; positional (``{}``, ``{0}``)
+    fields and malformed braces raise ``ValueError`` at compile time.
+    Attribute/index fields (``{a.b}``, ``{a[0]}``) and nested format specs
+    are accepted but rendered through plain ``str.format``.
+    """
+
+    __slots__ = ('name', 'source', 'placeholders', 'prefix', '_segments', '_fields', '_fallback')
+
+    def __init__(self, source: str, name: str = '<template>') -> None:
+        self.name = name
+        self.source = source
+        segments: List[Optional[str]] = []
+        fields: List[_Field] = []
+        names = set()
+        fallback = False
+        try:
+            parsed = list(_FORMATTER.parse(source))
+        except ValueError as e:
+            raise ValueError(f"{name}: malformed template: {e}") from e
+        for literal, field_name, spec, conversion in parsed:
+            if literal:
+                if segments and isinstance(segments[-1], str):
+                    segments[-1] += literal
+                else:
+                    segments.append(literal)
+            if field_name is None:
+                continue
+            root, rest = _split_field(field_name)
+            if root == '' or root.isdigit():
+                raise ValueError(f"{name}: positional placeholder {{{field_name}}} is not supported, use a name")
+            if conversion is not None and conversion not in _CONVERTERS:
+                raise ValueError(f"{name}: unknown conversion !{conversion} in {{{field_name}}}")
+            if rest or (spec and '{' in spec):
+                fallback = True
+            names.add(root)
+            fields.append((len(segments), root, conversion, spec or ''))
+            segments.append(None)
+        self.placeholders: FrozenSet[str] = frozenset(names)
+        self.prefix = segments[0] if segments and isinstance(segments[0], str) else ''
+        self._segments = segments
+        self._fields = fields
+        self._fallback = fallback
+
+    def render(self, **kwargs: Any) -> str:
+        """Substitute ``kwargs``; missing placeholders raise ``KeyError`` like ``str.format``."""
+        if not self._fields:
+            # Шаблон без полей: текст с уже раскрытыми {{ }}
+            return self.prefix
+        if self._fallback:
+            return self.source.format(**kwargs)
+        parts = self._segments.copy()
+        for index, name, conversion, spec in self._fields:
+            value = kwargs[name]
+            if conversion is not None:
+                value = _CONVERTERS[conversion](value)
+            parts[index] = value if (type(value) is str and not spec) else format(value, spec)
+        return ''.join(parts)
+
+    def __str__(self) -> str:
+        return self.source
+
+    def __bool__(self) -> bool:
+        return bool(self.source)
+
+    def __repr__(self) -> str:
+        return f"CompiledTemplate({self.name!r}, placeholders={sorted(self.placeholders)!r})"
+
+
+def _split_field(field_name: str) -> Tuple[str, bool]:
+    """Root of a field name (``'a'`` for ``a.b[0]``) and whether it has accessors."""
+    root = _FIELD_ROOT.match(field_name).group()
+    return root, len(root) < len(field_name)
+
@@ -0,0 +1,71 @@
+"""Concurrent execution of the independent LLM stages of a training turn.
+
+Each stage gets its own timeout and a synchronous fallback. A stage that
+times out is cancelled and replaced by its fallback value, so one slow
+provider never blocks the others and the turn costs roughly the slowest
+stage instead of the sum of all of them.
+"""
+
+import asyncio
+import logging
+import time
+from dataclasses import dataclass, field
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class Stage:
+    """A single turn stage: coroutine factory, timeout and fallback."""
+    name: str
+    run: Callable[[], Awaitable[Any]]
+    timeout: Optional[float]
+    fallback: Callable[[], Any]
+
+
+@dataclass
+class StageResult:
+    """Outcome of a stage; ``status`` is one of ok/timeout/error."""
+    name: str
+    value: Any
+    status: str = 'ok'
+    elapsed: float = 0.0
+    error: Optional[str] = None
+
+
+@dataclass
+class TurnResult:
+    """Results of all stages of a turn keyed by stage name."""
+    stages: Dict[str, StageResult] = field(default_factory=dict)
+    elapsed: float = 0.0
+
+    def __getitem__(self, name: str) -> Any:
+        return self.stages[name].value
+
+
+async def _run_stage(stage: Stage) -> StageResult:
+    started = time.perf_counter()
+    try:
+        value = await asyncio.wait_for(stage.run(), timeout=stage.timeout)
+        return StageResult(stage.name, value, 'ok', time.perf_counter() - started)
+    except asyncio.TimeoutError:
+        logger.warning("Turn stage '%s' timed out after %.1fs; using fallback", stage.name, stage.timeout)
+        status, error = 'timeout', None
+    except Exception as e:
+        logger.warning("Turn stage '%s' failed (%s): %s; using fallback", stage.name, type(e).__name__, e)
+        status, error = 'error', f"{type(e).__name__}: {e}"
+    return StageResult(stage.name, stage.fallback(), status, time.perf_counter() - started, error)
+
+
+async def run_stages(stages: List[Stage]) -> TurnResult:
+    """Run stages concurrently; cancellation of the caller cancels all stages."""
+    started = time.perf_counter()
+    results = await asyncio.gather(*(_run_stage(s) for s in stages))
+    turn = TurnResult({r.name: r for r in results}, time.perf_counter() - started)
+    logger.info(
+        "Turn stages: %s (total %.2fs)",
+        ", ".join(f"{r.name}={r.status}/{r.elapsed:.2f}s" for r in results),
+        turn.elapsed,
+    )
+    return turn
@@ -0,0 +1,141 @@
+"""Per-user serialization of conversation turns.
+
+Handlers that read and mutate a user's session across ``await`` points
+must not interleave for the same user, otherwise counters, clarity and the
+end-of-training report can be applied twice. ``TurnSerializer`` runs at
+most one turn per user at a time; messages that arrive while a turn is in
+progress are handled according to the policy:
+
+- ``queue``: wait and run in arrival order;
+- ``drop``: reject the follow-up;
+- ``merge``: rapid follow-ups are joined into a single next turn.
+
+Different users never wait for each other.
+"""
+
+import asyncio
+import logging
+from typing import Awaitable, Callable, Dict, Hashable, List, Optional
+
+logger = logging.getLogger(__name__)
+
+POLICIES = ('queue', 'drop', 'merge')
+
+
+class _Pending:
+    """Texts collected for one merged turn."""
+    __slots__ = ('parts',)
+
+    def __init__(self, text: str) -> None:
+        self.parts: List[str] = [text]
+
+
+class _UserTurns:
+    __slots__ = ('lock', 'waiting', 'merge_slot')
+
+    def __init__(self) -> None:
+        self.lock = asyncio.Lock()
+        self.waiting = 0
+        self.merge_slot: Optional[_Pending] = None
+
+
+class TurnSerializer:
+    """One turn at a time per key, with a coalescing policy for follow-ups.
+
+    ``mergeable`` decides which texts may be merged (e.g. questions, but not
+    control words); ``max_pending`` bounds the coalescible turns waiting per
+    user.
+    """
+
+    def __init__(
+        self,
+        policy: str = 'queue',
+        max_pending: int = 5,
+        merge_separator: str = '\n',
+        mergeable: Callable[[str], bool] = lambda text: True,
+    ) -> None:
+        if policy not in POLICIES:
+            raise ValueError(f"Unknown turn policy {policy!r}, expected one of {', '.join(POLICIES)}")
+        self.policy = policy
+        self.max_pending = max_pending
+        self.merge_separator = merge_separator
+        self.mergeable = mergeable
+        self._users: Dict[Hashable, _UserTurns] = {}
+        self.turns = 0
+        self.queued = 0
+        self.dropped = 0
+        self.merged = 0
+
+    def busy(self, key: Hashable) -> bool:
+        state = self._users.get(key)
+        return state is not None and (state.lock.locked() or state.waiting > 0)
+
+    async def run(
+        self,
+        key: Hashable,
+        text: str,
+        handler: Callable[[str], Awaitable[None]],
+        coalesce: bool = True,
+    ) -> bool:
+        """Run ``handler(text)`` as the user's next turn.
+
+        Returns ``False`` if the text was rejected (``drop`` policy or the
+        pending limit). A text merged into a waiting turn returns ``True``
+        without calling ``handler``: the carrier turn processes it.
+        ``coalesce=False`` always queues, even past ``max_pending`` (commands
+        that must not be lost).
+        """
+        state = self._users.get(key)
+        if state is None:
+            state = self._users[key] = _UserTurns()
+        busy = state.lock.locked() or state.waiting > 0
+        slot: Optional[_Pending] = None
+        if busy and coalesce:
+            if self.policy == 'drop':
+                self.dropped += 1
+                return False
+            if self.policy == 'merge' and self.mergeable(text):
+                if state.merge_slot is not None:
+                    state.merge_slot.parts.append(text)
+                    self.merged += 1
+                    return True
+                slot = state.merge_slot = _Pending(text)
+        if busy and coalesce and state.waiting >= self.max_pending:
+            if slot is not None:
+                state.merge_slot = None
+            self.dropped += 1
+            return False
+        if busy:
+            self.queued += 1
+        state.waiting += 1
+        acquired = False
+        try:
+            await state.lock.acquire()
+            acquired = True
+            state.waiting -= 1
+            if slot is not None:
+                # Слияние закрывается, как только ход начался: новые сообщения пойдут в следующий
+                if state.merge_slot is slot:
+                    state.merge_slot = None
+                text = self.merge_separator.join(slot.parts)
+            self.turns += 1
+            await handler(text)
+            return True
+        finally:
+            if acquired:
+                state.lock.release()
+            else:
+                state.waiting -= 1
+                if state.merge_slot is slot:
+                    state.merge_slot = None
+            if not state.lock.locked() and state.waiting == 0 and self._users.get(key) is state:
+                del self._users[key]
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            'turns': self.turns,
+            'queued': self.queued,
+            'dropped': self.dropped,
+            'merged': self.merged,
+            'active_users': len(self._users),
+        }
@@ -0,0 +1,246 @@
+"""Compact typed containers for per-user session and statistics state.
+
+``Session`` and ``UserStats`` use ``__slots__`` and keep per-question-type
+counters in a fixed-size ``array`` indexed by the type's position in
+``question_types``. Both still behave as mutable mappings with the legacy
+string keys, so scenario achievement conditions, reports and persisted
+JSON keep working unchanged.
+"""
+
+from array import array
+from collections.abc import MutableMapping
+from typing import Any, Dict, Iterator, List, Optional, Sequence, Tuple
+
+from .dialogue import DEFAULT_LIMITS, DialogueLimits, DialogueMemory
+
+
+class QuestionTypeIndex:
+    """Position of each question type id within the scenario's ``question_types``."""
+    __slots__ = ('ids', 'positions')
+
+    def __init__(self, question_types: Sequence[Dict[str, Any]]) -> None:
+        self.ids: Tuple[str, ...] = tuple(t['id'] for t in question_types)
+        self.positions: Dict[str, int] = {tid: i for i, tid in enumerate(self.ids)}
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+
+class _SlotMapping(MutableMapping):
+    """Mapping view over the slots listed in ``_FIELDS``.
+
+    Keys outside ``_FIELDS`` are kept in a lazily created ``extra`` dict so
+    records written by newer/older versions survive a round trip.
+    """
+    __slots__ = ('extra',)
+    _FIELDS: Tuple[str, ...] = ()
+
+    def __getitem__(self, key: str) -> Any:
+        if key in self._FIELDS:
+            return getattr(self, key)
+        if self.extra is not None and key in self.extra:
+            return self.extra[key]
+        raise KeyError(key)
+
+    def __setitem__(self, key: str, value: Any) -> None:
+        if key in self._FIELDS:
+            setattr(self, key, value)
+        else:
+            if self.extra is None:
+                self.extra = {}
+            self.extra[key] = value
+
+    def __delitem__(self, key: str) -> None:
+        if key in self._FIELDS:
+            raise KeyError(f"Field {key} cannot be deleted")
+        if self.extra is None or key not in self.extra:
+            raise KeyError(key)
+        del self.extra[key]
+
+    def __iter__(self) -> Iterator[str]:
+        yield from self._FIELDS
+        if self.extra:
+            yield from self.extra
+
+    def __len__(self) -> int:
+        return len(self._FIELDS) + (len(self.extra) if self.extra else 0)
+
+    def __repr__(self) -> str:
+        return f"{type(self).__name__}({self.to_dict()!r})"
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {key: self[key] for key in self}
+
+    def _update_from(self, data: Dict[str, Any]) -> None:
+        for key, value in data.items():
+            self[key] = value
+
+
+class Session(_SlotMapping):
+    """State of the current training session."""
+    __slots__ = (
+        'question_count', 'clarity_level', 'type_counts', 'types', 'client_case', 'case_data',
+        'last_question_type', 'chat_state', 'contextual_questions', 'last_client_response', 'context_streak',
+        'client_prompt', 'history', 'dialogue_limits',
+    )
+    _FIELDS = (
+        'question_count', 'clarity_level', 'per_type_counts', 'client_case', 'case_data',
+        'last_question_type', 'chat_state', 'contextual_questions', 'last_client_response', 'context_streak',
+        'client_prompt', 'dialogue',
+    )
+
+    def __init__(
+        self,
+        types: QuestionTypeIndex,
+        chat_state: str = 'new',
+        dialogue_limits: DialogueLimits = DEFAULT_LIMITS,
+    ) -> None:
+        self.extra: Optional[Dict[str, Any]] = None
+        self.types = types
+        self.dialogue_limits = dialogue_limits
+        self.type_counts = array('I', bytes(4 * len(types)))
+        self.question_count = 0
+        self.clarity_level = 0
+        self.client_case = ''
+        self.case_data: Optional[Dict[str, Any]] = None
+        self.last_question_type = ''
+        self.chat_state = chat_state
+        self.contextual_questions = 0
+        self.last_client_response = ''
+        self.context_streak = 0
+        # Системный промпт клиента: строится один раз при генерации кейса и не меняется до конца тренировки
+        self.client_prompt = ''
+        # История диалога с клиентом создаётся при первом ответе
+        self.history: Optional[DialogueMemory] = None
+
+    @property
+    def dialogue(self) -> Optional[Dict[str, Any]]:
+        """Serializable dialogue history (``None`` before the first answer)."""
+        return self.history.to_dict() if self.history is not None else None
+
+    @dialogue.setter
+    def dialogue(self, data: Optional[Dict[str, Any]]) -> None:
+        self.history = DialogueMemory.from_dict(data, self.dialogue_limits) if data else None
+
+    def remember_turn(self, question: str, answer: str) -> None:
+        if self.history is None:
+            self.history = DialogueMemory(self.dialogue_limits)
+        self.history.add(question, answer)
+
+    def dialogue_messages(self, question: str) -> List[Dict[str, str]]:
+        """Chat messages for the client LLM: bounded history plus the new question."""
+        if self.history is None:
+            return [{'role': 'user', 'content': question}]
+        return self.history.messages(question)
+
+    @property
+    def per_type_counts(self) -> Dict[str, int]:
+        """Counters as ``{type_id: count}`` in ``question_types`` order (a copy)."""
+        return dict(zip(self.types.ids, self.type_counts))
+
+    @per_type_counts.setter
+    def per_type_counts(self, counts: Dict[str, int]) -> None:
+        positions = self.types.positions
+        self.type_counts = array('I', bytes(4 * len(self.types)))
+        for tid, count in (counts or {}).items():
+            pos = positions.get(tid)
+            if pos is not None:
+                self.type_counts[pos] = int(count)
+
+    def increment_type(self, type_id: str) -> None:
+        self.type_counts[self.types.positions[type_id]] += 1
+
+    def type_count(self, type_id: str) -> int:
+        pos = self.types.positions.get(type_id)
+        return self.type_counts[pos] if pos is not None else 0
+
+    @classmethod
+    def from_dict(
+        cls,
+        data: Dict[str, Any],
+        types: QuestionTypeIndex,
+        dialogue_limits: DialogueLimits = DEFAULT_LIMITS,
+    ) -> 'Session':
+        session = cls(types, dialogue_limits=dialogue_limits)
+        session._update_from(data)
+        return session
+
+
+class UserStats(_SlotMapping):
+    """Long-lived per-user statistics, XP and achievements."""
+    __slots__ = (
+        'total_trainings', 'total_questions', 'best_score', 'total_xp', 'current_level',
+        'badges_earned', 'achievements_unlocked', 'master_streak', 'total_contextual_questions',
+        'last_contextual_questions', 'last_training_date', 'case_seed', 'case_cursor', 'level_up_notification',
+    )
+    _FIELDS = __slots__
+
+    def __init__(self) -> None:
+        self.extra: Optional[Dict[str, Any]] = None
+        self.total_trainings = 0
+        self.total_questions = 0
+        self.best_score = 0
+        self.total_xp = 0
+        self.current_level = 1
+        self.badges_earned: List[str] = []
+        self.achievements_unlocked: List[str] = []
+        self.master_streak = 0
+        self.total_contextual_questions = 0
+        self.last_contextual_questions = 0
+        self.last_training_date: Optional[str] = None
+        self.case_seed = 0  # Сид персональной перестановки кейсов (0 — ещё не назначен)
+        self.case_cursor = 0  # Сколько кейсов из перестановки уже выдано
+        self.level_up_notification: Optional[Dict[str, Any]] = None
+
+    def to_dict(self) -> Dict[str, Any]:
+        data = super().to_dict()
+        if data['level_up_notification'] is None:
+            del data['level_up_notification']
+        return data
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> 'UserStats':
+        stats = cls()
+        # recent_cases заменён курсором по перестановке кейсов
+        stats._update_from({k: v for k, v in data.items() if k != 'recent_cases'})
+        return stats
+
+
+class UserRecord:
+    """Session and stats of one user; supports ``record['session']``/``record['stats']``."""
+    __slots__ = ('session', 'stats')
+
+    def __init__(self, session: Session, stats: UserStats) -> None:
+        self.session = session
+        self.stats = stats
+
+    def __getitem__(self, key: str) -> Any:
+        if key == 'session':
+            return self.session
+        if key == 'stats':
+            return self.stats
+        raise KeyError(key)
+
+    def __setitem__(self, key: str, value: Any) -> None:
+        if key not in ('session', 'stats'):
+            raise KeyError(key)
+        setattr(self, key, value)
+
+    @classmethod
+    def new(cls, types: QuestionTypeIndex, dialogue_limits: DialogueLimits = DEFAULT_LIMITS) -> 'UserRecord':
+        return cls(Session(types, dialogue_limits=dialogue_limits), UserStats())
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {'session': self.session.to_dict(), 'stats': self.stats.to_dict()}
+
+    @classmethod
+    def from_dict(
+        cls,
+        data: Dict[str, Any],
+        types: QuestionTypeIndex,
+        dialogue_limits: DialogueLimits = DEFAULT_LIMITS,
+    ) -> 'UserRecord':
+        return cls(
+            Session.from_dict(data.get('session') or {}, types, dialogue_limits),
+            UserStats.from_dict(data.get('stats') or {}),
+        )
@@ -0,0 +1,262 @@
+"""Persistent storage for user sessions and statistics.
+
+``UserStore`` is a minimal key-value interface (user id -> serialized JSON)
+that a SQLite file, an in-memory dict or a Redis-like service can implement.
+``WriteBehindStore`` sits in front of it: the bot marks records dirty on the
+hot path and a background task persists them in batches off the event loop.
+"""
+
+import asyncio
+import json
+import logging
+import sqlite3
+import threading
+import time
+from abc import ABC, abstractmethod
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+def encode_user(data: Any) -> str:
+    """Serialize a user record (a dict or an object with ``to_dict``) to JSON."""
+    if hasattr(data, 'to_dict'):
+        data = data.to_dict()
+    return json.dumps(data, ensure_ascii=False, default=str)
+
+
+def decode_user(raw: str) -> Dict[str, Any]:
+    """Deserialize a user record from JSON."""
+    return json.loads(raw)
+
+
+class UserStore(ABC):
+    """Interface of a user record store.
+
+    Implementations must be safe to call from a worker thread; values are
+    opaque serialized strings. ``get``/``put_many``/``delete`` are abstract,
+    so a backend missing one of them fails at construction time.
+    """
+
+    @abstractmethod
+    def get(self, user_id: int) -> Optional[str]:
+        """Serialized record of ``user_id`` or ``None``."""
+
+    @abstractmethod
+    def put_many(self, items: Dict[int, str]) -> None:
+        """Insert or replace records in one batch."""
+
+    @abstractmethod
+    def delete(self, user_id: int) -> None:
+        """Remove a record (no error if it is absent)."""
+
+    def recent(self, limit: int) -> List[Tuple[int, str]]:
+        """Most recently updated records, used to warm the in-memory state."""
+        return []
+
+    def close(self) -> None:
+        pass
+
+
+class MemoryUserStore(UserStore):
+    """Process-local store (no persistence across restarts)."""
+
+    def __init__(self) -> None:
+        self._items: Dict[int, Tuple[float, str]] = {}
+        self._lock = threading.Lock()
+
+    def get(self, user_id: int) -> Optional[str]:
+        with self._lock:
+            item = self._items.get(user_id)
+        return item[1] if item else None
+
+    def put_many(self, items: Dict[int, str]) -> None:
+        now = time.time()
+        with self._lock:
+            for user_id, raw in items.items():
+                self._items[user_id] = (now, raw)
+
+    def delete(self, user_id: int) -> None:
+        with self._lock:
+            self._items.pop(user_id, None)
+
+    def recent(self, limit: int) -> List[Tuple[int, str]]:
+        with self._lock:
+            items = sorted(self._items.items(), key=lambda kv: kv[1][0], reverse=True)[:limit]
+        return [(user_id, raw) for user_id, (_, raw) in items]
+
+
+class SQLiteUserStore(UserStore):
+    """SQLite-backed store in WAL mode.
+
+    Separate connections are used for reads (event loop thread) and writes
+    (flush worker thread), so lookups are not blocked by a running flush.
+    """
+
+    def __init__(self, path: str) -> None:
+        db_path = Path(path).expanduser()
+        db_path.parent.mkdir(parents=True, exist_ok=True)
+        self._write_conn = self._connect(db_path)
+        self._write_conn.execute(
+            "CREATE TABLE IF NOT EXISTS users ("
+            " user_id INTEGER PRIMARY KEY,"
+            " data TEXT NOT NULL,"
+            " updated_at REAL NOT NULL)"
+        )
+        self._write_conn.execute("CREATE INDEX IF NOT EXISTS users_updated_at ON users(updated_at)")
+        self._write_conn.commit()
+        self._read_conn = self._connect(db_path)
+        self._write_lock = threading.Lock()
+        self._read_lock = threading.Lock()
+        logger.info("SQLite user store opened at %s", db_path)
+
+    @staticmethod
+    def _connect(path: Path) -> sqlite3.Connection:
+        conn = sqlite3.connect(str(path), check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        return conn
+
+    def get(self, user_id: int) -> Optional[str]:
+        with self._read_lock:
+            row = self._read_conn.execute("SELECT data FROM users WHERE user_id = ?", (user_id,)).fetchone()
+        return row[0] if row else None
+
+    def put_many(self, items: Dict[int, str]) -> None:
+        now = time.time()
+        with self._write_lock:
+            with self._write_conn:
+                self._write_conn.executemany(
+                    "INSERT INTO users(user_id, data, updated_at) VALUES (?, ?, ?) "
+                    "ON CONFLICT(user_id) DO UPDATE SET data = excluded.data, updated_at = excluded.updated_at",
+                    [(user_id, raw, now) for user_id, raw in items.items()],
+                )
+
+    def delete(self, user_id: int) -> None:
+        with self._write_lock:
+            with self._write_conn:
+                self._write_conn.execute("DELETE FROM users WHERE user_id = ?", (user_id,))
+
+    def recent(self, limit: int) -> List[Tuple[int, str]]:
+        with self._read_lock:
+            rows = self._read_conn.execute(
+                "SELECT user_id, data FROM users ORDER BY updated_at DESC LIMIT ?", (limit,)
+            ).fetchall()
+        return [(int(user_id), data) for user_id, data in rows]
+
+    def close(self) -> None:
+        for conn in (self._read_conn, self._write_conn):
+            try:
+                conn.close()
+            except Exception as e:
+                logger.warning("Error closing SQLite connection: %s", e)
+
+
+class WriteBehindStore:
+    """Write-behind buffer in front of a ``UserStore``.
+
+    ``mark_dirty`` only records a reference to the live record; the periodic
+    flush serializes dirty records on the event loop (so they are not mutated
+    mid-serialization) and writes them in a worker thread.
+    """
+
+    def __init__(self, store: UserStore, flush_interval: float = 2.0, max_pending: int = 500) -> None:
+        self.store = store
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self._pending: Dict[int, Any] = {}
+        self._inflight: Dict[int, Any] = {}
+        self._task: Optional[asyncio.Task] = None
+        self._wakeup: Optional[asyncio.Event] = None
+        self._flush_lock: Optional[asyncio.Lock] = None
+        self._stopping = False
+
+    def mark_dirty(self, user_id: int, data: Any) -> None:
+        """Schedule the record for persistence."""
+        self._pending[user_id] = data
+        if self._wakeup is not None and len(self._pending) >= self.max_pending:
+            self._wakeup.set()
+
+    def _unflushed(self, user_id: int) -> Any:
+        data = self._pending.get(user_id)
+        return data if data is not None else self._inflight.get(user_id)
+
+    def load(self, user_id: int) -> Any:
+        """Return the record: unflushed live object first, then a dict decoded from the store."""
+        data = self._unflushed(user_id)
+        if data is not None:
+            return data
+        raw = self.store.get(user_id)
+        return decode_user(raw) if raw is not None else None
+
+    async def load_async(self, user_id: int) -> Any:
+        """Like ``load``, but reads the store in a worker thread so the event loop never waits on disk."""
+        data = self._unflushed(user_id)
+        if data is not None:
+            return data
+        raw = await asyncio.to_thread(self.store.get, user_id)
+        # Пока шло чтение, запись могла попасть в буфер — она свежее прочитанной
+        data = self._unflushed(user_id)
+        if data is not None:
+            return data
+        return decode_user(raw) if raw is not None else None
+
+    def recent(self, limit: int) -> Iterable[Tuple[int, Dict[str, Any]]]:
+        for user_id, raw in self.store.recent(limit):
+            try:
+                yield user_id, decode_user(raw)
+            except ValueError as e:
+                logger.warning("Skipping corrupt user record %s: %s", user_id, e)
+
+    @property
+    def pending_count(self) -> int:
+        return len(self._pending)
+
+    async def flush(self) -> int:
+        """Persist all dirty records; returns the number written."""
+        if self._flush_lock is None:
+            self._flush_lock = asyncio.Lock()
+        async with self._flush_lock:
+            if not self._pending:
+                return 0
+            self._inflight, self._pending = self._pending, {}
+            try:
+                items = {user_id: encode_user(data) for user_id, data in self._inflight.items()}
+                await asyncio.to_thread(self.store.put_many, items)
+            except Exception as e:
+                logger.error("User store flush failed (%s): %s; will retry", type(e).__name__, e)
+                # Возвращаем записи в очередь, не затирая более свежие отметки
+                for user_id, data in self._inflight.items():
+                    self._pending.setdefault(user_id, data)
+                return 0
+            finally:
+                self._inflight = {}
+            return len(items)
+
+    async def _run(self) -> None:
+        while not self._stopping:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            await self.flush()
+
+    def start(self) -> None:
+        """Start the background flush task on the running loop."""
+        if self._task is None:
+            self._wakeup = asyncio.Event()
+            self._flush_lock = asyncio.Lock()
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        """Stop the flush task, write remaining records and close the store."""
+        if self._task is not None:
+            # Даём текущей записи завершиться, а не отменяем её посреди транзакции
+            self._stopping = True
+            self._wakeup.set()
+            await self._task
+            self._task = None
+        await self.flush()
+        self.store.close()
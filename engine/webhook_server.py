@@ -0,0 +1,110 @@
+"""Single asyncio HTTP server for Telegram webhooks and service endpoints.
+
+Runs on the bot's own event loop (no extra thread) and serves:
+
+- ``POST <webhook path>`` — Telegram updates. The secret token header is
+  checked first; an accepted update is handed to ``on_update`` (which only
+  enqueues it) and acknowledged immediately, so Telegram never waits for a
+  turn to finish and does not redeliver;
+- ``GET /health`` — liveness;
+- ``GET /ready`` — readiness (``ready()``), 503 while starting or draining;
+- ``GET /metrics`` — JSON snapshot from ``metrics()``, only with
+  ``Authorization: Bearer <metrics token>``; without a metrics token the
+  endpoint is not served at all.
+
+Without a webhook path the server only serves the service endpoints
+(polling mode).
+"""
+
+import hmac
+import json
+import logging
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+from aiohttp import web
+
+logger = logging.getLogger(__name__)
+
+SECRET_HEADER = 'X-Telegram-Bot-Api-Secret-Token'
+
+
+class WebhookServer:
+    """aiohttp application bound to ``host:port``; ``start``/``stop`` are awaited by the bot."""
+
+    def __init__(
+        self,
+        host: str,
+        port: int,
+        on_update: Optional[Callable[[Dict[str, Any]], Awaitable[None]]] = None,
+        webhook_path: Optional[str] = None,
+        secret_token: Optional[str] = None,
+        ready: Callable[[], bool] = lambda: True,
+        metrics: Callable[[], Dict[str, Any]] = dict,
+        metrics_token: Optional[str] = None,
+    ) -> None:
+        if webhook_path is not None and (on_update is None or not secret_token):
+            raise ValueError("Webhook mode needs an update handler and a secret token")
+        self.host = host
+        self.port = port
+        self._on_update = on_update
+        self._secret = (secret_token or '').encode()
+        self._ready = ready
+        self._metrics = metrics
+        self._metrics_auth = f'Bearer {metrics_token}'.encode() if metrics_token else None
+        self._runner: Optional[web.AppRunner] = None
+        self.received = 0
+        self.rejected = 0
+
+        app = web.Application()
+        app.router.add_get('/health', self._health)
+        app.router.add_get('/ready', self._readiness)
+        if self._metrics_auth is not None:
+            app.router.add_get('/metrics', self._metrics_view)
+        if webhook_path is not None:
+            app.router.add_post(webhook_path, self._webhook)
+        self.app = app
+
+    async def start(self) -> None:
+        # access_log=None: health-чеки Fly приходят каждые 30 с и не нужны в логе
+        self._runner = web.AppRunner(self.app, access_log=None)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, self.host, self.port).start()
+        logger.info("HTTP server listening on %s:%d", self.host, self.port)
+
+    async def stop(self) -> None:
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+
+    async def _webhook(self, request: web.Request) -> web.Response:
+        token = request.headers.get(SECRET_HEADER, '').encode()
+        if not hmac.compare_digest(token, self._secret):
+            self.rejected += 1
+            return web.Response(status=403)
+        try:
+            data = await request.json()
+        except (json.JSONDecodeError, UnicodeDecodeError):
+            self.rejected += 1
+            return web.Response(status=400)
+        if not isinstance(data, dict):
+            self.rejected += 1
+            return web.Response(status=400)
+        self.received += 1
+        await self._on_update(data)
+        return web.Response()
+
+    async def _health(self, request: web.Request) -> web.Response:
+        return web.Response(text='OK')
+
+    async def _readiness(self, request: web.Request) -> web.Response:
+        if self._ready():
+            return web.Response(text='READY')
+        return web.Response(status=503, text='NOT READY')
+
+    async def _metrics_view(self, request: web.Request) -> web.Response:
+        auth = request.headers.get('Authorization', '').encode()
+        if not hmac.compare_digest(auth, self._metrics_auth):
+            return web.Response(status=401, headers={'WWW-Authenticate': 'Bearer'})
+        metrics = dict(self._metrics())
+        metrics['webhook'] = {'received': self.received, 'rejected': self.rejected}
+        return web.json_response(metrics, dumps=lambda obj: json.dumps(obj, ensure_ascii=False, default=str))